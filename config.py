@@ -26,6 +26,9 @@ REPO_NAME = os.getenv("REPO_NAME")
 
 DB_ENCRYPTED_PATH = os.path.join(WORKING_PATH, REPO_NAME, "92b33381-pl3-42a1-bee0-bbb9d132e83f.tmp")
 DB_DECRYPTED_PATH = os.path.join(WORKING_PATH, REPO_NAME, "bd.tmp")
+# Cada nueva generación se construye en un fichero propio junto a DB_DECRYPTED_PATH y lo sustituye
+# con un renombrado atómico; los workers se turnan para prepararla con este cerrojo
+DB_LOAD_LOCK_PATH = os.path.join(WORKING_PATH, "bd.lock")
 UPDATE_LOG_FILE = os.path.join(WORKING_PATH, "actualizar.txt")
 VERSION_FILE = os.path.join(WORKING_PATH, "version.txt")
 
@@ -13,6 +13,7 @@ from urllib.parse import unquote, urljoin
 
 logger = setup_logger(__name__)
 FICHIER_PREPARED_LINK_TTL = 15 * 24 * 60 * 60
+cache.namespace("realdebrid:1fichier:prepared:", ttl=FICHIER_PREPARED_LINK_TTL, priority=5, persist=True)
 FICHIER_PREPARED_INFLIGHT = {}
 FOLDER_HREF_REGEX = re.compile(r'<a href="([^"]+)">[^<]*<\/a>')
 WARP_RESTART_LOCK = asyncio.Lock()
@@ -42,7 +43,7 @@ class RealDebrid(BaseDebrid):
             return link
 
         cache_key = self._fichier_cache_key(link)
-        cached_link = cache.get(cache_key)
+        cached_link = await cache.get_async(cache_key)
         if cached_link:
             return cached_link
 
@@ -5,7 +5,7 @@ import os
 import re
 import shutil
 import time
-from datetime import datetime
+from datetime import datetime, timezone
 import sys
 
 import httpx
@@ -19,10 +19,17 @@ from starlette import status
 
 from debrid.get_debrid_service import get_debrid_service
 from metadata.tmdb import TMDB
-from utils.actualizarbd import comprobar_actualizacion_contenido, comprobar_actualizacion_addon, establecer_timestamp_arranque
+from utils.actualizarbd import (comprobar_actualizacion_contenido, comprobar_actualizacion_addon,
+                                establecer_timestamp_arranque, cerrar_cliente_feeds)
 from utils.bd import (setup_index,
-                      search_movies, search_tv_shows)
-from utils.cargarbd import check_and_download
+                      search_movies, search_tv_shows, bump_db_generation, db_generation, db_content,
+                      close_read_pool, get_links_metadata, DB_MEMORY_INDEX,
+                      build_memory_index, install_memory_index, materialize_detections,
+                      load_detections, install_detections, get_detection, publish_db,
+                      cache_generation, media_tag, changed_media_tags, published_db_changed,
+                      published_db_id)
+from utils.cargarbd import (check_and_download, content_fingerprint, last_changes, staged_db_path,
+                             acquire_db_load_lock, release_db_load_lock)
 from utils.detection import detect_quality, post_process_results, detect_languages, detect_quality_spec
 from utils.filter_results import filter_items
 from utils.logger import setup_logger
@@ -30,6 +37,7 @@ from utils.parse_config import parse_config
 from utils.stremio_parser import parse_to_debrid_stream
 from utils.string_encoding import decodeb64, encodeb64
 from utils.cache import cache  # Importamos nuestro cache nativo
+from utils.cache_backends import create_configured_tier
 
 from config import (
     VERSION,
@@ -62,6 +70,32 @@ warp_client = httpx.AsyncClient(timeout=30, proxy=WARP_PROXY_URL)
 
 FICHIER_STATUS_KEY = "rd_1fichier_status"
 STREAM_RESPONSE_TTL = 5 * 60
+# Ventana tras caducar en la que se sirve la respuesta obsoleta mientras se recalcula en segundo plano
+STREAM_RESPONSE_STALE_GRACE = int(os.getenv("STREAM_RESPONSE_STALE_GRACE", str(30 * 60)))
+STREAM_CATALOG_TTL = STREAM_RESPONSE_TTL
+LINK_METADATA_TTL = 60 * 60
+# Tiempo durante el que un enlace que no se pudo desrestringir se salta en las búsquedas
+NEGATIVE_LINK_TTL = int(os.getenv("NEGATIVE_LINK_TTL", str(15 * 60)))
+# Con 'true', al pedir un episodio se prepara en segundo plano el catálogo del siguiente
+NEXT_EPISODE_WARMUP = os.getenv("NEXT_EPISODE_WARMUP", "false").lower() == "true"
+# Espacios de caché calculados sobre la BD: se vacían al publicar una generación nueva
+DB_DEPENDENT_NAMESPACES = ("bd:search:", "stream:catalog:", "stream:response:")
+DB_RELOAD_INFLIGHT = {}
+STREAM_RESPONSE_INFLIGHT = {}
+STREAM_CATALOG_INFLIGHT = {}
+LINK_METADATA_SHARED_TUPLES = {}
+# Las respuestas de stream son baratas de perder frente a los enlaces de 1fichier preparados,
+# así que se desalojan antes; los metadatos de enlaces van compactados bajo 'link:meta:'.
+cache.namespace(
+    "stream:response:",
+    ttl=STREAM_RESPONSE_TTL,
+    max_bytes=32 * 1024 * 1024,
+    priority=0,
+    grace=STREAM_RESPONSE_STALE_GRACE,
+)
+cache.namespace("stream:catalog:", ttl=STREAM_CATALOG_TTL, max_bytes=32 * 1024 * 1024, priority=1)
+cache.namespace("link:dead:", ttl=NEGATIVE_LINK_TTL, max_entries=20000, priority=2)
+cache.namespace("link:meta:", ttl=LINK_METADATA_TTL, priority=1, persist=True)
 TORBOX_PENDING_VIDEO_PATH = os.path.join(ROOT_PATH, "assets", "torbox-descargando.mp4")
 TORBOX_PLAYBACK_INITIAL_POLL_INTERVAL = float(os.getenv("TORBOX_PLAYBACK_INITIAL_POLL_INTERVAL", "5"))
 TORBOX_PLAYBACK_MAX_POLL_INTERVAL = float(os.getenv("TORBOX_PLAYBACK_MAX_POLL_INTERVAL", "300"))
@@ -118,33 +152,93 @@ IS_DB_READY = False
 async def background_db_loader():
     """
     Tarea en segundo plano para descargar y preparar la base de datos.
+
+    Se usa al arrancar y en las recargas en caliente: la generación servida solo cambia
+    cuando la nueva está lista.
+
+    Returns:
+        bool: False si la carga falló; la BD servida, si la hay, sigue siendo la anterior.
     """
     global IS_DB_READY
     logger.update("Iniciando carga de base de datos en segundo plano...")
+    loop = asyncio.get_running_loop()
+    try:
+        # Si otro worker está preparando la BD se espera a que termine, sin bloquear el loop
+        await loop.run_in_executor(None, acquire_db_load_lock)
+    except Exception as e:
+        logger.error(f"No se pudo obtener el cerrojo de carga de la base de datos: {e}", exc_info=True)
+        return False
     try:
         # Ejecutar check_and_download en un executor para no bloquear el loop principal
         # ya que contiene muchas operaciones de E/S bloqueantes y CPU
-        loop = asyncio.get_running_loop()
         updated = await loop.run_in_executor(None, check_and_download)
         
         if updated:
-             # Si se actualizó, ejecutar setup_index también en executor por si acaso
-             await loop.run_in_executor(None, setup_index, DB_DECRYPTED_PATH)
-             logger.update("Base de datos actualizada y lista.")
+             logger.update("Base de datos actualizada.")
              if not IS_DEV:
                 asyncio.create_task(schedule_catalog_update_notification())
         else:
              logger.update("Base de datos verificada sin cambios.")
-             # Asegurar que setup_index se ejecute si ya existía la BD pero no se actualizó
-             if os.path.exists(DB_DECRYPTED_PATH):
-                 await loop.run_in_executor(None, setup_index, DB_DECRYPTED_PATH)
-        
+
+        # Una generación nueva se prepara entera en su propio fichero y solo se publica al final.
+        # La BD servida solo se prepara en sitio mientras aún no la lee nadie.
+        staged_path = staged_db_path()
+        staged = staged_path is not None
+        # Con varios workers solo uno prepara y publica la BD nueva; los demás la encuentran ya
+        # publicada (ya indexada y con sus detecciones) y solo tienen que cargarla
+        republished = IS_DB_READY and not staged and published_db_changed()
+        if IS_DB_READY and not staged and not republished:
+            return True
+        db_path = staged_path if staged else DB_DECRYPTED_PATH
+        memory_index = None
+        detections = None
+        if os.path.exists(db_path):
+            if not republished:
+                await loop.run_in_executor(None, setup_index, db_path)
+            try:
+                if not republished:
+                    await loop.run_in_executor(None, materialize_detections, db_path, staged)
+                detections = await loop.run_in_executor(None, load_detections, db_path)
+            except Exception as e:
+                logger.error(f"No se pudieron precalcular las detecciones, se calcularán por petición: {e}")
+            if DB_MEMORY_INDEX:
+                memory_index = await loop.run_in_executor(None, build_memory_index, db_path)
+
+        # Si solo se aplicaron parches .up sobre la BD ya servida, se sabe qué títulos cambiaron
+        changes = last_changes() if staged and updated and IS_DB_READY else None
+        content = await loop.run_in_executor(None, content_fingerprint)
+        if staged:
+            publish_db(staged_path)
+        bump_db_generation(keep_cache=changes is not None, content=content, db_file=published_db_id())
+        install_memory_index(memory_index)
+        install_detections(detections)
+        _invalidate_db_caches(changes)
+        # Las conexiones libres de la generación anterior se cierran ya; las ocupadas, al devolverse
+        await close_read_pool()
+        logger.update("Base de datos lista.")
         IS_DB_READY = True
         logger.info("✅ Sistema listo para recibir peticiones.")
+        return True
         
     except Exception as e:
         logger.error(f"Error crítico cargando la base de datos: {e}", exc_info=True)
         # Aquí podríamos decidir si reintentar o dejar el servicio en estado degradado
+        return False
+    finally:
+        release_db_load_lock()
+
+def _invalidate_db_caches(changes):
+    """
+    Invalida lo cacheado sobre la BD anterior: con los cambios conocidos, solo las entradas
+    etiquetadas con esos títulos; si no, todos los espacios que dependen de la BD.
+    """
+    if changes is None:
+        for prefix in DB_DEPENDENT_NAMESPACES:
+            cache.invalidate_namespace(prefix)
+        return
+    tags = changed_media_tags(changes)
+    removed = sum(cache.invalidate_tag(tag) for tag in tags)
+    logger.update(f"Caché invalidada para {len(tags)} títulos/episodios cambiados ({removed} entradas).")
 
 async def lifespan(app: FastAPI):
     """
@@ -163,6 +257,12 @@ async def lifespan(app: FastAPI):
         ]
         logger.info("Tareas programadas iniciadas.")
 
+    # Segundo nivel (disco o Redis): enlaces preparados, metadatos de enlaces y TMDB
+    # sobreviven al reinicio o se comparten entre workers
+    cache_tier = create_configured_tier()
+    if cache_tier:
+        cache.attach_tier(cache_tier)
+
     cache.set(FICHIER_STATUS_KEY, "up")
     logger.info(f"Estado inicial de 1fichier establecido a 'up' por defecto.")
 
@@ -171,8 +271,8 @@ async def lifespan(app: FastAPI):
     establecer_timestamp_arranque("ADDON")
     logger.update("Timestamps de arranque establecidos.")
 
-    # Lanzar la carga de BD en background
-    asyncio.create_task(background_db_loader())
+    # Lanzar la carga de BD en background; comparte tarea con las recargas en caliente
+    _start_once(DB_RELOAD_INFLIGHT, "contenido", background_db_loader)
     
     logger.info("Servidor HTTP iniciado. La carga de datos continúa en segundo plano.")
     yield
@@ -180,6 +280,9 @@ async def lifespan(app: FastAPI):
         for cron in getattr(app.state, "cron_jobs", []):
             cron.stop()
         logger.info("Tareas programadas detenidas.")
+    cache.detach_tier()
+    await close_read_pool()
+    await cerrar_cliente_feeds()
     logger.info("La aplicación se está cerrando.")
 
 # Configuración de la aplicación FastAPI
@@ -268,16 +371,19 @@ async def get_manifest():
 # --- Lógica Principal del Addon ---
 
 
-async def _get_unrestricted_link(debrid_service, original_link: str) -> dict | None:
+async def _get_unrestricted_link(debrid_service, original_link: str, failures: dict | None = None) -> dict | None:
     """
     Obtiene el enlace de descarga directa (sin restricciones) de un servicio Debrid.
     Devuelve un diccionario con metadatos: {'download': str, 'filename': str, 'filesize': int}
+    Si se pasa `failures`, anota en él el motivo del fallo bajo el enlace original.
     """
     debrid_name = type(debrid_service).__name__
     try:
         unrestricted_data = await debrid_service.unrestrict_link(original_link)
         
         if not unrestricted_data:
+            if failures is not None:
+                failures[original_link] = "el servicio no devolvió datos"
             return None
 
         result = {
@@ -308,6 +414,8 @@ async def _get_unrestricted_link(debrid_service, original_link: str) -> dict | N
                 logger.info("Devolviendo el enlace de descarga estándar de la API de Real-Debrid.")
 
         elif debrid_name == "AllDebrid":
+            if unrestricted_data.get('status') == 'error' and failures is not None:
+                failures[original_link] = (unrestricted_data.get('error') or {}).get('message', "error de AllDebrid")
             data = unrestricted_data.get('data', {})
             result['download'] = data.get('link')
             result['filename'] = data.get('filename')
@@ -323,26 +431,130 @@ async def _get_unrestricted_link(debrid_service, original_link: str) -> dict | N
                 result['download_state'] = unrestricted_data.get('download_state')
             
         if not result['download'] and not result.get('pending'):
+            if failures is not None:
+                failures.setdefault(original_link, "respuesta sin enlace de descarga")
             return None
 
         return result
     except Exception as e:
         logger.error(f"Error al desrestringir el enlace {original_link} con {debrid_name}: {e}")
+        if failures is not None:
+            failures[original_link] = f"error: {e}"
         return None
 
 
 def _stream_response_cache_key(config_str: str, stream_type: str, stream_id: str, fichier_status: str) -> str:
-    try:
-        db_version = os.stat(DB_DECRYPTED_PATH).st_mtime_ns
-    except OSError:
-        db_version = 0
-
     key_hash = hashlib.sha256(
-        f"{config_str}:{stream_type}:{stream_id}:{fichier_status}:{db_version}".encode("utf-8")
+        f"{config_str}:{stream_type}:{stream_id}:{fichier_status}:{cache_generation()}".encode("utf-8")
     ).hexdigest()
     return f"stream:response:{key_hash}"
 
 
+def _stream_catalog_cache_key(debrid_name: str, stream_type: str, stream_id: str) -> str:
+    # Sin datos del usuario: lo comparten todos los usuarios del mismo servicio Debrid
+    return f"stream:catalog:{debrid_name}:{stream_type}:{stream_id}:{cache_generation()}"
+
+
+def _media_cache_tag(media) -> str:
+    # Misma etiqueta que las búsquedas en la BD: un parche que toque el título invalida ambas
+    if media.type == "movie":
+        return media_tag("movie", media.id)
+    return media_tag("series", media.id, media.season, media.episode)
+
+
+def _cache_for_generation(key: str, value, ttl: int, media, generation: int) -> None:
+    # Lo calculado sobre una generación ya sustituida no se guarda: sus etiquetas ya pudieron invalidarse
+    if generation == db_generation():
+        cache.set(key, value, ttl=ttl, tags=(_media_cache_tag(media),))
+
+
+def _link_digest(link: str) -> str:
+    # Claves de tamaño fijo aunque el enlace sea largo
+    return hashlib.blake2b(link.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _link_metadata_cache_key(link: str) -> str:
+    return f"link:meta:{_link_digest(link)}"
+
+
+def _shared_tuple(values) -> tuple:
+    # Las combinaciones de idiomas y especificaciones son pocas: todas las entradas comparten la misma tupla
+    values = tuple(values or ())
+    return LINK_METADATA_SHARED_TUPLES.setdefault(values, values)
+
+
+def _pack_link_metadata(data: dict) -> tuple:
+    """
+    Convierte los metadatos de un enlace en una tupla compacta para la caché.
+
+    La calidad se interna y las listas de idiomas y especificaciones se sustituyen por
+    tuplas compartidas, así que por enlace solo se guarda lo que de verdad cambia.
+    """
+    return (
+        data['filesize'],
+        sys.intern(data['quality'] or ''),
+        data['nombre_fichero'],
+        _shared_tuple(data.get('languages')),
+        _shared_tuple(data.get('quality_spec')),
+    )
+
+
+def _unpack_link_metadata(packed: tuple | None) -> dict | None:
+    if packed is None:
+        return None
+    filesize, quality, nombre_fichero, languages, quality_spec = packed
+    return {
+        'filesize': filesize,
+        'quality': quality,
+        'nombre_fichero': nombre_fichero,
+        'languages': list(languages),
+        'quality_spec': list(quality_spec),
+    }
+
+
+def _get_link_metadata(link: str, prefetched: dict | None = None) -> dict | None:
+    """
+    Recupera los metadatos de un enlace guardados por cualquier usuario, o None.
+
+    Args:
+        link (str): El enlace.
+        prefetched (dict, optional): Resultado de una precarga con `cache.get_many_async`; si se
+            indica, una clave ausente cuenta como fallo sin volver a consultar la caché.
+    """
+    key = _link_metadata_cache_key(link)
+    if prefetched is not None:
+        return _unpack_link_metadata(prefetched.get(key))
+    return _unpack_link_metadata(cache.get(key))
+
+
+def _set_link_metadata(link: str, data: dict) -> None:
+    cache.set(_link_metadata_cache_key(link), _pack_link_metadata(data), ttl=LINK_METADATA_TTL)
+
+
+def _dead_link_cache_key(debrid_name: str, link: str) -> str:
+    return f"link:dead:{debrid_name}:{_link_digest(link)}"
+
+
+def _mark_dead_links(debrid_name: str, failures: dict) -> None:
+    """Guarda en la caché negativa los enlaces que no se pudieron desrestringir, con su motivo."""
+    for link, reason in failures.items():
+        logger.info(f"Enlace marcado como caído en {debrid_name} durante {NEGATIVE_LINK_TTL}s: {link} ({reason})")
+        cache.set(_dead_link_cache_key(debrid_name, link), reason, ttl=NEGATIVE_LINK_TTL)
+
+
+def _skip_dead_links(debrid_name: str, search_results: list) -> list:
+    """Quita de los resultados de búsqueda los enlaces que están en la caché negativa del servicio."""
+    links = [result[0] if isinstance(result, tuple) else result for result in search_results]
+    dead = cache.get_many([_dead_link_cache_key(debrid_name, link) for link in links])
+    if not dead:
+        return search_results
+    logger.info(f"Se omiten {len(dead)} enlaces caídos recientemente en {debrid_name}.")
+    return [
+        result for result, link in zip(search_results, links)
+        if _dead_link_cache_key(debrid_name, link) not in dead
+    ]
+
+
 
 async def _process_single_link(
     debrid_service,
@@ -352,11 +564,13 @@ async def _process_single_link(
     db_audio,
     db_info,
     db_metadata_text=None,
-    unrestrict_task_cache=None
+    unrestrict_task_cache=None,
+    unrestrict_failures=None,
+    prefetched_metadata=None
 ):
     debrid_name = type(debrid_service).__name__
     # 1. Intentar recuperar metadatos del caché global (independiente del usuario)
-    cached_metadata = cache.get(link)
+    cached_metadata = _get_link_metadata(link, prefetched_metadata)
 
     if debrid_name == "TorBox":
         metadata_source = db_metadata_text or " ".join(filter(None, [db_calidad, db_audio, db_info]))
@@ -377,9 +591,13 @@ async def _process_single_link(
             'debrid_pending': not is_cached,
             'streamable': is_cached,
         }
+        materialized = None if cached_metadata else get_detection(db_calidad, db_audio, db_info)
         if cached_metadata:
             data['languages'] = cached_metadata.get('languages')
             data['quality_spec'] = cached_metadata.get('quality_spec')
+        elif materialized:
+            data['languages'] = list(materialized[1])
+            data['quality_spec'] = list(materialized[2]) if materialized[2] else None
         elif metadata_source:
             data['languages'] = detect_languages(metadata_source)
             data['quality_spec'] = detect_quality_spec(metadata_source)
@@ -418,11 +636,13 @@ async def _process_single_link(
         if unrestrict_task_cache is not None:
             unrestricted_task = unrestrict_task_cache.get(link)
             if not unrestricted_task:
-                unrestricted_task = asyncio.create_task(_get_unrestricted_link(debrid_service, link))
+                unrestricted_task = asyncio.create_task(
+                    _get_unrestricted_link(debrid_service, link, unrestrict_failures)
+                )
                 unrestrict_task_cache[link] = unrestricted_task
             unrestricted_info = await unrestricted_task
         else:
-            unrestricted_info = await _get_unrestricted_link(debrid_service, link)
+            unrestricted_info = await _get_unrestricted_link(debrid_service, link, unrestrict_failures)
 
         if unrestricted_info:
             data['filesize'] = unrestricted_info.get('filesize', 0)
@@ -437,8 +657,13 @@ async def _process_single_link(
                 and "1fichier.com" in link.lower()
             )
             metadata_source = " ".join(filter(None, [db_calidad, db_audio, db_info])) if uses_prepared_1fichier else ""
+            # Detección precalculada al cargar la BD; las regex quedan como respaldo
+            materialized = get_detection(db_calidad, db_audio, db_info) if metadata_source else None
 
-            detected_quality = detect_quality(metadata_source) if metadata_source else None
+            if materialized:
+                detected_quality = materialized[0]
+            else:
+                detected_quality = detect_quality(metadata_source) if metadata_source else None
 
             if not detected_quality and data['nombre_fichero']:
                 detected_quality = detect_quality(data['nombre_fichero'])
@@ -449,19 +674,16 @@ async def _process_single_link(
             data['quality'] = detected_quality or data['quality']
 
             metadata_for_detection = metadata_source or data['nombre_fichero']
-            if metadata_for_detection:
+            if materialized:
+                data['languages'] = list(materialized[1])
+                data['quality_spec'] = list(materialized[2]) if materialized[2] else None
+            elif metadata_for_detection:
                 data['languages'] = detect_languages(metadata_for_detection)
                 data['quality_spec'] = detect_quality_spec(metadata_for_detection)
 
             # Guardamos SOLO los metadatos en el caché global
             if data['nombre_fichero'] and data['filesize'] > 0:
-                cache.set(link, {
-                    'filesize': data['filesize'],
-                    'quality': data['quality'],
-                    'nombre_fichero': data['nombre_fichero'],
-                    'languages': data.get('languages'),
-                    'quality_spec': data.get('quality_spec')
-                }, ttl=3600) # Cache por 1 hora
+                _set_link_metadata(link, data)
 
             # Devolvemos el link final para este usuario (aunque en get_results no se usa para generar la lista)
             return (link, data, True if data['debrid_pending'] else final_link_user)
@@ -497,20 +719,133 @@ async def get_results(config_str: str, stream_type: str, stream_id: str):
     # Recuperamos estado de 1fichier del cache
     fichier_status_rd = cache.get(FICHIER_STATUS_KEY) or "up"
     response_cache_key = _stream_response_cache_key(config_str, stream_type, stream_id, fichier_status_rd)
-    cached_response = cache.get(response_cache_key)
+    def build_response():
+        return _build_stream_response(
+            config_str, config, stream_type, stream_id, fichier_status_rd, response_cache_key, start_time
+        )
+
+    cached_response, is_stale = cache.get_stale(response_cache_key)
     if cached_response is not None:
-        logger.info(f"Resultados recuperados del cache de stream. Tiempo total: {time.time() - start_time:.2f}s")
+        if is_stale:
+            # Se sirve la respuesta obsoleta al momento y se recalcula una sola vez en segundo plano
+            _start_once(STREAM_RESPONSE_INFLIGHT, response_cache_key, build_response)
+            logger.info(f"Resultados obsoletos servidos del cache de stream; refrescando en segundo plano. Tiempo total: {time.time() - start_time:.2f}s")
+        else:
+            logger.info(f"Resultados recuperados del cache de stream. Tiempo total: {time.time() - start_time:.2f}s")
         return cached_response
 
+    # Peticiones idénticas simultáneas esperan al resultado de la primera en vez de repetir el trabajo
+    return await _coalesce(STREAM_RESPONSE_INFLIGHT, response_cache_key, build_response)
+
+
+def _start_once(inflight: dict, key: str, factory) -> asyncio.Task:
+    """
+    Devuelve la tarea en curso para la clave o lanza una nueva con `factory`.
+    La tarea se olvida al terminar y sus errores se registran aunque nadie la espere.
+    """
+    task = inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(factory())
+        inflight[key] = task
+
+        def _forget(done_task):
+            if inflight.get(key) is done_task:
+                del inflight[key]
+            if not done_task.cancelled() and done_task.exception():
+                logger.error(f"Error en la tarea compartida {key}: {done_task.exception()}")
+
+        task.add_done_callback(_forget)
+    return task
+
+
+def _coalesce(inflight: dict, key: str, factory):
+    """
+    Ejecuta una única tarea por clave; las llamadas concurrentes con la misma clave la comparten.
+    La tarea sigue aunque se cancele quien la esperaba, para no perjudicar al resto.
+    """
+    return asyncio.shield(_start_once(inflight, key, factory))
+
+
+async def _build_stream_response(config_str, config, stream_type, stream_id, fichier_status_rd, response_cache_key, start_time):
+    """
+    Construye la respuesta de stream de un usuario a partir de la capa de catálogo compartida
+    y la guarda en caché.
+    """
+    generation = db_generation()
+    debrid_service = get_debrid_service(config, http_client, warp_client)
+    debrid_name = type(debrid_service).__name__
+
+    catalog_cache_key = _stream_catalog_cache_key(debrid_name, stream_type, stream_id)
+    catalog = cache.get(catalog_cache_key)
+    if catalog is None:
+        catalog = await _coalesce(
+            STREAM_CATALOG_INFLIGHT,
+            catalog_cache_key,
+            lambda: _build_stream_catalog(config, debrid_service, stream_type, stream_id, catalog_cache_key),
+        )
+    else:
+        logger.info(f"Catálogo de enlaces recuperado del cache compartido para {stream_type} {stream_id}.")
+
+    if catalog is None:
+        return {"streams": []}
+
+    if NEXT_EPISODE_WARMUP and stream_type == "series":
+        _warm_next_episode(config, debrid_service, stream_id)
+
+    media = catalog["media"]
+    if not catalog["results"]:
+        logger.info(f"No se encontraron resultados para {media.type} {stream_id}. Tiempo total: {time.time() - start_time:.2f}s")
+        return {"streams": []}
+
+    streams = _render_user_streams(catalog, config_str, config, debrid_name, fichier_status_rd)
+
+    logger.info(f"Resultados encontrados. Tiempo total: {time.time() - start_time:.2f}s")
+    response = {"streams": streams}
+    _cache_for_generation(response_cache_key, response, STREAM_RESPONSE_TTL, media, generation)
+    return response
+
+
+def _next_episode_id(stream_id: str) -> str | None:
+    parts = stream_id.split(":")
+    if len(parts) != 3 or not parts[1].isdigit() or not parts[2].isdigit():
+        return None
+    return f"{parts[0]}:{parts[1]}:{int(parts[2]) + 1}"
+
+
+def _warm_next_episode(config, debrid_service, stream_id: str) -> None:
+    """
+    Lanza en segundo plano la construcción del catálogo del episodio siguiente, para que el
+    siguiente clic de quien ve la serie seguida encuentre los metadatos de enlaces ya en caché.
+    """
+    next_id = _next_episode_id(stream_id)
+    if next_id is None:
+        return
+    next_key = _stream_catalog_cache_key(type(debrid_service).__name__, "series", next_id)
+    if cache.get(next_key) is not None:
+        return
+    _start_once(
+        STREAM_CATALOG_INFLIGHT,
+        next_key,
+        lambda: _build_stream_catalog(config, debrid_service, "series", next_id, next_key),
+    )
+
+
+async def _build_stream_catalog(config, debrid_service, stream_type, stream_id, catalog_cache_key):
+    """
+    Calcula la parte de la respuesta que no depende del usuario: metadatos de TMDB, búsqueda en
+    la BD y enlaces válidos en el servicio Debrid con su tamaño, calidad e idiomas, ordenados
+    por tamaño. Es común a todos los usuarios del mismo servicio.
+
+    Returns:
+        dict | None: {'media': Media, 'results': [(link, data), ...]} o None si no hay metadatos.
+    """
+    generation = db_generation()
     metadata_provider = TMDB(config, http_client)
     media = await metadata_provider.get_metadata(stream_id, stream_type)
 
     if not media:
         logger.warning(f"No se pudo obtener metadatos para {stream_type} {stream_id}")
-        return {"streams": []}
-
-    debrid_service = get_debrid_service(config, http_client, warp_client)
-    debrid_name = type(debrid_service).__name__
+        return None
 
     if media.type == "movie":
         search_results = await search_movies(media.id)
@@ -518,11 +853,29 @@ async def get_results(config_str: str, stream_type: str, stream_id: str):
         search_results = await search_tv_shows(media.id, media.season, media.episode)
 
     if not search_results:
-        logger.info(f"No se encontraron resultados para {media.type} {stream_id}. Tiempo total: {time.time() - start_time:.2f}s")
-        return {"streams": []}
+        catalog = {"media": media, "results": []}
+        _cache_for_generation(catalog_cache_key, catalog, STREAM_CATALOG_TTL, media, generation)
+        return catalog
+
+    debrid_name = type(debrid_service).__name__
+    # En TorBox los enlaces no se desrestringen al buscar, así que no hay caché negativa que aplicar
+    if debrid_name != "TorBox":
+        search_results = _skip_dead_links(debrid_name, search_results)
+
+    # Precarga en bloque los metadatos de enlaces: con un segundo nivel es una sola ida y vuelta,
+    # fuera del bucle de eventos, y los fallos no se vuelven a consultar enlace por enlace
+    prefetched_metadata = await cache.get_many_async([
+        _link_metadata_cache_key(result[0] if isinstance(result, tuple) else result)
+        for result in search_results
+    ])
+
+    # Los resultados que solo traen el enlace reciben sus metadatos en una consulta por lotes
+    bare_links = [result for result in search_results if not isinstance(result, tuple)]
+    bare_metadata = await get_links_metadata(bare_links, media.type) if bare_links else {}
 
     tasks = []
     unrestrict_task_cache = {}
+    unrestrict_failures = {}
     for result in search_results:
         if isinstance(result, tuple):
             link, db_calidad, db_audio, db_info = result
@@ -530,7 +883,7 @@ async def get_results(config_str: str, stream_type: str, stream_id: str):
         else:
             link = result
             db_calidad = db_audio = db_info = ""
-            db_metadata_text = None
+            db_metadata_text = bare_metadata.get(link)
         
         tasks.append(_process_single_link(
             debrid_service,
@@ -540,10 +893,17 @@ async def get_results(config_str: str, stream_type: str, stream_id: str):
             db_audio,
             db_info,
             db_metadata_text,
-            unrestrict_task_cache
+            unrestrict_task_cache,
+            unrestrict_failures,
+            prefetched_metadata
         ))
 
     processed_results = await asyncio.gather(*tasks)
+
+    # Solo se marcan como caídos si algún otro enlace se desrestringió bien en esta misma búsqueda:
+    # así un fallo de la cuenta del usuario (clave inválida, servicio caído) no afecta a los demás
+    if unrestrict_failures and len(unrestrict_task_cache) > len(unrestrict_failures):
+        _mark_dead_links(debrid_name, unrestrict_failures)
     
     results_data = []
     
@@ -558,19 +918,33 @@ async def get_results(config_str: str, stream_type: str, stream_id: str):
             
         # IMPORTANTE: Si es válido (sea True o link), lo añadimos
         # Antes el filtro era implícito porque final_link era string
-        
-        filesize_gb = (data.get('filesize') or 0) / (1024 ** 3)
-        if 'maxSize' in config and filesize_gb > int(config['maxSize']):
-            continue
-        if "selectedQualityExclusion" in config and data.get("quality") in config["selectedQualityExclusion"]:
-            continue
-            
         results_data.append((link, data))
 
     results_data.sort(key=lambda x: x[1].get('filesize') or 0, reverse=True)
 
+    catalog = {"media": media, "results": results_data}
+    # Si ningún enlace fue válido puede deberse a la cuenta Debrid de este usuario; no se comparte
+    if results_data:
+        _cache_for_generation(catalog_cache_key, catalog, STREAM_CATALOG_TTL, media, generation)
+    return catalog
+
+
+def _render_user_streams(catalog, config_str, config, debrid_name, fichier_status_rd):
+    """
+    Aplica sobre el catálogo compartido lo que depende del usuario: filtros de tamaño y calidad,
+    URL de playback con su configuración y formato final para Stremio.
+    """
+    media = catalog["media"]
     streams_unfiltered = []
-    for link, data in results_data:
+    for link, shared_data in catalog["results"]:
+        filesize_gb = (shared_data.get('filesize') or 0) / (1024 ** 3)
+        if 'maxSize' in config and filesize_gb > int(config['maxSize']):
+            continue
+        if "selectedQualityExclusion" in config and shared_data.get("quality") in config["selectedQualityExclusion"]:
+            continue
+
+        # Copia por usuario: post_process_results modifica el diccionario
+        data = dict(shared_data)
         # Codificamos el enlace ORIGINAL, no el unrestricteado
         encoded_link = encodeb64(link)
         encoded_file_name = encodeb64(data.get('nombre_fichero', 'unknown'))
@@ -580,11 +954,7 @@ async def get_results(config_str: str, stream_type: str, stream_id: str):
 
     streams = filter_items(streams_unfiltered, media, config=config)
     parse_to_debrid_stream(streams, config, media, debrid_name, fichier_is_up=(fichier_status_rd == "up"))
-
-    logger.info(f"Resultados encontrados. Tiempo total: {time.time() - start_time:.2f}s")
-    response = {"streams": streams}
-    cache.set(response_cache_key, response, ttl=STREAM_RESPONSE_TTL)
-    return response
+    return streams
 
 
 async def _handle_playback(config_str: str, query: str, file_name) -> str:
@@ -673,19 +1043,47 @@ async def trigger_render_restart():
         logger.error(f"Error en la respuesta de Render ({e.response.status_code}): {e.response.text}")
         return False
 
+async def recargar_bd():
+    """
+    Carga en caliente una nueva versión del contenido sin reiniciar el servicio.
+
+    Mientras se prepara se sigue sirviendo la BD anterior. Al publicar la generación nueva, el
+    cargador invalida solo la caché que depende de lo que cambió.
+    """
+    inicio = datetime.now(timezone.utc)
+    generation = db_generation()
+    logger.update("Recargando la base de datos en caliente...")
+    if not await background_db_loader():
+        logger.warning("La recarga en caliente falló; se reintentará en la próxima comprobación.")
+        return
+    # Los commits posteriores al inicio de la recarga se detectarán en la próxima comprobación
+    establecer_timestamp_arranque("CONTENIDO", inicio)
+    if db_generation() != generation:
+        logger.update(f"Recarga en caliente completada: generación {db_generation()}.")
+
 async def actualizar_bd():
     """
-    Tarea programada que comprueba si hay nuevas versiones y reinicia el servicio si es necesario.
-    Compara el timestamp del último commit remoto con la hora de arranque del servidor.
+    Tarea programada que comprueba si hay nuevas versiones.
+    Compara el timestamp del último commit remoto con la hora de arranque del servidor:
+    el contenido nuevo se recarga en caliente y el código nuevo reinicia el servicio.
     """
     contenido_actualizado = await comprobar_actualizacion_contenido()
     addon_actualizado = await comprobar_actualizacion_addon()
+    if not contenido_actualizado and IS_DB_READY and published_db_changed():
+        # Otro worker ya descargó y publicó el commit nuevo y movió la marca de tiempo compartida
+        logger.update("Tarea programada: otro worker publicó una nueva versión del CONTENIDO.")
+        contenido_actualizado = True
+
+    if contenido_actualizado and not addon_actualizado:
+        logger.update("Tarea programada: Nueva versión de CONTENIDO detectada (commit posterior al arranque).")
+        # Si ya hay una recarga en marcha, esta comprobación no lanza otra
+        _start_once(DB_RELOAD_INFLIGHT, "contenido", recargar_bd)
+        return
 
-    if contenido_actualizado or addon_actualizado:
+    if addon_actualizado:
         if contenido_actualizado:
             logger.update("Tarea programada: Nueva versión de CONTENIDO detectada (commit posterior al arranque).")
-        if addon_actualizado:
-            logger.update("Tarea programada: Nueva versión de ADDON detectada (commit posterior al arranque).")
+        logger.update("Tarea programada: Nueva versión de ADDON detectada (commit posterior al arranque).")
         
         logger.update("Iniciando secuencia de reinicio...")
         
@@ -715,6 +1113,21 @@ async def fecha_actualizacion():
     except FileNotFoundError:
         return {"error": f"El archivo {UPDATE_LOG_FILE} no existe."}
 
+@app.get("/cache")
+async def estadisticas_cache():
+    """Devuelve los contadores de aciertos, fallos, desalojos y bytes de cada espacio de la caché."""
+    return cache.stats()
+
+@app.get("/generacion")
+async def generacion_bd():
+    """
+    Devuelve la generación de la base de datos cargada por este worker y el contenido que sirve.
+
+    El contador es propio de cada proceso; para saber si todos los workers sirven lo mismo hay
+    que comparar `contenido` (commit y hash de la BD cargada).
+    """
+    return {"generacion": db_generation(), "contenido": db_content(), "pid": os.getpid(), "lista": IS_DB_READY}
+
 @app.get("/version")
 async def version_actualizacion():
     """Devuelve el contenido del archivo de versión."""
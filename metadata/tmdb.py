@@ -6,6 +6,7 @@ from models.series import Series
 from utils.cache import cache
 
 TMDB_METADATA_TTL = 24 * 60 * 60
+cache.namespace("tmdb:metadata:", ttl=TMDB_METADATA_TTL, max_entries=20000, priority=3, persist=True)
 
 class TMDB(MetadataProvider):
     def __init__(self, config, http_client: httpx.AsyncClient):
@@ -27,7 +28,7 @@ class TMDB(MetadataProvider):
     async def get_metadata(self, id, media_type):
         self.logger.info("Getting metadata for " + media_type + " with id " + id)
         cache_key = self._metadata_cache_key(id, media_type)
-        cached_metadata = cache.get(cache_key)
+        cached_metadata = await cache.get_async(cache_key)
         if cached_metadata:
             return cached_metadata
 
@@ -0,0 +1,248 @@
+import base64
+import gc
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+import unittest
+from unittest.mock import patch
+
+from utils import bd
+from utils.cache import CacheManager, cache
+
+LINKS = 5000
+# Las comparaciones de tiempos dependen de la máquina: solo se exigen con RUN_TIMING_BENCHMARKS=1,
+# si no, se informa de las cifras
+RUN_TIMING_BENCHMARKS = os.getenv("RUN_TIMING_BENCHMARKS") == "1"
+# Par clave/IV fijo con el que los enlaces cifrados empiezan por 'btof' como en producción,
+# para no depender de la clave configurada en ENCRYPTION_KEY_B64
+TEST_KEY = bytes(range(16, 32))
+TEST_IV = bytes.fromhex("00000000000000000000000000a22f47")
+
+
+def _link_metadata(index):
+    return {
+        "filesize": (index + 1) * 1024 ** 2,
+        "quality": "1080p",
+        "nombre_fichero": f"Pelicula.{index}.2024.1080p.WEB-DL.SPANISH.mkv",
+        "languages": ["es", "en"],
+        "quality_spec": ["WEB-DL", "H264"],
+    }
+
+
+def _link(index):
+    return f"https://1fichier.com/?{index:020d}&af=3601079&lg=es"
+
+
+def _bytes_per_link(store):
+    """Mide con tracemalloc la memoria que retiene la caché tras guardar LINKS enlaces."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        cache = CacheManager(max_entries=LINKS * 2, max_bytes=1024 ** 3)
+        before = tracemalloc.get_traced_memory()[0]
+        for index in range(LINKS):
+            store(cache, _link(index), _link_metadata(index))
+        gc.collect()
+        after = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return (after - before) / LINKS
+
+
+def _report_timing(test, faster, message):
+    """Exige la mejora de tiempos con RUN_TIMING_BENCHMARKS; si no, solo muestra las cifras."""
+    if RUN_TIMING_BENCHMARKS:
+        test.assertTrue(faster, message)
+    else:
+        print(f"{test.id()}: {message}")
+
+
+class LinkMetadataMemoryBenchmark(unittest.TestCase):
+    def test_compact_link_metadata_uses_less_memory_per_link(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        cache_namespace = lambda cache: cache.namespace("link:meta:", ttl=main.LINK_METADATA_TTL)
+
+        def store_raw(cache, link, data):
+            # Representación anterior: el enlace completo como clave y un dict como valor
+            cache.set(link, data, ttl=main.LINK_METADATA_TTL)
+
+        def store_compact(cache, link, data):
+            cache_namespace(cache)
+            cache.set(main._link_metadata_cache_key(link), main._pack_link_metadata(data), ttl=main.LINK_METADATA_TTL)
+
+        raw = _bytes_per_link(store_raw)
+        compact = _bytes_per_link(store_compact)
+
+        self.assertLess(compact, raw * 0.8, f"antes: {raw:.0f} B/enlace, después: {compact:.0f} B/enlace")
+
+    def test_compact_link_metadata_round_trips(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        data = _link_metadata(7)
+
+        unpacked = main._unpack_link_metadata(main._pack_link_metadata(data))
+
+        self.assertEqual(unpacked, data)
+        self.assertEqual(len(main._link_metadata_cache_key(_link(7))), len(main._link_metadata_cache_key("x")))
+
+
+def _build_links_db(path, titles=2000, links_per_title=5):
+    connection = sqlite3.connect(path)
+    connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+    connection.execute(
+        "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+    )
+    connection.executemany(
+        "INSERT INTO enlaces_pelis VALUES (?, ?, ?, ?, ?)",
+        (
+            (_link(title * links_per_title + n), "1080p", "SPANISH DDP5.1", "WEB-DL", str(title))
+            for title in range(titles) for n in range(links_per_title)
+        ),
+    )
+    connection.executemany(
+        "INSERT INTO enlaces_series VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (_link(title * 100 + episode), "720p", "SPANISH", "WEBRip", str(title), 1, episode)
+            for title in range(titles // 10) for episode in range(1, 11)
+        ),
+    )
+    connection.commit()
+    connection.close()
+
+
+class DbReadModeBenchmark(unittest.IsolatedAsyncioTestCase):
+    LOOKUPS = 200
+
+    async def asyncTearDown(self):
+        await bd.close_read_pool()
+
+    async def _measure(self, mode):
+        with patch("utils.bd.DB_READ_MODE", mode):
+            await bd.close_read_pool()
+            bd.bump_db_generation()
+            cache.clear()
+            results = []
+            start = time.perf_counter()
+            for index in range(self.LOOKUPS):
+                results.append(await bd.search_movies(str(index)))
+                results.append(await bd.search_tv_shows(str(index % 200), 1, index % 10 + 1))
+            elapsed = time.perf_counter() - start
+            await bd.close_read_pool()
+        return elapsed / (self.LOOKUPS * 2), results
+
+    async def test_immutable_read_mode_is_not_slower_than_normal_mode(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "bd.tmp")
+            _build_links_db(db_path)
+            bd.setup_index(db_path)
+
+            with patch("utils.bd.DB_DECRYPTED_PATH", db_path):
+                normal, normal_results = await self._measure("normal")
+                immutable, immutable_results = await self._measure("immutable")
+
+        self.assertEqual(immutable_results, normal_results)
+        self.assertTrue(all(immutable_results))
+        _report_timing(
+            self, immutable < normal * 1.5,
+            f"normal: {normal * 1e6:.0f} µs/búsqueda, inmutable: {immutable * 1e6:.0f} µs/búsqueda",
+        )
+
+
+def _encrypt_link(link):
+    from Crypto.Cipher import AES
+    from utils import crypt
+
+    encrypted = AES.new(crypt.key, AES.MODE_OFB, crypt.iv).encrypt(link.encode("utf-8"))
+    return base64.urlsafe_b64encode(encrypted).decode("ascii")
+
+
+def _decryptbd_per_row(db_path):
+    """Implementación anterior: un cifrador y un UPDATE por enlace."""
+    from Crypto.Cipher import AES
+    from utils import crypt
+
+    conn = sqlite3.connect(db_path)
+    cursor = conn.cursor()
+    try:
+        for table in ["enlaces_pelis", "enlaces_series"]:
+            cursor.execute(f"SELECT rowid, link FROM {table} WHERE link LIKE 'btof%'")
+            for rowid, link in cursor.fetchall():
+                cipher = AES.new(crypt.key, AES.MODE_OFB, crypt.iv)
+                decrypted = cipher.decrypt(base64.urlsafe_b64decode(link)).decode("utf-8")
+                cursor.execute(f"UPDATE {table} SET link = ? WHERE rowid = ?", (decrypted, rowid))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+class DecryptBenchmark(unittest.TestCase):
+    LINKS = 20000
+
+    def setUp(self):
+        patcher = patch.multiple("utils.crypt", key=TEST_KEY, iv=TEST_IV, _KEYSTREAM=b"")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _encrypted_db(self, path):
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE enlaces_pelis (link TEXT, tmdb TEXT)")
+        connection.execute("CREATE TABLE enlaces_series (link TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)")
+        connection.executemany(
+            "INSERT INTO enlaces_pelis VALUES (?, ?)",
+            ((_encrypt_link(_link(index) + "x" * (index % 40)), str(index)) for index in range(self.LINKS)),
+        )
+        connection.executemany(
+            "INSERT INTO enlaces_series VALUES (?, '1', 1, ?)",
+            ((_encrypt_link(_link(index)), index) for index in range(self.LINKS // 4)),
+        )
+        connection.commit()
+        connection.close()
+
+    def _links(self, path):
+        connection = sqlite3.connect(path)
+        try:
+            return (
+                connection.execute("SELECT link FROM enlaces_pelis ORDER BY rowid").fetchall(),
+                connection.execute("SELECT link FROM enlaces_series ORDER BY rowid").fetchall(),
+            )
+        finally:
+            connection.close()
+
+    def test_keystream_decryption_matches_per_row_decryption(self):
+        from utils.crypt import decryptbd
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            before_path = os.path.join(tmpdir, "per_row.tmp")
+            after_path = os.path.join(tmpdir, "keystream.tmp")
+            self._encrypted_db(before_path)
+            shutil.copy(before_path, after_path)
+
+            start = time.perf_counter()
+            _decryptbd_per_row(before_path)
+            per_row = time.perf_counter() - start
+
+            start = time.perf_counter()
+            decryptbd(after_path)
+            keystream = time.perf_counter() - start
+
+            expected = self._links(before_path)
+            decrypted = self._links(after_path)
+
+        self.assertEqual(decrypted, expected)
+        self.assertEqual(decrypted[0][5], (_link(5) + "x" * 5,))
+        _report_timing(
+            self, keystream < per_row * 0.8,
+            f"por fila: {per_row * 1e3:.0f} ms, flujo de clave: {keystream * 1e3:.0f} ms",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,470 @@
+import asyncio
+import fnmatch
+import os
+import socketserver
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+
+from models.movie import Movie
+from utils.cache import CacheManager
+from utils.cache_backends import RedisCacheTier, SQLiteCacheTier, create_disk_tier, create_redis_tier
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    """Servidor mínimo con protocolo RESP2 para los comandos que usa RedisCacheTier."""
+
+    def handle(self):
+        while True:
+            command = self._read_command()
+            if command is None:
+                return
+            self.server.commands.append(command[0].upper())
+            self.wfile.write(self._execute(command))
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        parts = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            parts.append(self.rfile.read(length + 2)[:-2])
+        return [parts[0].decode()] + parts[1:]
+
+    def _execute(self, command):
+        name, args = command[0].upper(), command[1:]
+        data = self.server.data
+        now = time.time()
+        for key, (_, expire) in list(data.items()):
+            if expire is not None and expire <= now:
+                del data[key]
+
+        if name == "PING":
+            return b"+PONG\r\n"
+        if name == "CLIENT":
+            return b"+OK\r\n"
+        if name == "SET":
+            expire = None
+            if len(args) > 3 and args[2].upper() == b"PX":
+                expire = now + int(args[3]) / 1000
+            data[args[0]] = (args[1], expire)
+            return b"+OK\r\n"
+        if name == "GET":
+            return self._bulk(data.get(args[0], (None, None))[0])
+        if name == "MGET":
+            return b"*%d\r\n" % len(args) + b"".join(self._bulk(data.get(key, (None, None))[0]) for key in args)
+        if name == "DEL":
+            return b":%d\r\n" % sum(1 for key in args if data.pop(key, None) is not None)
+        if name == "SCAN":
+            pattern = args[args.index(b"MATCH") + 1].decode() if b"MATCH" in args else "*"
+            keys = [key for key in data if fnmatch.fnmatchcase(key.decode(), pattern)]
+            return b"*2\r\n$1\r\n0\r\n*%d\r\n" % len(keys) + b"".join(self._bulk(key) for key in keys)
+        return b"-ERR unknown command\r\n"
+
+    def _bulk(self, value):
+        if value is None:
+            return b"$-1\r\n"
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+
+
+class HungRedisHandler(socketserver.StreamRequestHandler):
+    """Acepta la conexión y lee los comandos, pero nunca responde: un Redis colgado."""
+
+    def handle(self):
+        self.server.released.wait()
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler=FakeRedisHandler):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.data = {}
+        self.commands = []
+        self.released = threading.Event()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.released.set()
+        self.shutdown()
+        self.server_close()
+
+
+class CacheEngineTest(unittest.TestCase):
+    def test_least_recently_used_entry_is_evicted_when_entry_cap_is_reached(self):
+        engine = CacheManager(max_entries=2, max_bytes=1024 * 1024)
+
+        engine.set("a", 1)
+        engine.set("b", 2)
+        engine.get("a")
+        engine.set("c", 3)
+
+        self.assertEqual(engine.get("a"), 1)
+        self.assertIsNone(engine.get("b"))
+        self.assertEqual(engine.get("c"), 3)
+        self.assertEqual(len(engine), 2)
+
+    def test_byte_budget_evicts_oldest_entries(self):
+        engine = CacheManager(max_entries=100, max_bytes=3000)
+
+        for index in range(10):
+            engine.set(f"key:{index}", "x" * 500)
+
+        self.assertLessEqual(engine.size_bytes, 3000)
+        self.assertIsNone(engine.get("key:0"))
+        self.assertEqual(engine.get("key:9"), "x" * 500)
+
+    def test_expired_entries_are_purged_without_being_read(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        now = time.time()
+
+        with patch("utils.cache.time.time", return_value=now):
+            engine.set("old", "value", ttl=10)
+        with patch("utils.cache.time.time", return_value=now + 11):
+            engine.set("new", "value", ttl=10)
+
+        self.assertEqual(len(engine), 1)
+        self.assertEqual(engine.get("new"), "value")
+
+    def test_overwritten_key_keeps_its_new_expiry(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        now = time.time()
+
+        with patch("utils.cache.time.time", return_value=now):
+            engine.set("key", "first", ttl=10)
+        with patch("utils.cache.time.time", return_value=now + 5):
+            engine.set("key", "second", ttl=100)
+        with patch("utils.cache.time.time", return_value=now + 20):
+            engine.set("other", "value", ttl=10)
+            self.assertEqual(engine.get("key"), "second")
+
+    def test_delete_releases_accounted_bytes(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+
+        engine.set("key", {"filesize": 1, "nombre_fichero": "file.mkv"})
+        engine.delete("key")
+
+        self.assertEqual(engine.size_bytes, 0)
+        self.assertIsNone(engine.get("key"))
+
+
+class CacheNamespaceTest(unittest.TestCase):
+    def test_keys_use_the_longest_matching_namespace_ttl(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("stream:", ttl=10)
+        engine.namespace("stream:response:", ttl=1000)
+        now = time.time()
+
+        with patch("utils.cache.time.time", return_value=now):
+            engine.set("stream:response:abc", "response")
+            engine.set("stream:other", "other")
+        with patch("utils.cache.time.time", return_value=now + 100):
+            self.assertEqual(engine.get("stream:response:abc"), "response")
+            self.assertIsNone(engine.get("stream:other"))
+
+    def test_low_priority_namespace_is_evicted_before_expensive_entries(self):
+        engine = CacheManager(max_entries=5, max_bytes=1024 * 1024)
+        engine.namespace("stream:response:", priority=0)
+        engine.namespace("realdebrid:1fichier:prepared:", priority=5)
+
+        engine.set("realdebrid:1fichier:prepared:1", "https://1fichier.com/?prepared")
+        for index in range(20):
+            engine.set(f"stream:response:{index}", {"streams": []})
+
+        self.assertEqual(engine.get("realdebrid:1fichier:prepared:1"), "https://1fichier.com/?prepared")
+        self.assertEqual(len(engine), 5)
+        self.assertEqual(engine.stats()["stream:response:"]["evictions"], 16)
+
+    def test_namespace_cap_only_evicts_its_own_entries(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("bd:search:", max_entries=2)
+
+        engine.set("https://host/file", {"filesize": 1})
+        for index in range(5):
+            engine.set(f"bd:search:{index}", [])
+
+        self.assertEqual(engine.stats()["bd:search:"]["entries"], 2)
+        self.assertEqual(engine.get("https://host/file"), {"filesize": 1})
+
+    def test_grace_keeps_expired_entries_for_stale_reads_only(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("stream:response:", ttl=10, grace=100)
+        now = time.time()
+
+        with patch("utils.cache.time.time", return_value=now):
+            engine.set("stream:response:abc", "response")
+        with patch("utils.cache.time.time", return_value=now + 50):
+            self.assertIsNone(engine.get("stream:response:abc"))
+            self.assertEqual(engine.get_stale("stream:response:abc"), ("response", True))
+        with patch("utils.cache.time.time", return_value=now + 200):
+            engine.set("stream:response:other", "other")
+            self.assertEqual(engine.get_stale("stream:response:abc"), (None, False))
+
+        self.assertEqual(engine.stats()["stream:response:"]["stale_hits"], 1)
+
+    def test_namespace_counters_track_hits_misses_and_bytes(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("tmdb:metadata:")
+
+        engine.set("tmdb:metadata:1", "movie")
+        engine.get("tmdb:metadata:1")
+        engine.get("tmdb:metadata:1")
+        engine.get("tmdb:metadata:2")
+        stats = engine.stats()["tmdb:metadata:"]
+
+        self.assertEqual(stats["hits"], 2)
+        self.assertEqual(stats["misses"], 1)
+        self.assertGreater(stats["bytes"], 0)
+        self.assertEqual(stats["bytes"], engine.size_bytes)
+
+    def test_invalidate_namespace_only_drops_its_own_entries(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("bd:search:")
+        engine.namespace("link:dead:")
+
+        engine.set("bd:search:movie:1:1", [("https://host/a",)])
+        engine.set("bd:search:movie:1:2", [])
+        engine.set("link:dead:rd:abc", True)
+
+        removed = engine.invalidate_namespace("bd:search:")
+
+        self.assertEqual(removed, 2)
+        self.assertIsNone(engine.get("bd:search:movie:1:1"))
+        self.assertTrue(engine.get("link:dead:rd:abc"))
+        self.assertEqual(len(engine), 1)
+        self.assertEqual(engine.stats()["bd:search:"]["bytes"], 0)
+
+
+    def test_invalidate_tag_drops_tagged_entries_across_namespaces(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("bd:search:")
+        engine.namespace("stream:catalog:")
+
+        engine.set("bd:search:movie:1:10", [], tags=("bd:movie:10",))
+        engine.set("stream:catalog:RealDebrid:movie:tt10:1", {}, tags=("bd:movie:10",))
+        engine.set("bd:search:movie:1:11", [], tags=("bd:movie:11",))
+
+        removed = engine.invalidate_tag("bd:movie:10")
+
+        self.assertEqual(removed, 2)
+        self.assertIsNone(engine.get("stream:catalog:RealDebrid:movie:tt10:1"))
+        self.assertEqual(engine.get("bd:search:movie:1:11"), [])
+        self.assertEqual(engine.invalidate_tag("bd:movie:10"), 0)
+
+class DiskTierTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "cache.sqlite3")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _engine(self):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("realdebrid:1fichier:prepared:", ttl=3600, persist=True)
+        engine.namespace("tmdb:metadata:", ttl=3600, persist=True)
+        engine.namespace("stream:response:", ttl=60)
+        return engine
+
+    def test_restarted_cache_comes_up_warm_from_disk(self):
+        engine = self._engine()
+        engine.attach_tier(create_disk_tier(self.path, flush_interval=60))
+        engine.set("realdebrid:1fichier:prepared:abc", "https://1fichier.com/?prepared")
+        engine.set("tmdb:metadata:abc", Movie(1, ["Title"], "2026", "es-ES"))
+        engine.set("stream:response:abc", {"streams": []})
+        engine.detach_tier()
+
+        restarted = self._engine()
+        restarted.attach_tier(create_disk_tier(self.path, flush_interval=60))
+
+        self.assertEqual(len(restarted), 2)
+        self.assertEqual(restarted.get("realdebrid:1fichier:prepared:abc"), "https://1fichier.com/?prepared")
+        self.assertEqual(restarted.get("tmdb:metadata:abc").titles, ["Title"])
+        self.assertIsNone(restarted.get("stream:response:abc"))
+        restarted.detach_tier()
+
+    def test_memory_miss_reads_through_to_disk(self):
+        tier = SQLiteCacheTier(self.path)
+        tier.set_many([("tmdb:metadata:abc", "movie", time.time() + 3600)])
+
+        engine = self._engine()
+        engine.attach_tier(tier, warm=False)
+
+        self.assertEqual(engine.get("tmdb:metadata:abc"), "movie")
+        self.assertEqual(engine.stats()["tmdb:metadata:"]["tier_hits"], 1)
+        engine.detach_tier()
+
+    def test_async_memory_miss_reads_disk_outside_the_event_loop_thread(self):
+        tier = SQLiteCacheTier(self.path)
+        tier.set_many([
+            ("tmdb:metadata:abc", "movie", time.time() + 3600),
+            ("realdebrid:1fichier:prepared:abc", "https://1fichier.com/?prepared", time.time() + 3600),
+        ])
+        read_threads = []
+        read_disk = tier.get_many
+
+        def recording_get_many(keys):
+            read_threads.append(threading.get_ident())
+            return read_disk(keys)
+
+        engine = self._engine()
+        engine.attach_tier(tier, warm=False)
+
+        async def lookups():
+            return (
+                await engine.get_async("tmdb:metadata:abc"),
+                await engine.get_async("realdebrid:1fichier:prepared:abc"),
+                await engine.get_async("tmdb:metadata:abc"),
+                threading.get_ident(),
+            )
+
+        with patch.object(tier, "get_many", recording_get_many):
+            movie, prepared, from_memory, loop_thread = asyncio.run(lookups())
+
+        self.assertEqual((movie, prepared, from_memory), ("movie", "https://1fichier.com/?prepared", "movie"))
+        self.assertEqual(len(read_threads), 2)
+        self.assertNotIn(loop_thread, read_threads)
+        engine.detach_tier()
+
+    def test_expired_disk_entries_are_ignored(self):
+        tier = SQLiteCacheTier(self.path)
+        tier.set_many([("tmdb:metadata:old", "movie", time.time() - 1)])
+
+        engine = self._engine()
+        engine.attach_tier(tier)
+
+        self.assertEqual(len(engine), 0)
+        self.assertIsNone(engine.get("tmdb:metadata:old"))
+        engine.detach_tier()
+
+    def test_delete_is_written_behind_to_disk(self):
+        engine = self._engine()
+        engine.attach_tier(create_disk_tier(self.path, flush_interval=60))
+        engine.set("tmdb:metadata:abc", "movie")
+        engine.detach_tier()
+
+        engine.attach_tier(create_disk_tier(self.path, flush_interval=60))
+        engine.delete("tmdb:metadata:abc")
+        engine.detach_tier()
+
+        tier = SQLiteCacheTier(self.path)
+        self.assertEqual(tier.get_many(["tmdb:metadata:abc"]), {})
+        tier.close()
+
+
+class RedisTierTest(unittest.TestCase):
+    def _worker(self, url):
+        engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+        engine.namespace("tmdb:metadata:", ttl=3600, persist=True)
+        engine.namespace("stream:response:", ttl=60)
+        engine.attach_tier(RedisCacheTier(url), warm=False)
+        return engine
+
+    def test_hits_are_shared_between_workers(self):
+        with FakeRedisServer() as server:
+            first = self._worker(server.url)
+            second = self._worker(server.url)
+
+            first.set("tmdb:metadata:abc", Movie(1, ["Title"], "2026", "es-ES"))
+            first.set("stream:response:abc", {"streams": []})
+
+            self.assertEqual(second.get("tmdb:metadata:abc").titles, ["Title"])
+            self.assertIsNone(second.get("stream:response:abc"))
+            self.assertEqual(second.stats()["tmdb:metadata:"]["tier_hits"], 1)
+            first.detach_tier()
+            second.detach_tier()
+
+    def test_bulk_get_uses_a_single_round_trip(self):
+        with FakeRedisServer() as server:
+            writer = self._worker(server.url)
+            for index in range(5):
+                writer.set(f"tmdb:metadata:{index}", index)
+            reader = self._worker(server.url)
+            server.commands.clear()
+
+            found = reader.get_many([f"tmdb:metadata:{index}" for index in range(6)])
+
+            self.assertEqual(found, {f"tmdb:metadata:{index}": index for index in range(5)})
+            self.assertEqual([command for command in server.commands if command != "CLIENT"], ["MGET"])
+            writer.detach_tier()
+            reader.detach_tier()
+
+    def test_write_behind_pipelines_sets_with_server_side_expiry(self):
+        with FakeRedisServer() as server:
+            engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+            engine.namespace("tmdb:metadata:", ttl=3600, persist=True)
+            engine.attach_tier(create_redis_tier(server.url, flush_interval=60), warm=False)
+
+            engine.set("tmdb:metadata:a", "a")
+            engine.set("tmdb:metadata:b", "b")
+            engine.detach_tier()
+
+            self.assertEqual(sorted(server.data), [b"ndk:tmdb:metadata:a", b"ndk:tmdb:metadata:b"])
+            self.assertTrue(all(expire is not None for _, expire in server.data.values()))
+
+    def test_hung_tier_does_not_block_the_event_loop_on_persisted_misses(self):
+        from metadata.tmdb import TMDB
+
+        class EmptyTMDBResponse:
+            def raise_for_status(self):
+                return None
+
+            def json(self):
+                return {"movie_results": []}
+
+        class EmptyTMDBClient:
+            async def get(self, url):
+                return EmptyTMDBResponse()
+
+        async def lookups(engine):
+            gaps = []
+
+            async def ticker():
+                for _ in range(20):
+                    start = time.perf_counter()
+                    await asyncio.sleep(0.02)
+                    gaps.append(time.perf_counter() - start)
+
+            tmdb = TMDB({"tmdbApi": "tmdb"}, EmptyTMDBClient())
+            with patch("metadata.tmdb.cache", engine):
+                await asyncio.gather(ticker(), *(tmdb.get_metadata(f"tt{index}", "movie") for index in range(5)))
+            return max(gaps)
+
+        with FakeRedisServer(HungRedisHandler) as server:
+            engine = self._worker(server.url)
+            longest_gap = asyncio.run(lookups(engine))
+            engine.detach_tier()
+
+        # Cada lectura del nivel colgado tarda lo que socket_timeout (0,5 s), pero en otro hilo
+        self.assertLess(longest_gap, 0.25)
+
+    def test_restarted_worker_is_warmed_from_the_shared_tier(self):
+        with FakeRedisServer() as server:
+            writer = self._worker(server.url)
+            writer.set("tmdb:metadata:abc", "movie")
+
+            engine = CacheManager(max_entries=100, max_bytes=1024 * 1024)
+            engine.namespace("tmdb:metadata:", ttl=3600, persist=True)
+            engine.attach_tier(RedisCacheTier(server.url))
+
+            self.assertEqual(len(engine), 1)
+            writer.clear()
+            self.assertEqual(server.data, {})
+            writer.detach_tier()
+            engine.detach_tier()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,6 @@
 import asyncio
 import hashlib
+import json
 import os
 import sqlite3
 import tempfile
@@ -149,6 +150,9 @@ class PerformanceOptimizationsTest(unittest.IsolatedAsyncioTestCase):
     def tearDown(self):
         self.env_patcher.stop()
 
+    async def asyncTearDown(self):
+        await bd.close_read_pool()
+
     async def test_1fichier_preparation_is_cached_per_link(self):
         debrid = FakeRealDebrid()
 
@@ -348,7 +352,7 @@ class PerformanceOptimizationsTest(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(first.titles, ["Cached Movie"])
         self.assertEqual(client.get_calls, 1)
 
-    async def test_movie_search_results_are_cached_by_db_version(self):
+    async def test_movie_search_results_are_cached_by_db_generation(self):
         with tempfile.TemporaryDirectory() as tmpdir:
             db_path = os.path.join(tmpdir, "bd.tmp")
             connection = sqlite3.connect(db_path)
@@ -375,15 +379,512 @@ class PerformanceOptimizationsTest(unittest.IsolatedAsyncioTestCase):
                 )
                 connection.commit()
                 connection.close()
-                future = time.time() + 10
-                os.utime(db_path, (future, future))
+                with patch("utils.bd.os.stat", side_effect=AssertionError("stat on search path")):
+                    still_cached = await bd.search_movies("123")
+                bd.bump_db_generation()
 
                 refreshed = await bd.search_movies("123")
 
         self.assertEqual(first, [("https://1fichier.com/?abc", "1080p", "SPANISH", "WEB-DL")])
         self.assertEqual(second, first)
+        self.assertEqual(still_cached, first)
         self.assertEqual(len(refreshed), 2)
 
+    async def test_search_connections_are_pooled_per_db_generation(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "bd.tmp")
+            connection = sqlite3.connect(db_path)
+            connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+            connection.execute("INSERT INTO enlaces_pelis VALUES ('https://host/a', '1080p', 'SPANISH', '', '1')")
+            connection.commit()
+            connection.close()
+
+            real_connect = bd.aiosqlite.connect
+            with patch("utils.bd.DB_DECRYPTED_PATH", db_path), \
+                    patch("utils.bd.aiosqlite.connect", side_effect=real_connect) as connect:
+                await bd.search_movies("1")
+                await bd.search_movies("2")
+                await bd.search_movies("3")
+                opened_before_swap = connect.call_count
+
+                bd.bump_db_generation()
+                refreshed = await bd.search_movies("1")
+
+                with self.assertRaises(sqlite3.OperationalError):
+                    async with bd.get_cursor() as cursor:
+                        await cursor.execute("DELETE FROM enlaces_pelis")
+                await bd.close_read_pool()
+
+        self.assertEqual(opened_before_swap, 1)
+        self.assertEqual(connect.call_count, 2)
+        self.assertEqual(refreshed, [("https://host/a", "1080p", "SPANISH", "")])
+
+    async def test_links_metadata_is_fetched_in_one_async_batch(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "bd.tmp")
+            connection = sqlite3.connect(db_path)
+            connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+            connection.executemany("INSERT INTO enlaces_pelis VALUES (?, ?, ?, ?, ?)", [
+                ("https://host/a", "1080p", "SPANISH", "WEB-DL", "1"),
+                ("https://host/b", "720p", "ENGLISH", "WEBRip", "1"),
+            ])
+            connection.commit()
+            connection.close()
+
+            with patch("utils.bd.DB_DECRYPTED_PATH", db_path):
+                metadata = await bd.get_links_metadata(
+                    ["https://host/a", "https://host/b", "https://host/missing", "https://host/a"], "movie"
+                )
+
+        self.assertEqual(metadata, {
+            "https://host/a": "('1080p', 'SPANISH', 'WEB-DL')",
+            "https://host/b": "('720p', 'ENGLISH', 'WEBRip')",
+        })
+
+    async def test_memory_index_answers_searches_for_its_generation_only(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "bd.tmp")
+            connection = sqlite3.connect(db_path)
+            connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+            connection.execute(
+                "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+            )
+            connection.executemany("INSERT INTO enlaces_pelis VALUES (?, ?, ?, ?, ?)", [
+                ("https://host/a", "1080p", "SPANISH", "WEB-DL", "1"),
+                ("https://host/b", "1080p", "SPANISH", "WEB-DL", "1"),
+            ])
+            connection.execute("INSERT INTO enlaces_series VALUES ('https://host/s', '720p', 'SPANISH', '', '9', 1, 2)")
+            connection.commit()
+            connection.close()
+
+            with patch("utils.bd.DB_DECRYPTED_PATH", db_path):
+                expected_movies = await bd.search_movies("1")
+                expected_episode = await bd.search_tv_shows("9", "1", "2")
+
+                index = bd.build_memory_index(db_path)
+                bd.bump_db_generation()
+                bd.install_memory_index(index)
+                try:
+                    with patch("utils.bd.get_cursor", side_effect=AssertionError("sqlite lookup")):
+                        movies = await bd.search_movies(1)
+                        episode = await bd.search_tv_shows(9, 1, 2)
+                        missing = await bd.search_movies("404")
+
+                    bd.bump_db_generation()
+                    after_swap = await bd.search_movies("1")
+                finally:
+                    bd.install_memory_index(None)
+
+        self.assertEqual(movies, expected_movies)
+        self.assertEqual(episode, expected_episode)
+        self.assertEqual(missing, [])
+        self.assertEqual(after_swap, expected_movies)
+        self.assertIs(index.movies["1"][0][1], index.movies["1"][1][1])
+        self.assertGreater(index.size_bytes(), 0)
+
+    async def test_season_prefetch_answers_following_episodes_from_one_query(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "bd.tmp")
+            connection = sqlite3.connect(db_path)
+            connection.execute(
+                "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+            )
+            connection.executemany("INSERT INTO enlaces_series VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                (f"https://host/e{episode}", "1080p", "SPANISH", "", "9", 1, episode) for episode in (1, 2, 3)
+            ])
+            connection.commit()
+            connection.close()
+
+            real_get_cursor = bd.get_cursor
+            with patch("utils.bd.DB_DECRYPTED_PATH", db_path), patch("utils.bd.SEASON_PREFETCH", True), \
+                    patch("utils.bd.get_cursor", side_effect=real_get_cursor) as get_cursor:
+                episodes = [await bd.search_tv_shows("9", 1, episode) for episode in (1, 2, 3, 4)]
+
+        self.assertEqual(get_cursor.call_count, 1)
+        self.assertEqual(episodes[1], [("https://host/e2", "1080p", "SPANISH", "")])
+        self.assertEqual(episodes[3], [])
+
+    async def test_next_episode_catalog_is_warmed_in_background(self):
+        import config
+        config.IS_DEV = True
+        import main
+        from models.series import Series
+
+        requested = []
+
+        class SeriesTMDB:
+            def __init__(self, config, http_client):
+                pass
+
+            async def get_metadata(self, stream_id, stream_type):
+                requested.append(stream_id)
+                _, season, episode = stream_id.split(":")
+                return Series("9", ["Show"], int(season), int(episode), [])
+
+        encoded_config = encodeb64('{"service": "realdebrid", "debridKey": "rd", "tmdbApi": "tmdb"}')
+        with patch("main.IS_DB_READY", True), patch("main.NEXT_EPISODE_WARMUP", True), \
+                patch("main.TMDB", SeriesTMDB), patch("main.search_tv_shows", AsyncMock(return_value=[])):
+            await main.get_results(encoded_config, "series", "tt9:1:1.json")
+            await asyncio.gather(*main.STREAM_CATALOG_INFLIGHT.values())
+
+            next_key = main._stream_catalog_cache_key("RealDebrid", "series", "tt9:1:2")
+            self.assertIsNotNone(cache.get(next_key))
+            await main.get_results(encoded_config, "series", "tt9:1:2.json")
+            await asyncio.gather(*main.STREAM_CATALOG_INFLIGHT.values())
+
+        self.assertEqual(requested.count("tt9:1:2"), 1)
+        self.assertIn("tt9:1:3", requested)
+
+    async def test_materialized_detections_replace_regex_work_when_serving(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        combinations = [
+            ("1080p", "SPANISH DDP5.1", "WEB-DL"),
+            ("2160p HDR", "MULTI", "BluRay"),
+            ("", None, "CAM"),
+        ]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "bd.tmp")
+            connection = sqlite3.connect(db_path)
+            connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+            connection.execute(
+                "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+            )
+            connection.executemany(
+                "INSERT INTO enlaces_pelis VALUES (?, ?, ?, ?, '1')",
+                [(f"https://1fichier.com/?{n}", *combination) for n, combination in enumerate(combinations)],
+            )
+            connection.commit()
+            connection.close()
+
+            bd.materialize_detections(db_path)
+            detections = bd.load_detections(db_path)
+        bd.bump_db_generation()
+        bd.install_detections(detections)
+
+        for calidad, audio, info in combinations:
+            text = " ".join(filter(None, [calidad, audio, info]))
+            quality, languages, specs = bd.get_detection(calidad, audio, info)
+            self.assertEqual(quality, detect_quality(text))
+            self.assertEqual(list(languages), detect_languages(text))
+            self.assertEqual(list(specs) if specs else None, detect_quality_spec(text))
+
+        class StubRealDebrid:
+            config = {}
+
+        StubRealDebrid.__name__ = "RealDebrid"
+        unrestricted = {"download": "https://download", "filename": "file.mkv", "filesize": 1024 ** 3}
+        with patch("main._get_unrestricted_link", AsyncMock(return_value=unrestricted)), \
+                patch("main.detect_languages", side_effect=AssertionError("regex on serving path")), \
+                patch("main.detect_quality_spec", side_effect=AssertionError("regex on serving path")):
+            _, data, _ = await main._process_single_link(
+                StubRealDebrid(), "https://1fichier.com/?0", {}, "1080p", "SPANISH DDP5.1", "WEB-DL",
+            )
+
+        self.assertEqual(data["quality"], "1080p")
+        self.assertEqual(data["languages"], ["es"])
+        self.assertEqual(data["quality_spec"], ["WEBDL"])
+
+        bd.bump_db_generation()
+        self.assertIsNone(bd.get_detection("1080p", "SPANISH DDP5.1", "WEB-DL"))
+
+    async def test_new_db_generation_is_built_aside_and_swapped_atomically(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        def links_db(path, link):
+            connection = sqlite3.connect(path)
+            connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+            connection.execute(
+                "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+            )
+            connection.execute("INSERT INTO enlaces_pelis VALUES (?, '1080p', 'SPANISH', 'WEB-DL', '1')", (link,))
+            connection.commit()
+            connection.close()
+
+        def file_digest(path):
+            with open(path, "rb") as handle:
+                return hashlib.sha256(handle.read()).hexdigest()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            live_path = os.path.join(tmpdir, "bd.tmp")
+            staging_path = os.path.join(tmpdir, "bd.next.tmp")
+            links_db(live_path, "https://host/old")
+            bd.setup_index(live_path)
+            live_digest = file_digest(live_path)
+            built_on = []
+            real_setup_index = main.setup_index
+
+            def check_and_download():
+                links_db(staging_path, "https://host/new")
+                return True
+
+            def setup_index(db_path):
+                built_on.append(db_path)
+                real_setup_index(db_path)
+                # La BD servida no se toca mientras se construye la nueva
+                self.assertEqual(file_digest(live_path), live_digest)
+
+            with patch("utils.bd.DB_DECRYPTED_PATH", live_path), patch("main.DB_DECRYPTED_PATH", live_path), \
+                    patch("main.staged_db_path", return_value=staging_path), patch("main.IS_DB_READY", True), \
+                    patch("utils.cargarbd.DB_LOAD_LOCK_PATH", os.path.join(tmpdir, "bd.lock")), \
+                    patch("main.check_and_download", check_and_download), patch("main.setup_index", setup_index):
+                bd.bump_db_generation()
+                generation = bd.db_generation()
+                async with bd.get_cursor() as cursor:
+                    await main.background_db_loader()
+                    # Una conexión abierta antes del cambio sigue leyendo la generación anterior
+                    await cursor.execute(bd.MOVIE_SEARCH_SQL, ("1",))
+                    in_flight = await cursor.fetchall()
+                after_swap = await bd.search_movies("1")
+
+            staged_left = os.path.exists(staging_path)
+
+        self.assertEqual(built_on, [staging_path])
+        self.assertFalse(staged_left)
+        self.assertEqual(in_flight, [("https://host/old", "1080p", "SPANISH", "WEB-DL")])
+        self.assertEqual(after_swap, [("https://host/new", "1080p", "SPANISH", "WEB-DL")])
+        self.assertEqual(bd.db_generation(), generation + 1)
+
+    async def test_up_patch_only_invalidates_the_titles_it_touches(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        def links_db(path, rows):
+            connection = sqlite3.connect(path)
+            connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+            connection.execute(
+                "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+            )
+            connection.executemany("INSERT INTO enlaces_pelis VALUES (?, '1080p', 'SPANISH', 'WEB-DL', ?)", rows)
+            connection.commit()
+            connection.close()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            live_path = os.path.join(tmpdir, "bd.tmp")
+            staging_path = os.path.join(tmpdir, "bd.next.tmp")
+            links_db(live_path, [("https://host/a", "10"), ("https://host/b", "11")])
+
+            def check_and_download():
+                links_db(staging_path, [("https://host/a2", "10"), ("https://host/b", "11")])
+                return True
+
+            with patch("utils.bd.DB_DECRYPTED_PATH", live_path), patch("main.DB_DECRYPTED_PATH", live_path), \
+                    patch("main.staged_db_path", return_value=staging_path), patch("main.IS_DB_READY", True), \
+                    patch("utils.cargarbd.DB_LOAD_LOCK_PATH", os.path.join(tmpdir, "bd.lock")), \
+                    patch("main.check_and_download", check_and_download), \
+                    patch("main.last_changes", return_value={("movie", "10", None, None)}):
+                bd.bump_db_generation()
+                await bd.search_movies("10")
+                untouched = await bd.search_movies("11")
+
+                await main.background_db_loader()
+
+                with patch("utils.bd.get_cursor", side_effect=AssertionError("search cache miss")):
+                    still_cached = await bd.search_movies("11")
+                refreshed = await bd.search_movies("10")
+
+        self.assertEqual(still_cached, untouched)
+        self.assertEqual(refreshed, [("https://host/a2", "1080p", "SPANISH", "WEB-DL")])
+
+    def test_up_file_records_the_rows_it_touches(self):
+        from utils import cargarbd
+
+        script = (
+            "INSERT OR REPLACE INTO enlaces_pelis VALUES ('btofnew', '1080p', '', '', '10');"
+            "INSERT OR REPLACE INTO enlaces_series VALUES ('btofep', '720p', '', '', '20', 1, 3);"
+            "DELETE FROM enlaces_pelis WHERE link = 'btofold';"
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            connection = sqlite3.connect(os.path.join(tmpdir, "92b33381-pl3-42a1-bee0-bbb9d132e83f.tmp"))
+            connection.execute(
+                "CREATE TABLE enlaces_pelis (link TEXT PRIMARY KEY, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, "
+                "FLAG INTEGER DEFAULT 0, enlace_modificado TEXT DEFAULT '')"
+            )
+            connection.execute(
+                "CREATE TABLE enlaces_series (link TEXT PRIMARY KEY, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, "
+                "temporada INTEGER, episodio INTEGER, FLAG INTEGER DEFAULT 0, enlace_modificado TEXT DEFAULT '')"
+            )
+            connection.execute("INSERT INTO enlaces_pelis VALUES ('btofold', '720p', '', '', '30', 0, '')")
+            connection.commit()
+            connection.close()
+            up_path = os.path.join(tmpdir, "cambios.up")
+            with open(up_path, "w", encoding="utf-8") as handle:
+                handle.write(script)
+
+            with patch("utils.cargarbd.REPO_DIR", tmpdir), patch("utils.cargarbd.LAST_CHANGES", set()), \
+                    patch("utils.cargarbd.p3b64decode_exacto", lambda text: text.encode("utf-8")):
+                processed = cargarbd.process_up_file(up_path)
+                changes = cargarbd.last_changes()
+
+                with open(up_path, "w", encoding="utf-8") as handle:
+                    handle.write("DROP TABLE enlaces_pelis; CREATE TABLE enlaces_pelis (link TEXT, tmdb TEXT);")
+                cargarbd.process_up_file(up_path)
+                untracked = cargarbd.last_changes()
+
+        self.assertTrue(processed)
+        self.assertEqual(changes, {
+            ("movie", "10", None, None),
+            ("movie", "30", None, None),
+            ("series", "20", "1", "3"),
+        })
+        self.assertIsNone(untracked)
+        self.assertEqual(bd.changed_media_tags(changes), {
+            "bd:movie:10", "bd:movie:30", "bd:series:20:1:3", "bd:series:20:1",
+        })
+
+    def test_up_file_replacing_a_row_records_both_titles_and_failures_record_everything(self):
+        from utils import cargarbd
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            connection = sqlite3.connect(os.path.join(tmpdir, "92b33381-pl3-42a1-bee0-bbb9d132e83f.tmp"))
+            connection.execute(
+                "CREATE TABLE enlaces_pelis (link TEXT PRIMARY KEY, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, "
+                "FLAG INTEGER DEFAULT 0, enlace_modificado TEXT DEFAULT '')"
+            )
+            connection.execute(
+                "CREATE TABLE enlaces_series (link TEXT PRIMARY KEY, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, "
+                "temporada INTEGER, episodio INTEGER, FLAG INTEGER DEFAULT 0, enlace_modificado TEXT DEFAULT '')"
+            )
+            connection.execute("INSERT INTO enlaces_pelis VALUES ('btofa', '720p', '', '', '10', 0, '')")
+            connection.commit()
+            connection.close()
+            up_path = os.path.join(tmpdir, "cambios.up")
+
+            with patch("utils.cargarbd.REPO_DIR", tmpdir), patch("utils.cargarbd.LAST_CHANGES", set()), \
+                    patch("utils.cargarbd.p3b64decode_exacto", lambda text: text.encode("utf-8")):
+                with open(up_path, "w", encoding="utf-8") as handle:
+                    handle.write("INSERT OR REPLACE INTO enlaces_pelis VALUES ('btofa', '1080p', '', '', '20');")
+                cargarbd.process_up_file(up_path)
+                moved = cargarbd.last_changes()
+
+                with open(up_path, "w", encoding="utf-8") as handle:
+                    handle.write(
+                        "INSERT OR REPLACE INTO enlaces_pelis VALUES ('btofb', '1080p', '', '', '30');"
+                        "INSERT INTO tabla_inexistente VALUES (1);"
+                    )
+                failed = cargarbd.process_up_file(up_path)
+                after_failure = cargarbd.last_changes()
+
+        self.assertEqual(moved, {("movie", "10", None, None), ("movie", "20", None, None)})
+        self.assertFalse(failed)
+        self.assertIsNone(after_failure)
+
+    async def test_lazy_mode_serves_the_encrypted_db_and_decrypts_on_read(self):
+        from utils import cargarbd, crypt
+
+        link = "https://1fichier.com/?lazy&af=1"
+        # Par clave/IV fijo con el que el enlace cifrado empieza por 'btof', sea cual sea ENCRYPTION_KEY_B64
+        key, iv = bytes(range(16, 32)), bytes.fromhex("00000000000000000000000000a22f47")
+        with patch.multiple("utils.crypt", key=key, iv=iv, _KEYSTREAM=b""):
+            crypt.decrypt_link_cached.cache_clear()
+            encrypted = crypt.encrypt_link(link)
+            with tempfile.TemporaryDirectory() as tmpdir:
+                encrypted_path = os.path.join(tmpdir, "cifrada.tmp")
+                connection = sqlite3.connect(encrypted_path)
+                connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+                connection.execute(
+                    "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+                )
+                connection.execute("INSERT INTO enlaces_pelis VALUES (?, '1080p', 'SPANISH', 'WEB-DL', '7')", (encrypted,))
+                connection.commit()
+                connection.close()
+
+                with patch("utils.cargarbd.DB_LAZY_DECRYPT", True), patch("utils.bd.DB_LAZY_DECRYPT", True), \
+                        patch("utils.cargarbd.DB_ENCRYPTED_PATH", encrypted_path), \
+                        patch("utils.cargarbd.DB_DECRYPTED_PATH", os.path.join(tmpdir, "bd.tmp")), \
+                        patch("utils.cargarbd.decryptbd") as decrypt_table:
+                    staging_path = cargarbd.stage_decrypted_db()
+                    with patch("utils.bd.DB_DECRYPTED_PATH", staging_path):
+                        bd.bump_db_generation()
+                        first = await bd.search_movies("7")
+                        cache.clear()
+                        second = await bd.search_movies("7")
+                        metadata = await bd.get_links_metadata([link], "movie")
+
+                connection = sqlite3.connect(staging_path)
+                stored = connection.execute("SELECT link FROM enlaces_pelis").fetchone()[0]
+                connection.close()
+            decrypted_once = crypt.decrypt_link_cached.cache_info()
+
+        decrypt_table.assert_not_called()
+        self.assertTrue(encrypted.startswith("btof"))
+        self.assertEqual(stored, encrypted)
+        self.assertEqual(first, [(link, "1080p", "SPANISH", "WEB-DL")])
+        self.assertEqual(second, first)
+        self.assertEqual(metadata, {link: "('1080p', 'SPANISH', 'WEB-DL')"})
+        self.assertEqual(decrypted_once.misses, 1)
+        self.assertEqual(decrypted_once.maxsize, crypt.LAZY_DECRYPT_CACHE_SIZE)
+
+    async def test_content_update_reloads_db_in_process_once(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        release = asyncio.Event()
+        loads = []
+
+        async def loader():
+            loads.append(bd.db_generation())
+            await release.wait()
+            bd.bump_db_generation()
+            main._invalidate_db_caches(None)
+            return True
+
+        cache.set("bd:search:movie:1:1", [("https://host/a", "1080p", "", "")])
+        cache.set("link:dead:RealDebrid:abc", True)
+        with patch("main.comprobar_actualizacion_contenido", AsyncMock(return_value=True)), \
+                patch("main.comprobar_actualizacion_addon", AsyncMock(return_value=False)), \
+                patch("main.background_db_loader", loader), \
+                patch("main.establecer_timestamp_arranque") as set_timestamp, \
+                patch("main.trigger_render_restart", AsyncMock()) as restart, \
+                patch("main.sys.exit") as exit_process:
+            await main.actualizar_bd()
+            await main.actualizar_bd()
+            release.set()
+            await asyncio.gather(*main.DB_RELOAD_INFLIGHT.values())
+
+        self.assertEqual(len(loads), 1)
+        restart.assert_not_called()
+        exit_process.assert_not_called()
+        self.assertEqual(set_timestamp.call_args.args[0], "CONTENIDO")
+        self.assertIsNone(cache.get("bd:search:movie:1:1"))
+        self.assertTrue(cache.get("link:dead:RealDebrid:abc"))
+
+    async def test_addon_update_still_restarts_the_service(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        loader = AsyncMock(return_value=True)
+        with patch("main.comprobar_actualizacion_contenido", AsyncMock(return_value=True)), \
+                patch("main.comprobar_actualizacion_addon", AsyncMock(return_value=True)), \
+                patch("main.background_db_loader", loader), patch("main.RENDER_API_URL", None), \
+                patch("main.sys.exit") as exit_process:
+            await main.actualizar_bd()
+
+        exit_process.assert_called_once_with(1)
+        loader.assert_not_called()
+
+    async def test_content_published_by_another_worker_is_reloaded_on_the_next_check(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        loader = AsyncMock(return_value=True)
+        with patch("main.comprobar_actualizacion_contenido", AsyncMock(return_value=False)), \
+                patch("main.comprobar_actualizacion_addon", AsyncMock(return_value=False)), \
+                patch("main.background_db_loader", loader), patch("main.IS_DB_READY", True), \
+                patch("main.published_db_changed", return_value=True), patch("main.establecer_timestamp_arranque"):
+            await main.actualizar_bd()
+            await asyncio.gather(*main.DB_RELOAD_INFLIGHT.values())
+
+        loader.assert_awaited_once()
+
     async def test_duplicate_links_share_one_unrestrict_task_per_request(self):
         import config
         config.IS_DEV = True
@@ -391,7 +892,7 @@ class PerformanceOptimizationsTest(unittest.IsolatedAsyncioTestCase):
 
         calls = 0
 
-        async def fake_get_unrestricted_link(debrid_service, link):
+        async def fake_get_unrestricted_link(debrid_service, link, failures=None):
             nonlocal calls
             calls += 1
             await asyncio.sleep(0)
@@ -421,27 +922,53 @@ class PerformanceOptimizationsTest(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(len(results), 5)
         self.assertTrue(all(result[2] == "https://download" for result in results))
 
-    async def test_stream_response_cache_key_tracks_db_version_and_fichier_status(self):
+    async def test_stream_response_cache_key_tracks_db_generation_and_fichier_status(self):
         import config
         config.IS_DEV = True
         import main
 
-        with tempfile.TemporaryDirectory() as tmpdir:
-            db_path = os.path.join(tmpdir, "bd.tmp")
-            with open(db_path, "w", encoding="utf-8") as db_file:
-                db_file.write("one")
-
-            with patch("main.DB_DECRYPTED_PATH", db_path):
-                first = main._stream_response_cache_key("cfg", "movie", "tt1", "up")
-                status_changed = main._stream_response_cache_key("cfg", "movie", "tt1", "down")
+        with patch("main.os.stat", side_effect=AssertionError("stat on stream path")):
+            first = main._stream_response_cache_key("cfg", "movie", "tt1", "up")
+            status_changed = main._stream_response_cache_key("cfg", "movie", "tt1", "down")
+            unchanged = main._stream_response_cache_key("cfg", "movie", "tt1", "up")
 
-                future = time.time() + 10
-                os.utime(db_path, (future, future))
-                db_changed = main._stream_response_cache_key("cfg", "movie", "tt1", "up")
+            bd.bump_db_generation()
+            db_changed = main._stream_response_cache_key("cfg", "movie", "tt1", "up")
 
+        self.assertEqual(first, unchanged)
         self.assertNotEqual(first, status_changed)
         self.assertNotEqual(first, db_changed)
 
+    async def test_db_generation_endpoint_reports_worker_generation(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        content = {"commit": "abc123", "sha256": "f" * 64}
+        generation = bd.bump_db_generation(content=content)
+        response = await main.generacion_bd()
+
+        self.assertEqual(response["generacion"], generation)
+        self.assertEqual(response["contenido"], content)
+        self.assertEqual(response["pid"], os.getpid())
+
+    def test_content_fingerprint_identifies_the_loaded_content(self):
+        from utils import cargarbd
+
+        with tempfile.TemporaryDirectory() as tmp:
+            encrypted = os.path.join(tmp, "bd.enc")
+            version_file = os.path.join(tmp, "version.txt")
+            with open(encrypted, "wb") as f:
+                f.write(b"contenido")
+            with open(version_file, "w") as f:
+                json.dump({"last_commit": "abc123"}, f)
+
+            with patch("utils.cargarbd.DB_ENCRYPTED_PATH", encrypted), \
+                    patch("utils.cargarbd.VERSION_FILE", version_file):
+                fingerprint = cargarbd.content_fingerprint()
+
+        self.assertEqual(fingerprint, {"commit": "abc123", "sha256": hashlib.sha256(b"contenido").hexdigest()})
+
     async def test_stream_response_cache_hit_skips_metadata_and_debrid_work(self):
         import config
         config.IS_DEV = True
@@ -467,6 +994,221 @@ class PerformanceOptimizationsTest(unittest.IsolatedAsyncioTestCase):
 
         self.assertEqual(response, expected)
 
+    async def test_concurrent_identical_stream_requests_are_coalesced(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        encoded_config = encodeb64(
+            '{"addonHost": "http://addon", "service": "realdebrid", "debridKey": "rd", '
+            '"tmdbApi": "tmdb", "maxSize": "100", "selectedQualityExclusion": []}'
+        )
+        calls = 0
+
+        class SlowTMDB:
+            def __init__(self, config, http_client):
+                pass
+
+            async def get_metadata(self, stream_id, stream_type):
+                nonlocal calls
+                calls += 1
+                await asyncio.sleep(0.01)
+                return None
+
+        with patch("main.IS_DB_READY", True), patch("main.TMDB", SlowTMDB):
+            responses = await asyncio.gather(*[
+                main.get_results(encoded_config, "movie", "tt1.json")
+                for _ in range(10)
+            ])
+
+        self.assertEqual(calls, 1)
+        self.assertEqual(responses, [{"streams": []}] * 10)
+        self.assertEqual(main.STREAM_RESPONSE_INFLIGHT, {})
+
+    async def test_stale_stream_response_is_served_while_refreshing_once(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        encoded_config = encodeb64('{"service": "realdebrid", "debridKey": "rd"}')
+        stale = {"streams": [{"name": "stale"}]}
+        fresh = {"streams": [{"name": "fresh"}]}
+        refreshes = 0
+
+        async def fake_build(config_str, config, stream_type, stream_id, fichier_status, cache_key, start_time):
+            nonlocal refreshes
+            refreshes += 1
+            await asyncio.sleep(0)
+            cache.set(cache_key, fresh, ttl=60)
+            return fresh
+
+        now = time.time()
+        with patch("main.IS_DB_READY", True), patch("main._build_stream_response", side_effect=fake_build):
+            cache_key = main._stream_response_cache_key(encoded_config, "movie", "tt1", "up")
+            with patch("utils.cache.time.time", return_value=now - main.STREAM_RESPONSE_TTL - 1):
+                cache.set(cache_key, stale)
+
+            responses = await asyncio.gather(*[
+                main.get_results(encoded_config, "movie", "tt1.json")
+                for _ in range(3)
+            ])
+            await asyncio.gather(*main.STREAM_RESPONSE_INFLIGHT.values())
+            refreshed = await main.get_results(encoded_config, "movie", "tt1.json")
+
+        self.assertEqual(responses, [stale] * 3)
+        self.assertEqual(refreshes, 1)
+        self.assertEqual(refreshed, fresh)
+
+    async def test_stream_catalog_is_shared_between_users_of_same_service(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        def user_config(debrid_key, max_size):
+            return encodeb64(
+                '{"addonHost": "http://addon", "service": "realdebrid", "debrid": true, "debridKey": "%s", '
+                '"tmdbApi": "tmdb", "maxSize": "%s", "selectedQualityExclusion": []}' % (debrid_key, max_size)
+            )
+
+        tmdb_calls = 0
+        processed_links = []
+
+        class CountingTMDB:
+            def __init__(self, config, http_client):
+                pass
+
+            async def get_metadata(self, stream_id, stream_type):
+                nonlocal tmdb_calls
+                tmdb_calls += 1
+                return Movie("1", ["Title"], "2026", [])
+
+        async def fake_process(debrid_service, link, config, *args):
+            processed_links.append(link)
+            size = 2 if link.endswith("small") else 50
+            return link, {"filesize": size * 1024 ** 3, "nombre_fichero": link, "quality": "1080p",
+                          "metadata_filename": "SPANISH 1080p WEB-DL"}, True
+
+        search = AsyncMock(return_value=[
+            ("https://host/small", "1080p", "SPANISH", "WEB-DL"),
+            ("https://host/big", "1080p", "SPANISH", "WEB-DL"),
+        ])
+        with patch("main.IS_DB_READY", True), patch("main.TMDB", CountingTMDB), \
+                patch("main.search_movies", search), patch("main._process_single_link", side_effect=fake_process):
+            first = await main.get_results(user_config("user-a", 100), "movie", "tt1.json")
+            second = await main.get_results(user_config("user-b", 10), "movie", "tt1.json")
+
+        self.assertEqual(tmdb_calls, 1)
+        self.assertEqual(search.await_count, 1)
+        self.assertEqual(sorted(processed_links), ["https://host/big", "https://host/small"])
+        self.assertEqual(len(first["streams"]), 2)
+        self.assertEqual(len(second["streams"]), 1)
+        self.assertNotEqual(first["streams"][0]["url"], second["streams"][0]["url"])
+
+    async def test_cold_catalog_build_reads_the_cache_tier_once_off_the_event_loop(self):
+        import threading
+        import main
+
+        class CountingTier:
+            def __init__(self):
+                self.reads = []
+
+            def get_many(self, keys):
+                self.reads.append((list(keys), threading.get_ident()))
+                return {}
+
+            def set_many(self, items):
+                pass
+
+            def delete_many(self, keys):
+                pass
+
+            def clear(self):
+                pass
+
+            def close(self):
+                pass
+
+        class StubTorBox:
+            config = {}
+
+            async def check_cached_link(self, link):
+                return None
+
+        StubTorBox.__name__ = "TorBox"
+
+        class StubTMDB:
+            def __init__(self, config, http_client):
+                pass
+
+            async def get_metadata(self, stream_id, stream_type):
+                return Movie("1", ["Title"], "2026", [])
+
+        links = [f"https://host/{index}" for index in range(5)]
+        search = AsyncMock(return_value=[(link, "1080p", "SPANISH", "WEB-DL") for link in links])
+        tier = CountingTier()
+        cache.attach_tier(tier, warm=False)
+        try:
+            with patch("main.TMDB", StubTMDB), patch("main.search_movies", search):
+                catalog = await main._build_stream_catalog({}, StubTorBox(), "movie", "tt1", "catalog:cold")
+        finally:
+            cache.detach_tier()
+
+        self.assertEqual(len(catalog["results"]), 5)
+        self.assertEqual(len(tier.reads), 1)
+        keys, thread_id = tier.reads[0]
+        self.assertEqual(sorted(keys), sorted(main._link_metadata_cache_key(link) for link in links))
+        self.assertNotEqual(thread_id, threading.get_ident())
+
+    async def test_dead_links_are_skipped_per_service_after_a_failed_unrestrict(self):
+        import config
+        config.IS_DEV = True
+        import main
+
+        unrestricted = []
+
+        class StubDebrid:
+            config = {}
+
+            def __init__(self, alive):
+                self.alive = alive
+
+            async def unrestrict_link(self, link):
+                unrestricted.append(link)
+                if link in self.alive:
+                    return {"download": link + "/dl", "filename": "Movie 1080p SPANISH", "filesize": 1024 ** 3}
+                return None
+
+        StubDebrid.__name__ = "RealDebrid"
+
+        class StubTMDB:
+            def __init__(self, config, http_client):
+                pass
+
+            async def get_metadata(self, stream_id, stream_type):
+                return Movie("1", ["Title"], "2026", [])
+
+        search = AsyncMock(return_value=[
+            ("https://host/alive", "1080p", "SPANISH", ""),
+            ("https://host/dead", "1080p", "SPANISH", ""),
+        ])
+        with patch("main.TMDB", StubTMDB), patch("main.search_movies", search):
+            # Si falla todo no se sabe si el enlace está caído o la cuenta no funciona
+            await main._build_stream_catalog({}, StubDebrid(alive=set()), "movie", "tt1", "catalog:0")
+            self.assertIsNone(cache.get(main._dead_link_cache_key("RealDebrid", "https://host/dead")))
+
+            unrestricted.clear()
+            first = await main._build_stream_catalog({}, StubDebrid(alive={"https://host/alive"}), "movie", "tt1", "catalog:1")
+            second = await main._build_stream_catalog({}, StubDebrid(alive={"https://host/alive"}), "movie", "tt1", "catalog:2")
+
+        self.assertEqual(sorted(unrestricted), ["https://host/alive", "https://host/dead"])
+        self.assertEqual([link for link, _ in first["results"]], ["https://host/alive"])
+        self.assertEqual([link for link, _ in second["results"]], ["https://host/alive"])
+        self.assertEqual(
+            cache.get(main._dead_link_cache_key("RealDebrid", "https://host/dead")),
+            "el servicio no devolvió datos",
+        )
+        self.assertIsNone(cache.get(main._dead_link_cache_key("AllDebrid", "https://host/dead")))
+
     def test_parse_config_is_cached(self):
         encoded = encodeb64('{"service": "realdebrid", "debridKey": "token"}')
 
@@ -490,22 +1232,23 @@ class MetadataReuseTest(unittest.TestCase):
             "metadata_filename": metadata,
         }
 
-        with patch("utils.detection.getMetadata") as get_metadata:
+        with patch("sqlite3.connect") as connect:
             processed = post_process_results("https://1fichier.com/?abc", media, "RealDebrid", "http://play", result)
 
-        get_metadata.assert_not_called()
+        connect.assert_not_called()
         self.assertEqual(processed["filename"], metadata)
         self.assertEqual(processed["languages"], ["es"])
         self.assertEqual(processed["quality_spec"], ["DDP", "WEBDL"])
 
-    def test_post_process_keeps_db_fallback_when_metadata_was_not_preloaded(self):
+    def test_post_process_falls_back_to_file_name_without_db_query(self):
         media = Movie("1", ["Title"], "2026", [])
+        result = {"nombre_fichero": "Title.2026.SPANISH.720p.WEBRip.mkv"}
 
-        with patch("utils.detection.getMetadata", return_value="SPANISH 720p WEBRip") as get_metadata:
-            processed = post_process_results("https://1fichier.com/?abc", media, "RealDebrid", "http://play", {})
+        with patch("sqlite3.connect") as connect:
+            processed = post_process_results("https://1fichier.com/?abc", media, "RealDebrid", "http://play", result)
 
-        get_metadata.assert_called_once_with("https://1fichier.com/?abc", "movie")
-        self.assertEqual(processed["filename"], "SPANISH 720p WEBRip")
+        connect.assert_not_called()
+        self.assertEqual(processed["filename"], "Title.2026.SPANISH.720p.WEBRip.mkv")
         self.assertEqual(processed["languages"], ["es"])
         self.assertEqual(processed["quality_spec"], ["WEBRIP"])
 
@@ -519,5 +1262,390 @@ class DetectionEquivalenceTest(unittest.TestCase):
         self.assertEqual(detect_languages(sample), ["es", "multi", "multi"])
 
 
+class ContentDownloadTest(unittest.TestCase):
+    def _zip_bytes(self, files):
+        import io
+        import zipfile
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_STORED) as archive:
+            for name, data in files.items():
+                archive.writestr(name, data)
+        return buffer.getvalue()
+
+    def test_each_worker_stages_into_its_own_file_under_a_shared_lock(self):
+        import fcntl
+        from utils import cargarbd
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            encrypted_path = os.path.join(tmpdir, "cifrada.tmp")
+            with open(encrypted_path, "wb") as handle:
+                handle.write(b"bd")
+            lock_path = os.path.join(tmpdir, "bd.lock")
+
+            with patch("utils.cargarbd.DB_ENCRYPTED_PATH", encrypted_path), \
+                    patch("utils.cargarbd.DB_DECRYPTED_PATH", os.path.join(tmpdir, "bd.tmp")), \
+                    patch("utils.cargarbd.DB_LOAD_LOCK_PATH", lock_path), \
+                    patch("utils.cargarbd.decryptbd"):
+                other_worker = cargarbd.stage_decrypted_db()
+                # Simula otro proceso: su fichero no es el de este
+                cargarbd.STAGED_DB_PATH = None
+                staged = cargarbd.stage_decrypted_db()
+                cargarbd.discard_staged_db()
+                other_left = os.path.exists(other_worker)
+                staged_left = os.path.exists(staged)
+
+                cargarbd.acquire_db_load_lock()
+                try:
+                    with open(lock_path, "a") as contender:
+                        with self.assertRaises(BlockingIOError):
+                            fcntl.flock(contender, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                finally:
+                    cargarbd.release_db_load_lock()
+                with open(lock_path, "a") as contender:
+                    fcntl.flock(contender, fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+        self.assertEqual(os.path.dirname(staged), tmpdir)
+        self.assertNotEqual(staged, other_worker)
+        self.assertTrue(other_left)
+        self.assertFalse(staged_left)
+        self.assertIsNone(cargarbd.staged_db_path())
+
+    def test_repo_zip_is_streamed_to_disk_with_bounded_memory(self):
+        import http.server
+        import threading
+        import tracemalloc
+        from utils import cargarbd
+
+        payload = os.urandom(8 * 1024 * 1024)
+        archive = self._zip_bytes({"repo-main/contenido.zm3": payload})
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(archive)))
+                self.end_headers()
+                self.wfile.write(archive)
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            with tempfile.TemporaryDirectory() as tmpdir, \
+                    patch("utils.cargarbd.REPO_URL", f"http://127.0.0.1:{server.server_port}/repo.git"), \
+                    patch("utils.cargarbd.BASE_DIR", tmpdir):
+                tracemalloc.start()
+                try:
+                    cargarbd.clone_or_update_repo()
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+                with open(os.path.join(tmpdir, "repo-main", "contenido.zm3"), "rb") as handle:
+                    extracted = handle.read()
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        self.assertEqual(extracted, payload)
+        self.assertLess(peak, len(archive) / 2)
+
+    def test_zm3_is_rebuilt_on_disk_with_its_zip_header(self):
+        import base64
+        from utils import cargarbd
+
+        archive = self._zip_bytes({"settings.xml": b"db"})
+        header, body = archive[:30], archive[30:]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            zm3_path = os.path.join(tmpdir, "contenido.zm3")
+            with open(zm3_path, "wb") as handle:
+                handle.write(body)
+
+            with patch("utils.cargarbd.REPO_DIR", tmpdir), patch("utils.cargarbd.BASE_DIR", tmpdir), \
+                    patch.dict(os.environ, {"ZIP_DECODE_BASE64": base64.b64encode(header).decode()}):
+                processed = cargarbd.download_and_process_file(zm3_path)
+            with open(os.path.join(tmpdir, "92b33381-pl3-42a1-bee0-bbb9d132e83f.tmp"), "rb") as handle:
+                extracted = handle.read()
+
+        self.assertTrue(processed)
+        self.assertEqual(extracted, b"db")
+
+    def test_unchanged_commit_with_intact_files_skips_the_download(self):
+        from unittest.mock import MagicMock
+        from utils import cargarbd
+
+        feed = (
+            '<feed xmlns="http://www.w3.org/2005/Atom"><entry>'
+            '<id>tag:github.com,2008:Grit::Commit/abc123</id></entry></feed>'
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            repo_dir = os.path.join(tmpdir, "repo")
+            os.makedirs(repo_dir)
+            paths = {name: os.path.join(repo_dir, name) for name in ("contenido.zm3", "parche.up")}
+            for name, path in paths.items():
+                with open(path, "wb") as handle:
+                    handle.write(name.encode("utf-8") * 100)
+            encrypted_path = os.path.join(repo_dir, "cifrada.tmp")
+            decrypted_path = os.path.join(repo_dir, "bd.tmp")
+            for path in (encrypted_path, decrypted_path):
+                open(path, "wb").close()
+            version_path = os.path.join(tmpdir, "version.txt")
+            with open(version_path, "w") as handle:
+                json.dump({
+                    "last_commit": "abc123",
+                    **{name: cargarbd.compute_hash(path) for name, path in paths.items()},
+                    "sizes": {name: os.path.getsize(path) for name, path in paths.items()},
+                }, handle)
+
+            response = MagicMock(text=feed, status_code=200, headers={})
+            with patch("utils.cargarbd.REPO_DIR", repo_dir), patch("utils.cargarbd.VERSION_FILE", version_path), \
+                    patch("utils.actualizarbd.FEED_VALIDATORS_FILE", os.path.join(tmpdir, "validators.json")), \
+                    patch("utils.cargarbd.DB_ENCRYPTED_PATH", encrypted_path), \
+                    patch("utils.cargarbd.DB_DECRYPTED_PATH", decrypted_path), \
+                    patch("utils.cargarbd.requests.get", return_value=response), \
+                    patch("utils.cargarbd.clone_or_update_repo") as clone, \
+                    patch("utils.cargarbd.download_and_process_file", return_value=False):
+                unchanged = cargarbd.check_and_download()
+                clone.assert_not_called()
+
+                with open(paths["parche.up"], "ab") as handle:
+                    handle.write(b"-- local")
+                cargarbd.check_and_download()
+
+        self.assertFalse(unchanged)
+        clone.assert_called_once()
+
+class FeedPollingTest(unittest.IsolatedAsyncioTestCase):
+    FEED = (
+        '<feed xmlns="http://www.w3.org/2005/Atom"><entry>'
+        '<id>tag:github.com,2008:Grit::Commit/abc123</id><updated>2030-01-01T00:00:00Z</updated>'
+        '</entry></feed>'
+    ).encode("utf-8")
+
+    def setUp(self):
+        import http.server
+        import threading
+
+        feed = self.FEED
+        self.requests = []
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                self.requests.append(handler.headers.get("If-None-Match"))
+                if handler.headers.get("If-None-Match") == '"v1"':
+                    handler.send_response(304)
+                    handler.end_headers()
+                    return
+                handler.send_response(200)
+                handler.send_header("ETag", '"v1"')
+                handler.send_header("Last-Modified", "Wed, 01 Jan 2030 00:00:00 GMT")
+                handler.send_header("Content-Length", str(len(feed)))
+                handler.end_headers()
+                handler.wfile.write(feed)
+
+            def log_message(handler, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/commits/main.atom"
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.validators = patch("utils.actualizarbd.FEED_VALIDATORS_FILE", os.path.join(self.tmpdir.name, "validators.json"))
+        self.validators.start()
+
+    async def asyncTearDown(self):
+        from utils import actualizarbd
+
+        await actualizarbd.cerrar_cliente_feeds()
+
+    def tearDown(self):
+        self.validators.stop()
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmpdir.cleanup()
+
+    async def test_unchanged_feed_is_answered_with_304_without_parsing(self):
+        from utils import actualizarbd
+
+        timestamp_file = os.path.join(self.tmpdir.name, "contenido_last_update.txt")
+        with open(timestamp_file, "w") as handle:
+            handle.write("2029-01-01T00:00:00+00:00")
+
+        with patch("utils.actualizarbd.ET.fromstring", wraps=actualizarbd.ET.fromstring) as parse:
+            first = await actualizarbd._comprobar_remoto(self.url, timestamp_file, "CONTENIDO")
+            client = actualizarbd._feed_client
+            second = await actualizarbd._comprobar_remoto(self.url, timestamp_file, "CONTENIDO")
+
+        self.assertTrue(first)
+        self.assertTrue(second)
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(self.requests, [None, '"v1"'])
+        self.assertIs(actualizarbd._feed_client, client)
+
+    async def test_content_loader_reuses_the_recorded_commit_on_304(self):
+        from utils import cargarbd
+
+        version_path = os.path.join(self.tmpdir.name, "version.txt")
+        with open(version_path, "w") as handle:
+            json.dump({"last_commit": "abc123"}, handle)
+
+        with patch("utils.cargarbd.REPO_URL_ATOM", self.url), patch("utils.cargarbd.VERSION_FILE", version_path), \
+                patch("utils.cargarbd.DB_DECRYPTED_PATH", version_path), \
+                patch("utils.cargarbd._recorded_files_intact", return_value=True), \
+                patch("utils.cargarbd.clone_or_update_repo") as clone, \
+                patch("utils.cargarbd.ET.fromstring", wraps=cargarbd.ET.fromstring) as parse:
+            first = cargarbd.check_and_download()
+            second = cargarbd.check_and_download()
+
+        self.assertFalse(first)
+        self.assertFalse(second)
+        clone.assert_not_called()
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(self.requests, [None, '"v1"'])
+
+class MultiWorkerReloadTest(unittest.TestCase):
+    """Varios workers comparten el directorio de trabajo: solo uno prepara la BD, todos la cargan."""
+
+    @staticmethod
+    def _links_db(path, link):
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+        connection.execute(
+            "CREATE TABLE enlaces_series (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+        )
+        connection.execute("INSERT INTO enlaces_pelis VALUES (?, '1080p', 'SPANISH', 'WEB-DL', '1')", (link,))
+        connection.commit()
+        connection.close()
+
+    def test_every_worker_switches_to_the_db_published_by_another(self):
+        import multiprocessing
+        import config
+        config.IS_DEV = True
+        import main
+        from utils import cargarbd
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            live_path = os.path.join(tmpdir, "bd.tmp")
+            encrypted_path = os.path.join(tmpdir, "cifrada.tmp")
+            version_path = os.path.join(tmpdir, "version.txt")
+            self._links_db(live_path, "https://host/old")
+            self._links_db(encrypted_path, "https://host/old")
+            with open(version_path, "w") as handle:
+                json.dump({"last_commit": "old"}, handle)
+            remote = {"commit": "old"}
+
+            def check_and_download():
+                # Como el real: quien ve primero el commit nuevo prepara la BD; los demás encuentran
+                # version.txt al día y toman el camino rápido sin preparar nada
+                cargarbd.discard_staged_db()
+                with open(version_path) as handle:
+                    if json.load(handle)["last_commit"] == remote["commit"]:
+                        return False
+                self._links_db(encrypted_path + ".new", "https://host/new")
+                os.replace(encrypted_path + ".new", encrypted_path)
+                # Una BD completa nueva (.zm3): no se sabe qué títulos cambiaron
+                cargarbd._record_changes(None)
+                cargarbd.stage_decrypted_db()
+                with open(version_path, "w") as handle:
+                    json.dump({"last_commit": "new"}, handle)
+                return True
+
+            async def serve():
+                await main.background_db_loader()
+                cache.clear()
+                await bd.search_movies("1")
+                await bd.close_read_pool()
+
+            async def reload(results):
+                generation = bd.db_generation()
+                loaded = await main.background_db_loader()
+                found = await bd.search_movies("1")
+                await bd.close_read_pool()
+                results.put((loaded, bd.db_generation() > generation, bd.db_content(), found))
+
+            def worker(results):
+                asyncio.run(reload(results))
+
+            with patch("utils.bd.DB_DECRYPTED_PATH", live_path), patch("main.DB_DECRYPTED_PATH", live_path), \
+                    patch("utils.cargarbd.DB_DECRYPTED_PATH", live_path), \
+                    patch("utils.cargarbd.DB_ENCRYPTED_PATH", encrypted_path), \
+                    patch("utils.cargarbd.VERSION_FILE", version_path), \
+                    patch("utils.cargarbd.DB_LOAD_LOCK_PATH", os.path.join(tmpdir, "bd.lock")), \
+                    patch("utils.cargarbd.decryptbd"), patch("main.DB_MEMORY_INDEX", False), \
+                    patch("main.check_and_download", check_and_download), patch("main.IS_DB_READY", False):
+                asyncio.run(serve())
+                remote["commit"] = "new"
+
+                context = multiprocessing.get_context("fork")
+                results = context.Queue()
+                workers = [context.Process(target=worker, args=(results,)) for _ in range(2)]
+                for process in workers:
+                    process.start()
+                reports = [results.get(timeout=60) for _ in workers]
+                for process in workers:
+                    process.join(timeout=60)
+
+        new = [("https://host/new", "1080p", "SPANISH", "WEB-DL")]
+        self.assertEqual([process.exitcode for process in workers], [0, 0])
+        for loaded, advanced, _, found in reports:
+            self.assertTrue(loaded)
+            self.assertTrue(advanced)
+            self.assertEqual(found, new)
+        self.assertEqual(reports[0][2], reports[1][2])
+        self.assertEqual(reports[0][2]["commit"], "new")
+
+
+class QueryPlanTest(unittest.TestCase):
+    def _synthetic_db(self, path):
+        connection = sqlite3.connect(path)
+        connection.execute("CREATE TABLE enlaces_pelis (link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT)")
+        connection.execute(
+            "CREATE TABLE enlaces_series "
+            "(link TEXT, calidad TEXT, audio TEXT, info TEXT, tmdb TEXT, temporada INTEGER, episodio INTEGER)"
+        )
+        # Índices antiguos tal como llegaban en BDs anteriores
+        connection.execute("CREATE INDEX idx_enlaces_pelis_tmdb ON enlaces_pelis(tmdb)")
+        connection.execute("CREATE INDEX idx_enlaces_series_tmdb_season_episode ON enlaces_series(tmdb, temporada, episodio)")
+        connection.executemany(
+            "INSERT INTO enlaces_pelis VALUES (?, ?, ?, ?, ?)",
+            ((f"https://1fichier.com/?m{n}", "1080p", "SPANISH", "WEB-DL", str(n % 300)) for n in range(3000)),
+        )
+        connection.executemany(
+            "INSERT INTO enlaces_series VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (f"https://1fichier.com/?s{n}", "720p", "SPANISH", "WEBRip", str(n % 50), n % 5 + 1, n % 12 + 1)
+                for n in range(3000)
+            ),
+        )
+        connection.commit()
+        connection.close()
+
+    def test_hot_queries_are_index_only_scans(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db_path = os.path.join(tmpdir, "bd.tmp")
+            self._synthetic_db(db_path)
+            connection = sqlite3.connect(db_path)
+            try:
+                self.assertEqual(sorted(bd.uncovered_hot_queries(connection)), sorted(bd.HOT_QUERIES))
+            finally:
+                connection.close()
+
+            bd.setup_index(db_path)
+
+            connection = sqlite3.connect(db_path)
+            try:
+                self.assertEqual(bd.uncovered_hot_queries(connection), [])
+                for name, (sql, params) in bd.HOT_QUERIES.items():
+                    plan = " ".join(row[3] for row in connection.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+                    self.assertIn("USING COVERING INDEX", plan, name)
+                indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            finally:
+                connection.close()
+
+        self.assertFalse(indexes & set(bd.SUPERSEDED_INDEXES))
+
+
 if __name__ == "__main__":
     unittest.main()
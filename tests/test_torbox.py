@@ -362,7 +362,7 @@ class TorBoxIntegrationShapeTest(unittest.IsolatedAsyncioTestCase):
     async def test_catalog_lookup_for_torbox_reuses_cached_filesize(self):
         import main
         cache.clear()
-        cache.set("https://host.example/file", {
+        main._set_link_metadata("https://host.example/file", {
             "filesize": 5 * 1024 ** 3,
             "quality": "1080p",
             "nombre_fichero": "cached-file.mkv",
@@ -1,5 +1,7 @@
 import httpx
+import json
 import os
+import threading
 import xml.etree.ElementTree as ET
 from datetime import datetime, timezone
 from utils.logger import setup_logger
@@ -18,11 +20,89 @@ CONTENIDO_TIMESTAMP_FILE = os.path.join(WORKING_PATH,'contenido_last_update.txt'
 ADDON_TIMESTAMP_FILE = os.path.join(WORKING_PATH,'addon_last_update.txt')
 ADDON_REPO_URL = "https://github.com/nulldk/addonespanol-ndk/commits/main.atom"
 
-def establecer_timestamp_arranque(tipo_contenido):
-    """Establece el timestamp de arranque a la hora actual (UTC)."""
+# --- Peticiones condicionales a los feeds ---
+# Por cada consulta se guardan su ETag/Last-Modified y lo que se extrajo del feed; con un 304
+# se reutiliza lo guardado sin descargar ni analizar el XML
+FEED_VALIDATORS_FILE = os.path.join(WORKING_PATH, 'feed_validators.json')
+_validadores_lock = threading.Lock()
+# Cliente compartido por las comprobaciones programadas
+_feed_client = None
+
+
+def _cargar_validadores():
+    try:
+        with open(FEED_VALIDATORS_FILE, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def cabeceras_condicionales(nombre):
+    """
+    Devuelve las cabeceras If-None-Match/If-Modified-Since de la última respuesta guardada para
+    la consulta `nombre`, o un dict vacío si no hay nada que reutilizar ante un 304.
+    """
+    guardado = _cargar_validadores().get(nombre)
+    if not guardado or not guardado.get("datos"):
+        return {}
+    cabeceras = {}
+    if guardado.get("etag"):
+        cabeceras["If-None-Match"] = guardado["etag"]
+    if guardado.get("last_modified"):
+        cabeceras["If-Modified-Since"] = guardado["last_modified"]
+    return cabeceras
+
+
+def datos_guardados(nombre):
+    """Devuelve lo extraído del feed en la última respuesta completa de la consulta `nombre`."""
+    guardado = _cargar_validadores().get(nombre) or {}
+    return guardado.get("datos")
+
+
+def guardar_validadores(nombre, headers, datos):
+    """
+    Guarda los validadores de una respuesta 200 y los datos extraídos de ella.
+
+    Args:
+        nombre (str): La consulta, p. ej. 'CONTENIDO'.
+        headers: Cabeceras de la respuesta (requests o httpx).
+        datos (dict): Lo que se extrajo del feed y se reutilizará ante un 304.
+    """
+    with _validadores_lock:
+        validadores = _cargar_validadores()
+        validadores[nombre] = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "datos": datos,
+        }
+        temporal = f"{FEED_VALIDATORS_FILE}.tmp"
+        with open(temporal, 'w') as f:
+            json.dump(validadores, f, indent=4)
+        os.replace(temporal, FEED_VALIDATORS_FILE)
+
+
+def _cliente_feeds():
+    global _feed_client
+    if _feed_client is None or _feed_client.is_closed:
+        _feed_client = httpx.AsyncClient(timeout=30)
+    return _feed_client
+
+
+async def cerrar_cliente_feeds():
+    """Cierra el cliente HTTP compartido de los feeds, p. ej. al apagar el servicio."""
+    global _feed_client
+    client, _feed_client = _feed_client, None
+    if client is not None:
+        await client.aclose()
+
+def establecer_timestamp_arranque(tipo_contenido, momento=None):
+    """
+    Establece el timestamp de arranque a la hora actual (UTC) o a `momento` si se indica,
+    p. ej. la hora en que empezó una recarga de la BD.
+    """
     fichero_timestamp = CONTENIDO_TIMESTAMP_FILE if tipo_contenido == "CONTENIDO" else ADDON_TIMESTAMP_FILE
     # Usar UTC explícitamente para evitar problemas de offset-naive vs offset-aware
-    ahora = datetime.now(timezone.utc).isoformat()
+    ahora = (momento or datetime.now(timezone.utc)).isoformat()
     with open(fichero_timestamp, 'w') as f:
         f.write(ahora)
     logger.update(f"Timestamp de arranque establecido para {tipo_contenido}: {ahora}")
@@ -51,24 +131,30 @@ async def _comprobar_remoto(url_atom, fichero_timestamp, tipo_contenido):
             f.write(hora_arranque.isoformat())
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url_atom, timeout=30)
+        response = await _cliente_feeds().get(
+            url_atom, timeout=30, headers=cabeceras_condicionales(tipo_contenido)
+        )
+        if response.status_code == 304:
+            # El feed no ha cambiado desde la última consulta: no se analiza de nuevo
+            latest_remote_timestamp = datetime.fromisoformat(datos_guardados(tipo_contenido)["updated"])
+        else:
             response.raise_for_status()
-        
-        root = ET.fromstring(response.text)
-        namespace = '{http://www.w3.org/2005/Atom}'
-        latest_entry = root.find(f'{namespace}entry')
-        if latest_entry is None:
-            logger.warning(f"No se encontró 'entry' en el feed de commits para {tipo_contenido}.")
-            return False
-
-        latest_remote_timestamp_str = latest_entry.find(f'{namespace}updated').text.strip()
-        # Convertir Z a +00:00 para compatibilidad con fromisoformat en versiones antiguas de Python
-        latest_remote_timestamp = datetime.fromisoformat(latest_remote_timestamp_str.replace('Z', '+00:00'))
-        
-        # Asegurar que ambos timestamps tengan zona horaria
-        if latest_remote_timestamp.tzinfo is None:
-            latest_remote_timestamp = latest_remote_timestamp.replace(tzinfo=timezone.utc)
+
+            root = ET.fromstring(response.text)
+            namespace = '{http://www.w3.org/2005/Atom}'
+            latest_entry = root.find(f'{namespace}entry')
+            if latest_entry is None:
+                logger.warning(f"No se encontró 'entry' en el feed de commits para {tipo_contenido}.")
+                return False
+
+            latest_remote_timestamp_str = latest_entry.find(f'{namespace}updated').text.strip()
+            # Convertir Z a +00:00 para compatibilidad con fromisoformat en versiones antiguas de Python
+            latest_remote_timestamp = datetime.fromisoformat(latest_remote_timestamp_str.replace('Z', '+00:00'))
+
+            # Asegurar que ambos timestamps tengan zona horaria
+            if latest_remote_timestamp.tzinfo is None:
+                latest_remote_timestamp = latest_remote_timestamp.replace(tzinfo=timezone.utc)
+            guardar_validadores(tipo_contenido, response.headers, {"updated": latest_remote_timestamp.isoformat()})
             
     except Exception as e:
         logger.error(f"No se pudo comprobar la actualización para {tipo_contenido}: {e}")
@@ -1,34 +1,390 @@
+import asyncio
 import sqlite3
+import sys
+import threading
+import time
 import aiosqlite
 import httpx
 from contextlib import asynccontextmanager
 from utils.logger import setup_logger
 from config import DB_DECRYPTED_PATH, DB_ENCRYPTED_PATH
 import os
+from urllib.parse import quote
 from utils.cache import cache
+from utils.detection import detect_languages, detect_quality, detect_quality_spec
+from utils.crypt import encrypt_link, reveal_link
 
 
 logger = setup_logger(__name__)
 SEARCH_CACHE_TTL = 5 * 60
+# Por debajo del límite de parámetros por consulta de SQLite
+METADATA_BATCH_SIZE = 500
+# Con 'true' la primera búsqueda de un episodio carga y cachea la temporada completa
+SEASON_PREFETCH = os.getenv("SEASON_PREFETCH", "false").lower() == "true"
+cache.namespace("bd:search:", ttl=SEARCH_CACHE_TTL, max_bytes=16 * 1024 * 1024, priority=1)
+# Generación de la BD cargada en este proceso; las conexiones e índices en memoria van ligados a ella
+_DB_GENERATION = 0
+# Generación de caché: forma parte de las claves que dependen de la BD y solo avanza con los cambios
+# completos; los parches .up invalidan por etiqueta únicamente los títulos que tocan
+_CACHE_GENERATION = 0
+# Identificador del contenido cargado (ver `content_fingerprint` en utils.cargarbd): el contador es
+# propio de cada proceso, esto permite comprobar que todos los workers sirven la misma BD
+_DB_CONTENT = None
+# (dispositivo, inodo) de la BD publicada al avanzar la generación. Cada publicación es un fichero
+# nuevo renombrado sobre DB_DECRYPTED_PATH, así que otro inodo indica que otro worker publicó otra BD
+_DB_FILE_ID = None
+_DB_GENERATION_LOCK = threading.Lock()
+
+
+def bump_db_generation(keep_cache=False, content=None, db_file=None):
+    """
+    Avanza la generación de la BD tras cargarla o sustituirla.
+
+    Args:
+        keep_cache (bool): Si la nueva versión solo cambia títulos conocidos, se conserva la
+            generación de caché y quien publica invalida sus etiquetas. Si no, se invalidan de golpe
+            todas las entradas de caché calculadas sobre la versión anterior.
+        content (dict, optional): Identificador del contenido cargado en esta generación.
+        db_file (tuple, optional): `published_db_id()` de la BD cargada en esta generación.
+
+    Returns:
+        int: La nueva generación.
+    """
+    global _DB_GENERATION, _CACHE_GENERATION, _DB_CONTENT, _DB_FILE_ID
+    with _DB_GENERATION_LOCK:
+        _DB_GENERATION += 1
+        if not keep_cache:
+            _CACHE_GENERATION += 1
+        _DB_CONTENT = content
+        _DB_FILE_ID = db_file
+        generation = _DB_GENERATION
+    logger.info(f"Generación de la base de datos: {generation} (contenido: {content})")
+    return generation
+
+
+def db_generation():
+    """Devuelve la generación de la BD cargada actualmente, sin tocar el disco."""
+    return _DB_GENERATION
+
+
+def db_content():
+    """Devuelve el identificador del contenido de la BD cargada, registrado al avanzar la generación."""
+    return _DB_CONTENT
+
+
+def published_db_id():
+    """Devuelve (dispositivo, inodo) de la BD publicada, o None si aún no hay ninguna."""
+    try:
+        stat = os.stat(DB_DECRYPTED_PATH)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino
+
+
+def published_db_changed():
+    """
+    Indica si la BD publicada ya no es la que cargó este proceso, p. ej. porque otro worker
+    preparó y publicó una versión nueva mientras este esperaba su turno.
+    """
+    return published_db_id() != _DB_FILE_ID
+
+
+def cache_generation():
+    """Devuelve la generación que llevan las claves de caché calculadas sobre la BD."""
+    return _CACHE_GENERATION
+
+
+def media_tag(media_type, tmdb, *parts):
+    """
+    Etiqueta de caché de las entradas calculadas sobre las filas de un título.
+
+    Args:
+        media_type (str): 'movie' o 'series'.
+        tmdb (str or int): El ID de TMDB.
+        *parts: Temporada y episodio, o solo temporada para las entradas de temporada completa.
+
+    Returns:
+        str: La etiqueta, p. ej. 'bd:series:123:1:2'.
+    """
+    return ":".join(["bd", media_type, str(tmdb), *(str(part) for part in parts)])
+
+
+def changed_media_tags(changes):
+    """
+    Traduce las filas tocadas por un parche en las etiquetas de caché a invalidar.
+
+    Args:
+        changes (iterable): Tuplas (tipo, tmdb, temporada, episodio) con temporada y episodio
+            a None en las películas.
+
+    Returns:
+        set: Las etiquetas de los títulos, episodios y temporadas afectados.
+    """
+    tags = set()
+    for media_type, tmdb, season, episode in changes:
+        if media_type == "movie":
+            tags.add(media_tag("movie", tmdb))
+        else:
+            tags.add(media_tag("series", tmdb, season, episode))
+            tags.add(media_tag("series", tmdb, season))
+    return tags
+
+
+# 'immutable' abre la instantánea descifrada en solo lectura sin bloqueos ni comprobaciones de cambios
+# (el fichero no se modifica entre cargas y cada generación abre conexiones nuevas); 'normal' la abre como
+# una BD corriente.
+DB_READ_MODE = os.getenv("DB_READ_MODE", "immutable").lower()
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", str(16 * 1024)))
+# Con 'true' la BD se publica sin descifrar y cada enlace se descifra al devolverlo una búsqueda
+# (con un LRU acotado en utils.crypt), en lugar de descifrar la tabla entera en cada carga
+DB_LAZY_DECRYPT = os.getenv("DB_LAZY_DECRYPT", "false").lower() == "true"
+
+
+def _read_connect_args(path):
+    """Devuelve los argumentos de conexión de lectura según DB_READ_MODE."""
+    if DB_READ_MODE == "immutable":
+        return (f"file:{quote(os.path.abspath(path))}?mode=ro&immutable=1",), {"uri": True}
+    return (path,), {}
+
+
+def _read_pragmas():
+    return (
+        "PRAGMA query_only=ON;",
+        f"PRAGMA mmap_size={DB_MMAP_SIZE};",
+        f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB};",
+    )
+
+
+class _ReadPool:
+    """
+    Conexiones de solo lectura reutilizables sobre una generación concreta de la BD.
+
+    Se abren bajo demanda hasta `size` y se mantienen abiertas entre búsquedas. Al cambiar
+    la generación el pool se retira: las conexiones libres se cierran al momento y las que
+    están en uso al devolverse.
+    """
+
+    def __init__(self, path, generation, size):
+        self.path = path
+        self.generation = generation
+        self.loop = asyncio.get_running_loop()
+        self.retired = False
+        self._idle = []
+        self._available = asyncio.Semaphore(size)
+
+    async def acquire(self):
+        await self._available.acquire()
+        if self._idle:
+            return self._idle.pop()
+        try:
+            args, kwargs = _read_connect_args(self.path)
+            connection = await aiosqlite.connect(*args, **kwargs)
+            for pragma in _read_pragmas():
+                await connection.execute(pragma)
+            return connection
+        except BaseException:
+            self._available.release()
+            raise
+
+    async def release(self, connection, broken=False):
+        self._available.release()
+        if self.retired or broken:
+            await self._close(connection)
+        else:
+            self._idle.append(connection)
+
+    async def retire(self):
+        self.retired = True
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await self._close(connection)
+
+    async def _close(self, connection):
+        if self.loop is asyncio.get_running_loop():
+            await connection.close()
+        else:
+            # El bucle en el que se abrió ya no está en marcha: se para el hilo sin esperar
+            connection.stop()
+
+
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "4"))
+_READ_POOL = None
+# Con 'true' las búsquedas se resuelven en un índice en memoria construido en cada carga de la BD
+DB_MEMORY_INDEX = os.getenv("DB_MEMORY_INDEX", "false").lower() == "true"
+_MEMORY_INDEX = None
+
+
+class MemoryLinkIndex:
+    """
+    Índices en memoria de los enlaces de una generación de la BD.
+
+    `movies` asocia tmdb con sus filas y `episodes` (tmdb, temporada, episodio) con las suyas.
+    Las filas son tuplas (link, calidad, audio, info) con las cadenas repetidas internadas.
+    """
+
+    __slots__ = ("movies", "episodes", "generation")
+
+    def __init__(self, movies, episodes):
+        self.movies = movies
+        self.episodes = episodes
+        self.generation = None
+
+    def size_bytes(self):
+        """Aproxima la memoria ocupada contando una sola vez cada objeto compartido."""
+        seen = set()
+        total = 0
+        for index in (self.movies, self.episodes):
+            total += sys.getsizeof(index)
+            for key, rows in index.items():
+                total += sys.getsizeof(key) + sys.getsizeof(rows)
+                for row in rows:
+                    total += sys.getsizeof(row)
+                    for value in row:
+                        if id(value) not in seen:
+                            seen.add(id(value))
+                            total += sys.getsizeof(value)
+        return total
+
+
+def _intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def build_memory_index(db_path=DB_DECRYPTED_PATH):
+    """
+    Lee todos los enlaces de la BD y construye los índices en memoria.
+
+    Args:
+        db_path (str): Ruta de la BD descifrada.
+
+    Returns:
+        MemoryLinkIndex: Los índices listos para `install_memory_index`.
+    """
+    start = time.time()
+    movies = {}
+    episodes = {}
+    conn = sqlite3.connect(db_path)
+    try:
+        for link, calidad, audio, info, tmdb in conn.execute(
+            "SELECT link, calidad, audio, info, tmdb FROM enlaces_pelis"
+        ):
+            movies.setdefault(str(tmdb), []).append((link, _intern(calidad), _intern(audio), _intern(info)))
+        for link, calidad, audio, info, tmdb, temporada, episodio in conn.execute(
+            "SELECT link, calidad, audio, info, tmdb, temporada, episodio FROM enlaces_series"
+        ):
+            episodes.setdefault((str(tmdb), str(temporada), str(episodio)), []).append(
+                (link, _intern(calidad), _intern(audio), _intern(info))
+            )
+    finally:
+        conn.close()
+
+    # Las listas se congelan en tuplas: ocupan menos y nadie puede modificarlas por error
+    index = MemoryLinkIndex(
+        {key: tuple(rows) for key, rows in movies.items()},
+        {key: tuple(rows) for key, rows in episodes.items()},
+    )
+    logger.info(
+        f"Índice en memoria construido en {time.time() - start:.2f}s: {len(index.movies)} películas, "
+        f"{len(index.episodes)} episodios, ~{index.size_bytes() / (1024 * 1024):.1f} MB"
+    )
+    return index
+
+
+def install_memory_index(index):
+    """Publica el índice para la generación actual de la BD; con None se vuelve a SQLite."""
+    global _MEMORY_INDEX
+    if index is not None:
+        index.generation = db_generation()
+    _MEMORY_INDEX = index
+
+
+def _current_memory_index():
+    index = _MEMORY_INDEX
+    # Un índice de otra generación ya no refleja la BD servida
+    if index is not None and index.generation == db_generation():
+        return index
+    return None
+
+
+async def _get_read_pool():
+    global _READ_POOL
+    pool = _READ_POOL
+    loop = asyncio.get_running_loop()
+    if pool is not None and pool.path == DB_DECRYPTED_PATH and pool.generation == db_generation() and pool.loop is loop:
+        return pool
+    _READ_POOL = _ReadPool(DB_DECRYPTED_PATH, db_generation(), DB_READ_POOL_SIZE)
+    if pool is not None:
+        await pool.retire()
+    return _READ_POOL
+
+
+async def close_read_pool():
+    """Cierra las conexiones de lectura abiertas, p. ej. al apagar el servicio."""
+    global _READ_POOL
+    pool, _READ_POOL = _READ_POOL, None
+    if pool is not None:
+        await pool.retire()
 
 
 @asynccontextmanager
 async def get_cursor():
     """
-    Proporciona un cursor de base de datos asíncrono gestionando la conexión.
+    Proporciona un cursor de solo lectura sobre una conexión del pool de la generación actual.
 
     Yields:
-        aiosqlite.Cursor: Un cursor para ejecutar operaciones en la base de datos.
+        aiosqlite.Cursor: Un cursor para ejecutar consultas en la base de datos.
     """
-    connection = None
+    pool = await _get_read_pool()
+    connection = await pool.acquire()
+    broken = False
     try:
-        connection = await aiosqlite.connect(DB_DECRYPTED_PATH)
         cursor = await connection.cursor()
-        yield cursor
-        await connection.commit()
+        try:
+            yield cursor
+        finally:
+            await cursor.close()
+    except BaseException:
+        broken = True
+        raise
     finally:
-        if connection:
-            await connection.close()
+        await pool.release(connection, broken=broken)
+
+# Consultas de búsqueda en caliente. Los índices de abajo incluyen todas las columnas que leen,
+# así que SQLite las responde desde el índice sin volver a la tabla por cada fila.
+MOVIE_SEARCH_SQL = "SELECT link, calidad, audio, info FROM enlaces_pelis WHERE tmdb = ?"
+EPISODE_SEARCH_SQL = (
+    "SELECT link, calidad, audio, info FROM enlaces_series WHERE tmdb = ? AND temporada = ? AND episodio = ?"
+)
+SEASON_SEARCH_SQL = "SELECT episodio, link, calidad, audio, info FROM enlaces_series WHERE tmdb = ? AND temporada = ?"
+LINKS_METADATA_SQL = "SELECT link, calidad, audio, info FROM {table} WHERE link IN ({placeholders})"
+
+COVERING_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_enlaces_pelis_tmdb_cubriente "
+    "ON enlaces_pelis(tmdb, link, calidad, audio, info);",
+    "CREATE INDEX IF NOT EXISTS idx_enlaces_pelis_link_cubriente "
+    "ON enlaces_pelis(link, calidad, audio, info);",
+    "CREATE INDEX IF NOT EXISTS idx_enlaces_series_tmdb_season_episode_cubriente "
+    "ON enlaces_series(tmdb, temporada, episodio, link, calidad, audio, info);",
+    "CREATE INDEX IF NOT EXISTS idx_enlaces_series_link_cubriente "
+    "ON enlaces_series(link, calidad, audio, info);",
+)
+# Los índices anteriores son prefijos de los cubrientes: solo ocupaban espacio
+SUPERSEDED_INDEXES = (
+    "idx_enlaces_pelis_tmdb",
+    "idx_enlaces_pelis_link",
+    "idx_enlaces_series_tmdb_season_episode",
+    "idx_enlaces_series_link",
+)
+# Nombre -> (consulta, parámetros de ejemplo) que `uncovered_hot_queries` comprueba
+HOT_QUERIES = {
+    "movie": (MOVIE_SEARCH_SQL, ("0",)),
+    "episode": (EPISODE_SEARCH_SQL, ("0", 1, 1)),
+    "season": (SEASON_SEARCH_SQL, ("0", 1)),
+    "movie_links": (LINKS_METADATA_SQL.format(table="enlaces_pelis", placeholders="?,?"), ("a", "b")),
+    "series_links": (LINKS_METADATA_SQL.format(table="enlaces_series", placeholders="?,?"), ("a", "b")),
+}
+
 
 def setup_index(db_path=DB_DECRYPTED_PATH):
     """
@@ -42,18 +398,70 @@ def setup_index(db_path=DB_DECRYPTED_PATH):
     try:        
         # --- Creación de Índices para acelerar búsquedas ---
         logger.info("Creando índices para mejorar el rendimiento de las búsquedas...")
-        cursor.execute("PRAGMA journal_mode=WAL;")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_enlaces_pelis_tmdb ON enlaces_pelis(tmdb);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_enlaces_pelis_link ON enlaces_pelis(link);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_enlaces_series_tmdb_season_episode ON enlaces_series(tmdb, temporada, episodio);")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_enlaces_series_link ON enlaces_series(link);")
+        # La BD servida se sustituye renombrando el fichero: no puede depender de un WAL aparte,
+        # que quedaría asociado por nombre a la generación anterior
+        cursor.execute("PRAGMA journal_mode=DELETE;")
+        indexes_before = _index_names(cursor)
+        for index_name in SUPERSEDED_INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name};")
+        for create_index in COVERING_INDEXES:
+            cursor.execute(create_index)
+        # Estadísticas para que el planificador elija bien entre los índices. Una BD ya preparada
+        # (p. ej. al reiniciar sin cambios) las conserva y no se vuelve a recorrer entera
+        if _index_names(cursor) - indexes_before or not _has_statistics(cursor):
+            cursor.execute("ANALYZE;")
         
         conn.commit()
+        for name in uncovered_hot_queries(conn):
+            logger.warning(f"La consulta '{name}' no se resuelve solo con un índice cubriente")
         logger.info("La configuración de la base de datos ha finalizado con éxito.")
     finally:
         conn.close()
 
 
+def _index_names(cursor):
+    return {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def _has_statistics(cursor):
+    return cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'"
+    ).fetchone() is not None
+
+
+def publish_db(staged_path):
+    """
+    Sustituye de forma atómica la BD servida por una generación ya preparada.
+
+    Las conexiones abiertas siguen leyendo el fichero anterior hasta cerrarse; las nuevas
+    abren el publicado. Nadie ve nunca una BD a medio construir.
+
+    Args:
+        staged_path (str): Ruta de la BD descifrada, indexada y analizada.
+    """
+    os.replace(staged_path, DB_DECRYPTED_PATH)
+    logger.info(f"Nueva base de datos publicada en {DB_DECRYPTED_PATH}")
+
+
+def uncovered_hot_queries(conn):
+    """
+    Ejecuta EXPLAIN QUERY PLAN sobre las consultas de búsqueda y devuelve las que no se
+    resuelven solo con un índice cubriente (es decir, las que vuelven a leer la tabla).
+
+    Args:
+        conn (sqlite3.Connection): Conexión a una BD con los índices ya creados.
+
+    Returns:
+        list: Los nombres de HOT_QUERIES cuyo plan no es un recorrido solo de índice.
+    """
+    uncovered = []
+    for name, (sql, params) in HOT_QUERIES.items():
+        plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+        if not plan or not all("USING COVERING INDEX" in step for step in plan):
+            uncovered.append(name)
+    return uncovered
+
+
 def add_flag(db_path=DB_ENCRYPTED_PATH):
     """
     Prepara la base de datos: crea columnas necesarias y los índices para optimizar búsquedas.
@@ -93,16 +501,21 @@ async def search_movies(id):
     Returns:
         list: Una lista de tuplas (link, calidad, audio, info) asociados a la película.
     """
+    index = _current_memory_index()
+    if index is not None:
+        return _reveal_rows(index.movies.get(str(id), ()))
+
     cache_key = _search_cache_key("movie", id)
     cached_results = cache.get(cache_key)
     if cached_results is not None:
         return cached_results
 
+    generation = db_generation()
     async with get_cursor() as cursor:
-        await cursor.execute("SELECT link, calidad, audio, info FROM enlaces_pelis WHERE tmdb = ?", (id,))
+        await cursor.execute(MOVIE_SEARCH_SQL, (id,))
         rows = await cursor.fetchall()
-        results = [(row[0], row[1], row[2], row[3]) for row in rows]
-        cache.set(cache_key, results, ttl=SEARCH_CACHE_TTL)
+        results = _reveal_rows(rows)
+        _cache_search(cache_key, results, generation, media_tag("movie", id))
         return results
 
 async def search_tv_shows(id, season, episode):
@@ -117,47 +530,186 @@ async def search_tv_shows(id, season, episode):
     Returns:
         list: Una lista de tuplas (link, calidad, audio, info) asociados al episodio.
     """
+    index = _current_memory_index()
+    if index is not None:
+        return _reveal_rows(index.episodes.get((str(id), str(season), str(episode)), ()))
+
+    if SEASON_PREFETCH:
+        season_rows = await _search_season(id, season)
+        return list(season_rows.get(str(episode), ()))
+
     cache_key = _search_cache_key("series", id, season, episode)
     cached_results = cache.get(cache_key)
     if cached_results is not None:
         return cached_results
 
+    generation = db_generation()
     async with get_cursor() as cursor:
-        await cursor.execute(
-            "SELECT link, calidad, audio, info FROM enlaces_series WHERE tmdb = ? AND temporada = ? AND episodio = ?",
-            (id, season, episode)
-        )
+        await cursor.execute(EPISODE_SEARCH_SQL, (id, season, episode))
         rows = await cursor.fetchall()
-        results = [(row[0], row[1], row[2], row[3]) for row in rows]
-        cache.set(cache_key, results, ttl=SEARCH_CACHE_TTL)
+        results = _reveal_rows(rows)
+        _cache_search(cache_key, results, generation, media_tag("series", id, season, episode))
         return results
 
+async def _search_season(id, season):
+    """
+    Devuelve las filas de toda una temporada agrupadas por episodio, con una sola consulta
+    sobre el índice (tmdb, temporada, episodio) y cacheadas por temporada.
+
+    Returns:
+        dict: Episodio (str) -> lista de tuplas (link, calidad, audio, info).
+    """
+    cache_key = _search_cache_key("season", id, season)
+    cached_season = cache.get(cache_key)
+    if cached_season is not None:
+        return cached_season
+
+    generation = db_generation()
+    async with get_cursor() as cursor:
+        await cursor.execute(SEASON_SEARCH_SQL, (id, season))
+        rows = await cursor.fetchall()
+    season_rows = {}
+    for episodio, link, calidad, audio, info in rows:
+        season_rows.setdefault(str(episodio), []).append((reveal_link(link), calidad, audio, info))
+    _cache_search(cache_key, season_rows, generation, media_tag("series", id, season))
+    return season_rows
+
+def _reveal_rows(rows):
+    # Los enlaces que aún llegan cifrados (DB_LAZY_DECRYPT) se descifran aquí, solo los devueltos
+    return [(reveal_link(link), calidad, audio, info) for link, calidad, audio, info in rows]
+
 def _search_cache_key(media_type, *parts):
-    return f"bd:search:{media_type}:{_db_version()}:{':'.join(str(part) for part in parts)}"
+    return f"bd:search:{media_type}:{cache_generation()}:{':'.join(str(part) for part in parts)}"
 
-def _db_version():
-    try:
-        return os.stat(DB_DECRYPTED_PATH).st_mtime_ns
-    except OSError:
-        return 0
+def _cache_search(cache_key, results, generation, tag):
+    # Una búsqueda que empezó sobre la generación anterior no se guarda: su etiqueta ya pudo invalidarse
+    if generation == db_generation():
+        cache.set(cache_key, results, ttl=SEARCH_CACHE_TTL, tags=(tag,))
 
-def getMetadata(link, media_type):
+async def get_links_metadata(links, media_type):
     """
-    Obtiene metadatos (calidad, audio, info) para un enlace específico.
+    Obtiene en consultas asíncronas por lotes los metadatos (calidad, audio, info) de varios enlaces.
 
     Args:
-        link (str): El enlace cuyos metadatos se desean obtener.
+        links (list): Los enlaces cuyos metadatos se desean obtener.
         media_type (str): El tipo de medio ('movie' o 'series').
 
     Returns:
-        str: Una cadena de texto representando los metadatos encontrados.
+        dict: Enlace -> cadena de metadatos, la tupla (calidad, audio, info) como texto.
     """
-    conn = sqlite3.connect(DB_DECRYPTED_PATH)
-    cursor = conn.cursor()
+    table = "enlaces_pelis" if media_type == "movie" else "enlaces_series"
+    unique_links = list(dict.fromkeys(links))
+    if DB_LAZY_DECRYPT:
+        # En la BD cifrada se busca también la forma cifrada de cada enlace
+        unique_links = list(dict.fromkeys([*unique_links, *(encrypt_link(link) for link in unique_links)]))
+    metadata = {}
+    async with get_cursor() as cursor:
+        for start in range(0, len(unique_links), METADATA_BATCH_SIZE):
+            batch = unique_links[start:start + METADATA_BATCH_SIZE]
+            placeholders = ",".join("?" for _ in batch)
+            await cursor.execute(LINKS_METADATA_SQL.format(table=table, placeholders=placeholders), batch)
+            for link, calidad, audio, info in await cursor.fetchall():
+                metadata.setdefault(reveal_link(link), str((calidad, audio, info)))
+    return metadata
+
+DETECTIONS_TABLE = "detecciones"
+_DETECTIONS = None
+_DETECTIONS_GENERATION = None
+
+
+def _detection_text(calidad, audio, info):
+    # El mismo texto sobre el que se detectaba al servir cada enlace
+    return " ".join(filter(None, [calidad, audio, info]))
+
+
+def materialize_detections(db_path=DB_DECRYPTED_PATH, force=False):
+    """
+    Precalcula calidad, idiomas y especificaciones de cada combinación distinta de
+    calidad/audio/info de la BD y las guarda en una tabla auxiliar.
+
+    Solo dependen del contenido de la BD, así que se calculan una vez por descarga en lugar
+    de en cada petición. Si la tabla ya existe y no se fuerza, se reutiliza.
+
+    Args:
+        db_path (str): Ruta de la BD descifrada.
+        force (bool): Recalcular aunque la tabla ya exista (p. ej. tras una descarga nueva).
+    """
+    start = time.time()
+    conn = sqlite3.connect(db_path)
     try:
-        table = "enlaces_pelis" if media_type == "movie" else "enlaces_series"
-        cursor.execute(f"SELECT calidad, audio, info FROM {table} WHERE link = ?", (link,))
-        metadata = cursor.fetchone()
-        return str(metadata) if metadata else ""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (DETECTIONS_TABLE,)
+        ).fetchone()
+        if exists and not force:
+            logger.info("Detecciones precalculadas ya presentes en la base de datos.")
+            return
+
+        combinations = conn.execute(
+            "SELECT DISTINCT COALESCE(calidad, ''), COALESCE(audio, ''), COALESCE(info, '') FROM enlaces_pelis "
+            "UNION SELECT DISTINCT COALESCE(calidad, ''), COALESCE(audio, ''), COALESCE(info, '') FROM enlaces_series"
+        ).fetchall()
+        rows = []
+        for calidad, audio, info in combinations:
+            text = _detection_text(calidad, audio, info)
+            rows.append((
+                calidad, audio, info,
+                detect_quality(text),
+                ",".join(detect_languages(text)),
+                ",".join(detect_quality_spec(text) or []),
+            ))
+
+        with conn:
+            conn.execute(f"DROP TABLE IF EXISTS {DETECTIONS_TABLE}")
+            conn.execute(
+                f"CREATE TABLE {DETECTIONS_TABLE} (calidad TEXT, audio TEXT, info TEXT, calidad_detectada TEXT, "
+                "idiomas TEXT, especificaciones TEXT, PRIMARY KEY (calidad, audio, info)) WITHOUT ROWID"
+            )
+            conn.executemany(f"INSERT INTO {DETECTIONS_TABLE} VALUES (?, ?, ?, ?, ?, ?)", rows)
+        logger.info(f"Detecciones precalculadas para {len(rows)} combinaciones en {time.time() - start:.2f}s.")
     finally:
         conn.close()
+
+
+def load_detections(db_path=DB_DECRYPTED_PATH):
+    """
+    Carga en memoria la tabla de detecciones precalculadas.
+
+    Returns:
+        dict: (calidad, audio, info) -> (calidad detectada, tupla de idiomas, tupla de especificaciones o None).
+    """
+    conn = sqlite3.connect(db_path)
+    try:
+        rows = conn.execute(
+            f"SELECT calidad, audio, info, calidad_detectada, idiomas, especificaciones FROM {DETECTIONS_TABLE}"
+        ).fetchall()
+    finally:
+        conn.close()
+    return {
+        (calidad, audio, info): (
+            sys.intern(quality),
+            tuple(sys.intern(language) for language in languages.split(",")),
+            tuple(sys.intern(spec) for spec in specs.split(",")) if specs else None,
+        )
+        for calidad, audio, info, quality, languages, specs in rows
+    }
+
+
+def install_detections(detections):
+    """Publica las detecciones para la generación actual de la BD; con None se vuelve a las regex."""
+    global _DETECTIONS, _DETECTIONS_GENERATION
+    _DETECTIONS = detections
+    _DETECTIONS_GENERATION = db_generation()
+
+
+def get_detection(calidad, audio, info):
+    """
+    Devuelve la detección precalculada para los metadatos de un enlace de la BD.
+
+    Returns:
+        tuple | None: (calidad, idiomas, especificaciones) o None si no hay detecciones cargadas.
+    """
+    detections = _DETECTIONS
+    if detections is None or _DETECTIONS_GENERATION != db_generation():
+        return None
+    return detections.get((calidad or "", audio or "", info or ""))
+
@@ -1,32 +1,601 @@
+import asyncio
+import heapq
+import os
+import sys
 import time
-from typing import Dict, Any, Optional
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
 
-class CacheManager:
-    def __init__(self):
-        self._store: Dict[str, Dict[str, Any]] = {}
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "50000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(128 * 1024 * 1024)))
+# Segundo nivel opcional: 'memory' (solo proceso), o 'redis' para compartirlo entre workers/nodos.
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "")
+CACHE_REDIS_PREFIX = os.getenv("CACHE_REDIS_PREFIX", "ndk:")
+# Ruta del segundo nivel en disco (SQLite) cuando no se usa Redis; vacío lo desactiva.
+CACHE_DISK_PATH = os.getenv("CACHE_DISK_PATH", "")
+DEFAULT_TTL = 1800
+DEFAULT_NAMESPACE = "default"
+_SIZE_MAX_DEPTH = 4
+# Claves muertas que se toleran en el índice de etiquetas antes de limpiarlo
+TAG_INDEX_SLACK = 1024
+
+
+def estimate_size(value: Any, _depth: int = 0) -> int:
+    """
+    Aproxima los bytes que ocupa un valor en memoria recorriendo sus contenedores.
+
+    Args:
+        value (Any): El valor a medir.
+
+    Returns:
+        int: Tamaño aproximado en bytes.
+    """
+    size = sys.getsizeof(value)
+    if _depth >= _SIZE_MAX_DEPTH or isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return size
+
+    if isinstance(value, dict):
+        return size + sum(
+            estimate_size(k, _depth + 1) + estimate_size(v, _depth + 1)
+            for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return size + sum(estimate_size(item, _depth + 1) for item in value)
+    if hasattr(value, "__dict__"):
+        return size + estimate_size(vars(value), _depth + 1)
+    return size
+
+
+class _Entry:
+    """Entrada de la caché. Con __slots__ ocupa menos que un dict o una tupla de tres campos."""
+
+    __slots__ = ("value", "expire", "size")
 
-    def set(self, key: str, value: Any, ttl: int = 1800) -> None:
-        self._store[key] = {
-            'data': value,
-            'expire': time.time() + ttl
+    def __init__(self, value: Any, expire: float, size: int):
+        self.value = value
+        self.expire = expire
+        self.size = size
+
+
+class CacheNamespace:
+    """
+    Segmento de la caché para las claves que empiezan por un prefijo.
+
+    Cada espacio tiene su propio TTL por defecto, límites de entradas y bytes,
+    una prioridad de desalojo (las de menor prioridad se desalojan antes cuando
+    se supera el presupuesto global) y contadores de aciertos, fallos y desalojos.
+    Los espacios con `persist` se replican en el segundo nivel si hay uno configurado.
+    Con `grace` las entradas caducadas se conservan ese tiempo extra para poder servirse
+    obsoletas mediante `CacheManager.get_stale` mientras se recalculan.
+    Las expiraciones se agrupan en colas FIFO por TTL: dentro de una misma cola las
+    entradas caducan en orden de inserción, así que purgar es O(1) amortizado. Las
+    entradas recuperadas del segundo nivel, con caducidades arbitrarias, van a un heap.
+    Cada marca es solo (expire, key) y comparte el float de caducidad con la entrada.
+    """
+
+    def __init__(self, prefix: str, ttl: int = DEFAULT_TTL, max_entries: Optional[int] = None,
+                 max_bytes: Optional[int] = None, priority: int = 0, persist: bool = False,
+                 grace: int = 0):
+        self.prefix = prefix
+        self.ttl = ttl
+        self.grace = grace
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.priority = priority
+        self.persist = persist
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.tier_hits = 0
+        self.stale_hits = 0
+        self.bytes = 0
+        # key -> _Entry; el orden del OrderedDict es el orden LRU
+        self._store: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Marcas (expire, key); una marca vence cuando además ha pasado el periodo de gracia
+        self._expiry: Dict[int, Deque[Tuple[float, str]]] = {}
+        self._restored_expiry: List[Tuple[float, str]] = []
+        self._expiry_markers = 0
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._store),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "tier_hits": self.tier_hits,
+            "stale_hits": self.stale_hits,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "ttl": self.ttl,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "priority": self.priority,
+            "persist": self.persist,
+            "grace": self.grace,
         }
 
-    def get(self, key: str) -> Optional[Any]:
+    def _put(self, key: str, value: Any, ttl: int, now: float) -> float:
+        expire = now + ttl
+        self._store_entry(key, value, expire)
+        self._expiry.setdefault(ttl, deque()).append((expire, key))
+        self._expiry_markers += 1
+        return expire
+
+    def _restore(self, key: str, value: Any, expire: float) -> None:
+        self._store_entry(key, value, expire)
+        heapq.heappush(self._restored_expiry, (expire, key))
+        self._expiry_markers += 1
+
+    def _store_entry(self, key: str, value: Any, expire: float) -> None:
+        size = estimate_size(key) + estimate_size(value)
+        self._remove(key)
+        self._store[key] = _Entry(value, expire, size)
+        self.bytes += size
+
+    def _get(self, key: str, now: float, allow_stale: bool = False) -> Tuple[bool, Any, bool]:
         item = self._store.get(key)
-        if not item:
-            return None
-        
-        if time.time() > item['expire']:
-            del self._store[key]
-            return None
-            
-        return item['data']
+        if item is None:
+            self.misses += 1
+            return False, None, False
+
+        if now > item.expire:
+            if now > item.expire + self.grace:
+                self._remove(key)
+            elif allow_stale:
+                self._store.move_to_end(key)
+                self.stale_hits += 1
+                return True, item.value, True
+            self.misses += 1
+            return False, None, False
+
+        self._store.move_to_end(key)
+        self.hits += 1
+        return True, item.value, False
+
+    def _remove(self, key: str) -> int:
+        item = self._store.pop(key, None)
+        if item is None:
+            return 0
+        self.bytes -= item.size
+        return item.size
+
+    def _evict_oldest(self) -> int:
+        _, item = self._store.popitem(last=False)
+        self.bytes -= item.size
+        self.evictions += 1
+        return item.size
+
+    def _over_limits(self) -> bool:
+        return bool(self._store) and (
+            (self.max_entries is not None and len(self._store) > self.max_entries)
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+        )
+
+    def _purge_expired(self, now: float) -> None:
+        deadline = now - self.grace
+        for queue in self._expiry.values():
+            while queue and queue[0][0] <= deadline:
+                self._drop_marker(queue.popleft())
+        while self._restored_expiry and self._restored_expiry[0][0] <= deadline:
+            self._drop_marker(heapq.heappop(self._restored_expiry))
+
+        # Las marcas de claves reescritas o desalojadas se acumulan hasta caducar;
+        # si superan con holgura al número de entradas, se reconstruyen las colas.
+        if self._expiry_markers > 2 * len(self._store) + 1024:
+            self._rebuild_expiry()
+
+    def _drop_marker(self, marker: Tuple[float, str]) -> None:
+        self._expiry_markers -= 1
+        # Si la clave se reescribió, su marca antigua ya no corresponde
+        if self._is_live(marker):
+            self._remove(marker[1])
+
+    def _rebuild_expiry(self) -> None:
+        queues: Dict[int, Deque[Tuple[float, str]]] = {}
+        for ttl, queue in self._expiry.items():
+            live = [marker for marker in queue if self._is_live(marker)]
+            if live:
+                queues[ttl] = deque(live)
+        self._expiry = queues
+        self._restored_expiry = [marker for marker in self._restored_expiry if self._is_live(marker)]
+        heapq.heapify(self._restored_expiry)
+        self._expiry_markers = sum(len(queue) for queue in queues.values()) + len(self._restored_expiry)
+
+    def _is_live(self, marker: Tuple[float, str]) -> bool:
+        item = self._store.get(marker[1])
+        return item is not None and item.expire == marker[0]
+
+    def _clear(self) -> None:
+        self._store.clear()
+        self._expiry.clear()
+        self._restored_expiry.clear()
+        self._expiry_markers = 0
+        self.bytes = 0
+
+
+class CacheManager:
+    """
+    Caché en memoria con expiración por TTL y desalojo LRU, repartida en espacios de nombres.
+
+    Las claves se asignan al espacio cuyo prefijo más largo coincide; el resto cae en
+    el espacio por defecto. El total está acotado por número de entradas y por un
+    presupuesto aproximado de bytes.
+
+    Opcionalmente se le acopla un segundo nivel (ver `utils.cache_backends`): las claves de
+    espacios con `persist` se leen a través de él cuando faltan en memoria y se le
+    escriben en diferido.
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._default = CacheNamespace("", priority=1)
+        self._namespaces: Dict[str, CacheNamespace] = {}
+        self._prefixes: List[str] = []
+        self._entries = 0
+        self._bytes = 0
+        self._tier = None
+        # Etiqueta -> claves; permite invalidar juntas entradas de espacios distintos
+        self._tags: Dict[str, Set[str]] = {}
+        self._tagged = 0
+
+    def namespace(self, prefix: str, ttl: int = DEFAULT_TTL, max_entries: Optional[int] = None,
+                  max_bytes: Optional[int] = None, priority: int = 0, persist: bool = False,
+                  grace: int = 0) -> CacheNamespace:
+        """
+        Declara (o actualiza) la política de las claves que empiezan por `prefix`.
+
+        Args:
+            prefix (str): Prefijo de las claves, p. ej. 'stream:response:'. Con '' se
+                ajusta el espacio por defecto.
+            ttl (int): TTL por defecto cuando `set` no recibe uno.
+            max_entries (int, optional): Máximo de entradas del espacio.
+            max_bytes (int, optional): Presupuesto aproximado de bytes del espacio.
+            priority (int): Las prioridades más bajas se desalojan primero.
+            persist (bool): Si sus entradas se replican en el segundo nivel.
+            grace (int): Segundos que una entrada caducada sigue disponible para `get_stale`.
+
+        Returns:
+            CacheNamespace: El espacio declarado.
+        """
+        ns = self._default if prefix == "" else self._namespaces.get(prefix)
+        if ns is None:
+            ns = CacheNamespace(prefix, ttl, max_entries, max_bytes, priority, persist, grace)
+            self._namespaces[prefix] = ns
+            self._prefixes = sorted(self._namespaces, key=len, reverse=True)
+        else:
+            ns.ttl = ttl
+            ns.max_entries = max_entries
+            ns.max_bytes = max_bytes
+            ns.priority = priority
+            ns.persist = persist
+            ns.grace = grace
+        return ns
+
+    def attach_tier(self, tier, warm: bool = True) -> None:
+        """
+        Acopla un segundo nivel de caché y, opcionalmente, precarga en memoria sus entradas vigentes.
+
+        Args:
+            tier: Objeto con la interfaz de `utils.cache_backends` (get_many, set_many, ...).
+            warm (bool): Si se cargan en memoria las entradas ya guardadas en el nivel.
+        """
+        self._tier = tier
+        if not warm:
+            return
+
+        now = time.time()
+        restored = 0
+        try:
+            for key, value, expire in tier.iter_entries(now):
+                if self._entries >= self.max_entries or self._bytes >= self.max_bytes:
+                    break
+                ns = self._resolve(key)
+                if not ns.persist or key in ns._store:
+                    continue
+                ns._restore(key, value, expire)
+                self._enforce_limits(ns)
+                restored += 1
+        except Exception as e:
+            logger.error(f"Error precargando la caché desde el segundo nivel: {e}")
+        logger.info(f"Caché precargada desde el segundo nivel con {restored} entradas.")
+
+    def detach_tier(self) -> None:
+        """Vuelca las escrituras pendientes y cierra el segundo nivel."""
+        tier, self._tier = self._tier, None
+        if tier is not None:
+            tier.close()
+
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, tags: Iterable[str] = ()) -> None:
+        now = time.time()
+        ns = self._resolve(key)
+        expire = ns._put(key, value, ns.ttl if ttl is None else ttl, now)
+        if ns.persist and self._tier is not None:
+            self._tier.set_many([(key, value, expire)])
+        for tag in tags:
+            keys = self._tags.setdefault(tag, set())
+            if key not in keys:
+                keys.add(key)
+                self._tagged += 1
+        self._purge_expired(now)
+        self._enforce_limits(ns)
+        if self._tagged > 2 * self._entries + TAG_INDEX_SLACK:
+            self._prune_tags()
+
+    def invalidate_tag(self, tag: str) -> int:
+        """
+        Elimina todas las entradas guardadas con la etiqueta, sea cual sea su espacio.
+
+        Args:
+            tag (str): La etiqueta indicada en `set`.
+
+        Returns:
+            int: Número de entradas eliminadas.
+        """
+        keys = self._tags.pop(tag, ())
+        self._tagged -= len(keys)
+        removed = 0
+        for key in keys:
+            ns = self._resolve(key)
+            if ns.persist and self._tier is not None:
+                self._tier.delete_many([key])
+            if key in ns._store:
+                ns._remove(key)
+                removed += 1
+        if removed:
+            self._sync_totals()
+        return removed
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Recupera una clave. En los espacios con `persist` un fallo en memoria se lee del segundo
+        nivel en este mismo hilo: desde el bucle de eventos hay que usar `get_async`.
+        """
+        ns = self._resolve(key)
+        now = time.time()
+        entries = len(ns)
+        found, value, _ = ns._get(key, now)
+        if not found and ns.persist and self._tier is not None:
+            found, value = self._read_through(ns, key, now)
+        if len(ns) != entries:
+            self._sync_totals()
+        return value if found else None
+
+    async def get_async(self, key: str) -> Optional[Any]:
+        """
+        Como `get`, pero si la clave falta en memoria y hay que pedirla al segundo nivel, la
+        lectura se hace en un hilo del executor. Es la que debe usarse desde el bucle de eventos
+        para las claves de espacios con `persist`.
+
+        Args:
+            key (str): La clave a recuperar.
+
+        Returns:
+            El valor guardado o None.
+        """
+        return (await self.get_many_async([key])).get(key)
+
+    def get_stale(self, key: str) -> Tuple[Optional[Any], bool]:
+        """
+        Como `get`, pero dentro del periodo de gracia del espacio devuelve también la entrada caducada.
+
+        Args:
+            key (str): La clave a recuperar.
+
+        Returns:
+            tuple: (valor o None, True si el valor está caducado y conviene recalcularlo).
+        """
+        ns = self._resolve(key)
+        now = time.time()
+        entries = len(ns)
+        found, value, stale = ns._get(key, now, allow_stale=True)
+        if not found and ns.persist and self._tier is not None:
+            found, value = self._read_through(ns, key, now)
+        if len(ns) != entries:
+            self._sync_totals()
+        return (value, stale) if found else (None, False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Recupera varias claves a la vez; las que faltan en memoria se piden al segundo nivel
+        en una sola operación (un MGET en Redis, una consulta en SQLite).
+
+        Args:
+            keys (list): Las claves a recuperar.
+
+        Returns:
+            dict: Los valores encontrados, indexados por clave.
+        """
+        now = time.time()
+        found, missing = self._get_many_local(keys, now)
+        if missing:
+            self._restore_many(self._tier_get_many(self._tier, missing), now, found)
+        self._sync_totals()
+        return found
+
+    async def get_many_async(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Como `get_many`, pero la lectura del segundo nivel se hace en un hilo del executor para
+        que un Redis lento o inaccesible no bloquee el bucle de eventos.
+
+        Args:
+            keys (list): Las claves a recuperar.
+
+        Returns:
+            dict: Los valores encontrados, indexados por clave.
+        """
+        now = time.time()
+        found, missing = self._get_many_local(keys, now)
+        if missing:
+            loop = asyncio.get_running_loop()
+            items = await loop.run_in_executor(None, self._tier_get_many, self._tier, missing)
+            self._restore_many(items, now, found)
+        self._sync_totals()
+        return found
 
     def delete(self, key: str) -> None:
-        if key in self._store:
-            del self._store[key]
+        ns = self._resolve(key)
+        if ns.persist and self._tier is not None:
+            self._tier.delete_many([key])
+        if ns._remove(key):
+            self._sync_totals()
+
+    def invalidate_namespace(self, prefix: str) -> int:
+        """
+        Vacía un espacio de nombres sin tocar el resto, p. ej. el que depende de una BD ya sustituida.
+
+        Args:
+            prefix (str): Prefijo con el que se declaró el espacio.
+
+        Returns:
+            int: Número de entradas eliminadas.
+        """
+        ns = self._default if prefix == "" else self._namespaces.get(prefix)
+        if ns is None:
+            return 0
+        keys = list(ns._store)
+        if keys and ns.persist and self._tier is not None:
+            self._tier.delete_many(keys)
+        ns._clear()
+        self._sync_totals()
+        return len(keys)
 
     def clear(self) -> None:
-        self._store.clear()
+        self._tags.clear()
+        self._tagged = 0
+        for ns in self._all_namespaces():
+            ns._clear()
+        if self._tier is not None:
+            self._tier.clear()
+        self._entries = 0
+        self._bytes = 0
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Devuelve los contadores de cada espacio de nombres.
+
+        Returns:
+            dict: Contadores indexados por prefijo ('default' para el espacio por defecto).
+        """
+        result = {ns.prefix or DEFAULT_NAMESPACE: ns.stats() for ns in self._all_namespaces()}
+        result["total"] = {
+            "entries": self._entries,
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+        }
+        return result
+
+    def __len__(self) -> int:
+        return self._entries
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def _get_many_local(self, keys: List[str], now: float) -> Tuple[Dict[str, Any], List[str]]:
+        found: Dict[str, Any] = {}
+        missing: List[str] = []
+        for key in keys:
+            ns = self._resolve(key)
+            hit, value, _ = ns._get(key, now)
+            if hit:
+                found[key] = value
+            elif ns.persist and self._tier is not None:
+                missing.append(key)
+        return found, missing
+
+    @staticmethod
+    def _tier_get_many(tier, keys: List[str]) -> Dict[str, Tuple[Any, float]]:
+        try:
+            return tier.get_many(keys)
+        except Exception as e:
+            logger.error(f"Error leyendo {len(keys)} claves del segundo nivel de caché: {e}")
+            return {}
+
+    def _restore_many(self, items: Dict[str, Tuple[Any, float]], now: float, found: Dict[str, Any]) -> None:
+        restored = {}
+        for key, (value, expire) in items.items():
+            if expire <= now:
+                continue
+            ns = self._resolve(key)
+            # Si se escribió en memoria mientras se leía el segundo nivel, prevalece lo escrito
+            item = ns._store.get(key)
+            if item is not None and item.expire > now:
+                found[key] = item.value
+                continue
+            ns._restore(key, value, expire)
+            ns.tier_hits += 1
+            restored[ns.prefix] = ns
+            found[key] = value
+        for ns in restored.values():
+            self._enforce_limits(ns)
+
+    def _read_through(self, ns: CacheNamespace, key: str, now: float) -> Tuple[bool, Any]:
+        try:
+            item = self._tier.get_many([key]).get(key)
+        except Exception as e:
+            logger.error(f"Error leyendo '{ns.prefix or DEFAULT_NAMESPACE}' del segundo nivel de caché: {e}")
+            return False, None
+
+        if item is None or item[1] <= now:
+            return False, None
+
+        value, expire = item
+        ns._restore(key, value, expire)
+        ns.tier_hits += 1
+        self._enforce_limits(ns)
+        return True, value
+
+    def _resolve(self, key: str) -> CacheNamespace:
+        for prefix in self._prefixes:
+            if key.startswith(prefix):
+                return self._namespaces[prefix]
+        return self._default
+
+    def _prune_tags(self) -> None:
+        # Las claves caducadas o desalojadas siguen en el índice de etiquetas hasta esta limpieza
+        tags = {}
+        for tag, keys in self._tags.items():
+            alive = {key for key in keys if key in self._resolve(key)._store}
+            if alive:
+                tags[tag] = alive
+        self._tags = tags
+        self._tagged = sum(len(keys) for keys in tags.values())
+
+    def _all_namespaces(self) -> List[CacheNamespace]:
+        return [self._default, *self._namespaces.values()]
+
+    def _sync_totals(self) -> None:
+        namespaces = self._all_namespaces()
+        self._entries = sum(len(ns) for ns in namespaces)
+        self._bytes = sum(ns.bytes for ns in namespaces)
+
+    def _purge_expired(self, now: float) -> None:
+        for ns in self._all_namespaces():
+            ns._purge_expired(now)
+        self._sync_totals()
+
+    def _enforce_limits(self, ns: CacheNamespace) -> None:
+        while ns._over_limits():
+            ns._evict_oldest()
+        self._sync_totals()
+
+        while self._entries > self.max_entries or self._bytes > self.max_bytes:
+            victim = min(
+                (candidate for candidate in self._all_namespaces() if len(candidate)),
+                key=lambda candidate: (candidate.priority, -candidate.bytes),
+            )
+            self._bytes -= victim._evict_oldest()
+            self._entries -= 1
 
 cache = CacheManager()
@@ -0,0 +1,333 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+DELETED = object()
+
+
+class SQLiteCacheTier:
+    """
+    Segundo nivel de caché en un fichero SQLite local, para sobrevivir a reinicios.
+
+    Los valores se serializan con pickle. Las lecturas y las escrituras usan conexiones
+    distintas sobre WAL para que el volcado en segundo plano no bloquee las lecturas.
+    """
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL;")
+        self._writer.execute("PRAGMA synchronous=NORMAL;")
+        self._writer.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expire REAL NOT NULL) WITHOUT ROWID"
+        )
+        self._writer.execute("CREATE INDEX IF NOT EXISTS idx_cache_expire ON cache(expire);")
+        self._writer.commit()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[Any, float]]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" for _ in keys)
+        with self._read_lock:
+            rows = self._reader.execute(
+                f"SELECT key, value, expire FROM cache WHERE key IN ({placeholders})", keys
+            ).fetchall()
+        return {key: (pickle.loads(value), expire) for key, value, expire in rows}
+
+    def set_many(self, items: Iterable[Tuple[str, Any, float]]) -> None:
+        rows = []
+        for key, value, expire in items:
+            try:
+                rows.append((key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), expire))
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.warning(f"No se puede persistir la clave de caché '{key}': {e}")
+        if not rows:
+            return
+        with self._write_lock:
+            self._writer.executemany("INSERT OR REPLACE INTO cache (key, value, expire) VALUES (?, ?, ?)", rows)
+            self._writer.commit()
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        rows = [(key,) for key in keys]
+        if not rows:
+            return
+        with self._write_lock:
+            self._writer.executemany("DELETE FROM cache WHERE key = ?", rows)
+            self._writer.commit()
+
+    def clear(self) -> None:
+        with self._write_lock:
+            self._writer.execute("DELETE FROM cache")
+            self._writer.commit()
+
+    def iter_entries(self, now: float) -> Iterator[Tuple[str, Any, float]]:
+        """Recorre las entradas vigentes, de la que caduca más tarde a la que antes."""
+        with self._read_lock:
+            rows = self._reader.execute(
+                "SELECT key, value, expire FROM cache WHERE expire > ? ORDER BY expire DESC", (now,)
+            ).fetchall()
+        for key, value, expire in rows:
+            yield key, pickle.loads(value), expire
+
+    def purge_expired(self, now: float) -> None:
+        with self._write_lock:
+            self._writer.execute("DELETE FROM cache WHERE expire <= ?", (now,))
+            self._writer.commit()
+
+    def close(self) -> None:
+        with self._write_lock, self._read_lock:
+            self._writer.close()
+            self._reader.close()
+
+
+class RedisCacheTier:
+    """
+    Segundo nivel de caché compartido en un servidor con protocolo Redis.
+
+    Permite que varios workers o nodos compartan los aciertos. Las lecturas en bloque
+    usan MGET y las escrituras van en un pipeline sin transacción; la caducidad la
+    gestiona el propio servidor con PX. Cada valor se guarda junto a su caducidad
+    absoluta para poder repoblar la memoria local con el TTL restante.
+    """
+
+    def __init__(self, url: str, prefix: str = "ndk:", client=None, scan_count: int = 500):
+        if client is None:
+            import redis
+            # RESP2 para funcionar también con servidores compatibles que no implementan HELLO
+            client = redis.Redis.from_url(url, protocol=2, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.client = client
+        self.prefix = prefix
+        self.scan_count = scan_count
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[Any, float]]:
+        if not keys:
+            return {}
+        blobs = self.client.mget([self.prefix + key for key in keys])
+        return {key: pickle.loads(blob) for key, blob in zip(keys, blobs) if blob is not None}
+
+    def set_many(self, items: Iterable[Tuple[str, Any, float]]) -> None:
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        queued = 0
+        for key, value, expire in items:
+            ttl_ms = int((expire - now) * 1000)
+            if ttl_ms <= 0:
+                continue
+            try:
+                blob = pickle.dumps((value, expire), protocol=pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.warning(f"No se puede compartir la clave de caché '{key}': {e}")
+                continue
+            pipe.set(self.prefix + key, blob, px=ttl_ms)
+            queued += 1
+        if queued:
+            pipe.execute()
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        prefixed = [self.prefix + key for key in keys]
+        if prefixed:
+            self.client.delete(*prefixed)
+
+    def clear(self) -> None:
+        batch = []
+        for key in self.client.scan_iter(match=f"{self.prefix}*", count=self.scan_count):
+            batch.append(key)
+            if len(batch) >= self.scan_count:
+                self.client.delete(*batch)
+                batch = []
+        if batch:
+            self.client.delete(*batch)
+
+    def iter_entries(self, now: float) -> Iterator[Tuple[str, Any, float]]:
+        batch = []
+        for key in self.client.scan_iter(match=f"{self.prefix}*", count=self.scan_count):
+            batch.append(key)
+            if len(batch) >= self.scan_count:
+                yield from self._load_batch(batch, now)
+                batch = []
+        if batch:
+            yield from self._load_batch(batch, now)
+
+    def purge_expired(self, now: float) -> None:
+        # El servidor caduca las claves por sí mismo
+        return None
+
+    def close(self) -> None:
+        self.client.close()
+
+    def _load_batch(self, keys: List[bytes], now: float) -> Iterator[Tuple[str, Any, float]]:
+        for raw_key, blob in zip(keys, self.client.mget(keys)):
+            if blob is None:
+                continue
+            value, expire = pickle.loads(blob)
+            if expire > now:
+                key = raw_key.decode("utf-8") if isinstance(raw_key, bytes) else raw_key
+                yield key[len(self.prefix):], value, expire
+
+
+class WriteBehindTier:
+    """
+    Envoltorio que acumula escrituras y borrados y los vuelca en lote desde un hilo.
+
+    Las lecturas consultan primero lo pendiente para que se vean las propias escrituras.
+    """
+
+    def __init__(self, tier, flush_interval: float = 2.0, max_pending: int = 500,
+                 purge_interval: float = 15 * 60):
+        self.tier = tier
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.purge_interval = purge_interval
+        self._pending: Dict[str, Tuple[Any, float]] = {}
+        self._flushing: Dict[str, Tuple[Any, float]] = {}
+        self._flush_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._last_purge = time.time()
+        self._thread = threading.Thread(target=self._run, name="cache-write-behind", daemon=True)
+        self._thread.start()
+
+    def get_many(self, keys: List[str]) -> Dict[str, Tuple[Any, float]]:
+        found: Dict[str, Tuple[Any, float]] = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                item = self._pending.get(key) or self._flushing.get(key)
+                if item is None:
+                    missing.append(key)
+                elif item[0] is not DELETED:
+                    found[key] = item
+        if missing:
+            found.update(self.tier.get_many(missing))
+        return found
+
+    def set_many(self, items: Iterable[Tuple[str, Any, float]]) -> None:
+        with self._lock:
+            for key, value, expire in items:
+                self._pending[key] = (value, expire)
+            pending = len(self._pending)
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def delete_many(self, keys: Iterable[str]) -> None:
+        with self._lock:
+            for key in keys:
+                self._pending[key] = (DELETED, 0.0)
+
+    def clear(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                self._pending.clear()
+            self.tier.clear()
+
+    def iter_entries(self, now: float) -> Iterator[Tuple[str, Any, float]]:
+        self.flush()
+        return self.tier.iter_entries(now)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._flushing = pending
+            if not pending:
+                return
+
+            deleted = [key for key, (value, _) in pending.items() if value is DELETED]
+            written = [(key, value, expire) for key, (value, expire) in pending.items() if value is not DELETED]
+            try:
+                self.tier.delete_many(deleted)
+                self.tier.set_many(written)
+            except Exception as e:
+                logger.error(f"Error volcando {len(pending)} entradas al segundo nivel de caché: {e}")
+            finally:
+                with self._lock:
+                    self._flushing = {}
+
+    def close(self) -> None:
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=10)
+        self.flush()
+        self.tier.close()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            now = time.time()
+            if now - self._last_purge >= self.purge_interval:
+                self._last_purge = now
+                try:
+                    self.tier.purge_expired(now)
+                except Exception as e:
+                    logger.error(f"Error purgando el segundo nivel de caché: {e}")
+
+
+def create_redis_tier(url: str, prefix: str = "ndk:", flush_interval: float = 0.5) -> WriteBehindTier:
+    """
+    Crea el segundo nivel compartido en Redis con escritura diferida.
+
+    Args:
+        url (str): URL del servidor, p. ej. 'redis://localhost:6379/0'.
+        prefix (str): Prefijo de las claves para no pisar otros datos del servidor.
+        flush_interval (float): Segundos entre volcados.
+
+    Returns:
+        WriteBehindTier: El nivel listo para `cache.attach_tier`.
+    """
+    return WriteBehindTier(RedisCacheTier(url, prefix), flush_interval=flush_interval)
+
+
+def create_configured_tier():
+    """
+    Crea el segundo nivel según la configuración de entorno de `utils.cache`.
+
+    `CACHE_BACKEND=redis` usa `CACHE_REDIS_URL`; en otro caso, si hay `CACHE_DISK_PATH`
+    se usa SQLite en disco. Por defecto la caché se queda solo en memoria del proceso.
+
+    Returns:
+        WriteBehindTier | None: El nivel configurado o None si no hay ninguno.
+    """
+    from utils.cache import CACHE_BACKEND, CACHE_DISK_PATH, CACHE_REDIS_PREFIX, CACHE_REDIS_URL
+
+    if CACHE_BACKEND == "redis":
+        if not CACHE_REDIS_URL:
+            logger.warning("CACHE_BACKEND=redis pero no hay CACHE_REDIS_URL. La caché se queda en memoria.")
+            return None
+        logger.info("Caché compartida en Redis activada.")
+        return create_redis_tier(CACHE_REDIS_URL, CACHE_REDIS_PREFIX)
+
+    if CACHE_DISK_PATH:
+        logger.info(f"Caché persistente en disco activada en: {CACHE_DISK_PATH}")
+        return create_disk_tier(CACHE_DISK_PATH)
+
+    return None
+
+
+def create_disk_tier(path: str, flush_interval: float = 2.0) -> WriteBehindTier:
+    """
+    Crea el segundo nivel en disco con escritura diferida.
+
+    Args:
+        path (str): Ruta del fichero SQLite.
+        flush_interval (float, optional): Segundos entre volcados.
+
+    Returns:
+        WriteBehindTier: El nivel listo para `cache.attach_tier`.
+    """
+    return WriteBehindTier(SQLiteCacheTier(path), flush_interval=flush_interval)
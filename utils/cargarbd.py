@@ -1,5 +1,4 @@
 import os
-import io
 import re
 import json
 import base64
@@ -7,17 +6,24 @@ import zipfile
 import shutil
 import hashlib
 import sqlite3
+import tempfile
 import requests
 import xml.etree.ElementTree as ET
 from urllib import parse
 from threading import Lock
-from utils.bd import add_flag
+try:
+    import fcntl
+except ImportError:  # Windows: un único proceso en desarrollo, no hace falta cerrojo entre procesos
+    fcntl = None
+from utils.bd import add_flag, DB_LAZY_DECRYPT
 from utils.crypt import decryptbd
+from utils.actualizarbd import cabeceras_condicionales, datos_guardados, guardar_validadores
 from utils.logger import setup_logger
 
 from config import (
     DB_ENCRYPTED_PATH,
     DB_DECRYPTED_PATH,
+    DB_LOAD_LOCK_PATH,
     VERSION_FILE,
     DB_PATH_PREFIX,
     REPO_URL,
@@ -31,6 +37,41 @@ BASE_DIR = DB_PATH_PREFIX
 REPO_DIR = os.path.join(BASE_DIR, REPO_NAME)
 VERSION_FILE = os.path.join(REPO_DIR, 'version.txt')
 db_lock = Lock()
+# Las descargas se escriben a disco por bloques: la memoria no crece con el tamaño del archivo
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Consulta del feed de commits del contenido en el fichero de validadores de utils.actualizarbd
+FEED_VALIDATORS_KEY = "BD"
+# Filas (tipo, tmdb, temporada, episodio) que tocaron los .up de la última comprobación;
+# None si cambió la BD entera (.zm3) o algún parche no se pudo seguir
+LAST_CHANGES = set()
+# BD preparada por este proceso en la última comprobación y aún no publicada
+STAGED_DB_PATH = None
+_load_lock_file = None
+
+# Triggers temporales que anotan qué títulos toca un parche .up mientras se ejecuta
+_CHANGE_TRIGGER_TABLES = {
+    "enlaces_pelis": ("movie", "NULL", "NULL"),
+    "enlaces_series": ("series", "{row}.temporada", "{row}.episodio"),
+}
+
+def _spool_file():
+    """Fichero temporal en el directorio de trabajo (no en /tmp, que puede estar en RAM)."""
+    return tempfile.TemporaryFile(dir=BASE_DIR or None)
+
+def _download_to(url, target):
+    """
+    Descarga `url` en el fichero abierto `target` por bloques de DOWNLOAD_CHUNK_SIZE.
+
+    Returns:
+        int: Bytes descargados.
+    """
+    written = 0
+    with requests.get(url, timeout=120, stream=True) as resp:
+        resp.raise_for_status()
+        for chunk in resp.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            target.write(chunk)
+            written += len(chunk)
+    return written
 
 def clone_or_update_repo():
     """
@@ -38,11 +79,13 @@ def clone_or_update_repo():
     """
     zip_url = REPO_URL.replace('.git', '/archive/refs/heads/main.zip')
     logger.update("Descargando ZIP del repositorio...")
-    resp = requests.get(zip_url, timeout=120)
-    resp.raise_for_status()
-    with zipfile.ZipFile(io.BytesIO(resp.content), 'r') as z:
-        z.extractall(BASE_DIR)
-    logger.update(f"Repositorio descomprimido en '{REPO_DIR}'")
+    os.makedirs(BASE_DIR or '.', exist_ok=True)
+    with _spool_file() as archive:
+        size = _download_to(zip_url, archive)
+        archive.seek(0)
+        with zipfile.ZipFile(archive, 'r') as z:
+            z.extractall(BASE_DIR)
+    logger.update(f"Repositorio descomprimido en '{REPO_DIR}' ({size / (1024 * 1024):.1f} MB)")
 
 def download_and_process_file(url_or_path):
     """
@@ -55,20 +98,21 @@ def download_and_process_file(url_or_path):
     Returns:
         bool: True si el procesamiento fue exitoso, False en caso contrario.
     """
-    if os.path.isfile(url_or_path):
-        with open(url_or_path, 'rb') as f:
-            content = f.read()
-    else:
-        response = requests.get(url_or_path, timeout=120)
-        response.raise_for_status()
-        content = response.content
-
     zip_header_b64 = os.getenv('ZIP_DECODE_BASE64')
-    decoded_data = base64.b64decode(zip_header_b64) + content
-    
-    with zipfile.ZipFile(io.BytesIO(decoded_data), 'r') as zfile:
-        zfile.extractall(REPO_DIR)
-        logger.update(f"Archivos extraídos en: {os.path.abspath(REPO_DIR)}")
+
+    # La cabecera y el contenido se juntan en disco, sin cargar el archivo entero en memoria
+    with _spool_file() as archive:
+        archive.write(base64.b64decode(zip_header_b64))
+        if os.path.isfile(url_or_path):
+            with open(url_or_path, 'rb') as f:
+                shutil.copyfileobj(f, archive, DOWNLOAD_CHUNK_SIZE)
+        else:
+            _download_to(url_or_path, archive)
+        archive.seek(0)
+
+        with zipfile.ZipFile(archive, 'r') as zfile:
+            zfile.extractall(REPO_DIR)
+            logger.update(f"Archivos extraídos en: {os.path.abspath(REPO_DIR)}")
         
     old_file = os.path.join(REPO_DIR, 'settings.xml')
     new_file = os.path.join(REPO_DIR, '92b33381-pl3-42a1-bee0-bbb9d132e83f.tmp')
@@ -133,6 +177,54 @@ def p3b64decode_exacto(encoded_text):
     
     return base64.b64decode(final_to_decode)
 
+def _track_changes(conn):
+    """
+    Crea en la conexión los triggers temporales que anotan en 'temp.cambios' las filas de
+    enlaces que se insertan, reemplazan, actualizan o borran.
+    """
+    # Sin recursive_triggers, INSERT OR REPLACE borra la fila reemplazada sin disparar DELETE
+    # y se perdería el título del que salía el enlace
+    conn.execute("PRAGMA recursive_triggers=ON")
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS cambios (tipo TEXT, tmdb TEXT, temporada TEXT, episodio TEXT)")
+    for table, (media_type, season, episode) in _CHANGE_TRIGGER_TABLES.items():
+        for event, rows in (("INSERT", ("NEW",)), ("UPDATE", ("OLD", "NEW")), ("DELETE", ("OLD",))):
+            inserts = " ".join(
+                f"INSERT INTO cambios VALUES ('{media_type}', {row}.tmdb, "
+                f"{season.format(row=row)}, {episode.format(row=row)});"
+                for row in rows
+            )
+            conn.execute(
+                f"CREATE TEMP TRIGGER IF NOT EXISTS cambios_{table}_{event.lower()} "
+                f"AFTER {event} ON main.{table} BEGIN {inserts} END"
+            )
+
+def _tracked_changes(conn):
+    """
+    Devuelve las filas anotadas por `_track_changes`, o None si el parche se saltó los triggers
+    (p. ej. porque recreó las tablas) y no se sabe qué cambió.
+    """
+    triggers = conn.execute("SELECT COUNT(*) FROM sqlite_temp_master WHERE type = 'trigger'").fetchone()[0]
+    if triggers != 3 * len(_CHANGE_TRIGGER_TABLES):
+        return None
+    return {
+        (media_type, str(tmdb), None if season is None else str(season), None if episode is None else str(episode))
+        for media_type, tmdb, season, episode in conn.execute("SELECT DISTINCT * FROM cambios")
+    }
+
+def _record_changes(changes):
+    global LAST_CHANGES
+    if changes is None or LAST_CHANGES is None:
+        LAST_CHANGES = None
+    else:
+        LAST_CHANGES |= changes
+
+def last_changes():
+    """
+    Devuelve lo que cambió en la última comprobación: las filas (tipo, tmdb, temporada, episodio)
+    tocadas por los .up, o None si hay que dar por cambiada toda la BD.
+    """
+    return LAST_CHANGES
+
 def process_up_file(url_or_path):
     """
     Procesa un archivo '.up', decodificándolo, modificando su contenido SQL
@@ -164,14 +256,26 @@ def process_up_file(url_or_path):
     db_file = os.path.join(REPO_DIR, '92b33381-pl3-42a1-bee0-bbb9d132e83f.tmp')
     
     with db_lock:
+        conn = None
         try:
             conn = sqlite3.connect(db_file)
+            try:
+                _track_changes(conn)
+            except sqlite3.Error as e:
+                logger.warning(f"No se pueden seguir los cambios de '{url_or_path}': {e}")
             conn.executescript(final_sql_script)
             conn.commit()
-            logger.update(f"Archivo .up procesado e insertado: {url_or_path}")
+            changes = _tracked_changes(conn)
+            _record_changes(changes)
+            logger.update(
+                f"Archivo .up procesado e insertado: {url_or_path} "
+                f"({'cambios no localizados' if changes is None else f'{len(changes)} títulos/episodios tocados'})"
+            )
             return True
         except sqlite3.Error as e:
             logger.error(f"Error de base de datos al procesar .up: {e}", exc_info=True)
+            # Las sentencias anteriores al error ya se aplicaron: no se sabe qué títulos cambiaron
+            _record_changes(None)
             return False
         finally:
             if conn:
@@ -194,15 +298,115 @@ def compute_hash(path, chunk_size=8192):
             h.update(chunk)
     return h.hexdigest()
 
+def content_fingerprint():
+    """
+    Identifica el contenido que se va a servir, igual en todos los workers que cargan el mismo:
+    el commit registrado en version.txt y el hash de la BD cifrada de la que se prepara.
+
+    Returns:
+        dict: {'commit': str | None, 'sha256': str | None}
+    """
+    commit = None
+    try:
+        with open(VERSION_FILE, 'r') as f:
+            commit = json.load(f).get("last_commit")
+    except (OSError, json.JSONDecodeError):
+        pass
+    sha256 = compute_hash(DB_ENCRYPTED_PATH) if os.path.exists(DB_ENCRYPTED_PATH) else None
+    return {"commit": commit, "sha256": sha256}
+
+def acquire_db_load_lock():
+    """
+    Bloquea hasta obtener el cerrojo de carga de la BD, compartido por todos los procesos.
+
+    Entre la comprobación del repositorio y la publicación de la nueva BD solo trabaja un
+    worker a la vez; los demás esperan y después encuentran el trabajo ya hecho.
+    """
+    global _load_lock_file
+    directory = os.path.dirname(DB_LOAD_LOCK_PATH)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    lock_file = open(DB_LOAD_LOCK_PATH, 'a')
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+    _load_lock_file = lock_file
+
+def release_db_load_lock():
+    """Libera el cerrojo obtenido con `acquire_db_load_lock`."""
+    global _load_lock_file
+    lock_file, _load_lock_file = _load_lock_file, None
+    if lock_file is None:
+        return
+    if fcntl is not None:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+    lock_file.close()
+
+def staged_db_path():
+    """Devuelve la BD preparada por este proceso pendiente de publicar, o None."""
+    if STAGED_DB_PATH is not None and os.path.exists(STAGED_DB_PATH):
+        return STAGED_DB_PATH
+    return None
+
+def discard_staged_db():
+    """Elimina la BD que este proceso dejó a medio preparar o sin publicar en una carga anterior."""
+    global STAGED_DB_PATH
+    staged, STAGED_DB_PATH = STAGED_DB_PATH, None
+    if staged is None:
+        return
+    for path in (staged, staged + "-journal", staged + "-wal", staged + "-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+
+def stage_decrypted_db():
+    """
+    Copia la BD cifrada a un fichero nuevo junto a la BD servida y la descifra allí, sin tocar la
+    BD que se está sirviendo. Con DB_LAZY_DECRYPT solo se copia: los enlaces se descifran al
+    devolverlos las búsquedas.
+
+    Returns:
+        str: Ruta de la BD preparada, que el cargador indexa y publica.
+    """
+    global STAGED_DB_PATH
+    discard_staged_db()
+    fd, path = tempfile.mkstemp(dir=os.path.dirname(DB_DECRYPTED_PATH) or None, prefix="bd.next.", suffix=".tmp")
+    os.close(fd)
+    STAGED_DB_PATH = path
+    shutil.copy(DB_ENCRYPTED_PATH, path)
+    if not DB_LAZY_DECRYPT:
+        decryptbd(path)
+    return path
+
+def _recorded_files_intact(version_data):
+    """
+    Comprueba que los .zm3/.up del último commit procesado siguen en disco con el tamaño y el
+    hash registrados, y que la BD cifrada que generaron existe.
+    """
+    sizes = version_data.get("sizes") or {}
+    if not sizes or not os.path.exists(DB_ENCRYPTED_PATH):
+        return False
+    for fname, size in sizes.items():
+        path = os.path.join(REPO_DIR, fname)
+        if not os.path.isfile(path) or os.path.getsize(path) != size:
+            return False
+        if compute_hash(path) != version_data.get(fname):
+            return False
+    return True
+
 def check_and_download():
     """
     Verifica si hay nuevos commits en el repositorio de GitHub. Si los hay,
     descarga los cambios y procesa los archivos '.zm3' y '.up' que han sido modificados,
     asegurando procesar primero todos los '.zm3' y luego los '.up'.
 
+    La BD descifrada no se modifica: si hay que regenerarla, queda preparada en un fichero aparte
+    (ver `staged_db_path`) para que el cargador la indexe y la publique.
+
     Returns:
         bool: True si se realizaron actualizaciones, False en caso contrario.
     """
+    global LAST_CHANGES
+    discard_staged_db()
+    LAST_CHANGES = set()
     version_data = {}
     if os.path.exists(VERSION_FILE):
         with open(VERSION_FILE, 'r') as f:
@@ -214,20 +418,32 @@ def check_and_download():
     logger.update(f"Archivo de control de updates: {os.path.abspath(VERSION_FILE)}")
     logger.update(f"Commit local registrado: {version_data.get('last_commit')}")
 
-    resp = requests.get(REPO_URL_ATOM, timeout=30)
-    resp.raise_for_status()
-    root = ET.fromstring(resp.text)
-    
-    entry = root.find('{http://www.w3.org/2005/Atom}entry')
-    if entry is None or entry.find('{http://www.w3.org/2005/Atom}id') is None:
-        logger.error("No se encontró ID de commit en el feed.")
-        return False
+    resp = requests.get(REPO_URL_ATOM, timeout=30, headers=cabeceras_condicionales(FEED_VALIDATORS_KEY))
+    if resp.status_code == 304:
+        # Feed sin cambios desde la última consulta: el commit es el que se guardó entonces
+        commit_sha = datos_guardados(FEED_VALIDATORS_KEY)["commit"]
+    else:
+        resp.raise_for_status()
+        root = ET.fromstring(resp.text)
 
-    commit_id = entry.find('{http://www.w3.org/2005/Atom}id').text
-    commit_sha = commit_id.split('/')[-1]
+        entry = root.find('{http://www.w3.org/2005/Atom}entry')
+        if entry is None or entry.find('{http://www.w3.org/2005/Atom}id') is None:
+            logger.error("No se encontró ID de commit en el feed.")
+            return False
+
+        commit_id = entry.find('{http://www.w3.org/2005/Atom}id').text
+        commit_sha = commit_id.split('/')[-1]
+        guardar_validadores(FEED_VALIDATORS_KEY, resp.headers, {"commit": commit_sha})
     logger.update(f"Commit remoto detectado: {commit_sha}")
 
     same_commit = commit_sha == version_data.get("last_commit")
+    if same_commit and _recorded_files_intact(version_data):
+        # Ni el commit ni los archivos locales han cambiado: no hace falta descargar ni extraer nada
+        logger.update("El commit remoto ya estaba registrado y los archivos locales están intactos.")
+        if not os.path.exists(DB_DECRYPTED_PATH):
+            logger.update("Preparando la base de datos en una copia aparte...")
+            stage_decrypted_db()
+        return False
     if same_commit:
         logger.update("El commit remoto ya estaba registrado. Se revisarán hashes de archivos igualmente.")
 
@@ -269,13 +485,10 @@ def check_and_download():
             if download_and_process_file(path):
                 version_data[fname] = current_hash
                 updated = True
+                # Una BD completa nueva: no hay forma de saber qué títulos cambiaron
+                _record_changes(None)
                 logger.update("Base de datos descargada.")
-                logger.update("Descifrando base de datos...")
                 add_flag(DB_ENCRYPTED_PATH)
-                if not up_files:
-                    shutil.copy(DB_ENCRYPTED_PATH, DB_DECRYPTED_PATH)
-                    decryptbd(DB_DECRYPTED_PATH)
-                logger.update("Base de datos descifrada.")
             else:
                 processing_failed = True
                 logger.error(f"No se pudo procesar .zm3: {fname}")
@@ -302,15 +515,20 @@ def check_and_download():
         else:
             logger.update(f"Sin cambios en {fname}")
 
-    if up_files:
-        shutil.copy(DB_ENCRYPTED_PATH, DB_DECRYPTED_PATH)
-        decryptbd(DB_DECRYPTED_PATH)
+    if os.path.exists(DB_ENCRYPTED_PATH) and (updated or not os.path.exists(DB_DECRYPTED_PATH)):
+        logger.update("Preparando la base de datos en una copia aparte...")
+        stage_decrypted_db()
+        logger.update("Base de datos preparada.")
     if processing_failed:
         logger.warning(
             f"No se marca el commit {commit_sha} como completado porque hubo errores procesando archivos."
         )
     else:
         version_data["last_commit"] = commit_sha
+        # Tamaños de los archivos ya procesados, para el arranque rápido con el mismo commit
+        version_data["sizes"] = {
+            fname: os.path.getsize(os.path.join(REPO_DIR, fname)) for fname in zm3_files + up_files
+        }
         if not updated and same_commit:
             logger.update("No hay archivos nuevos o modificados que procesar.")
     with open(VERSION_FILE, 'w') as f:
@@ -1,6 +1,8 @@
 import os
 import sqlite3
 import base64
+import functools
+import threading
 from Crypto.Cipher import AES
 
 # Cargar la cadena Base64 desde las variables de entorno
@@ -11,6 +13,42 @@ DECODED_KEY = base64.b64decode(ENCRYPTION_KEY_B64)
 iv = DECODED_KEY[:16]
 key = DECODED_KEY[16:]
 
+# Todos los enlaces usan la misma clave e IV, así que en modo OFB comparten el mismo flujo de
+# clave: se genera una vez y cada enlace se descifra con un XOR contra su prefijo
+_KEYSTREAM = b""
+_KEYSTREAM_LOCK = threading.Lock()
+# Enlaces descifrados que se conservan cuando la BD se sirve cifrada (ver DB_LAZY_DECRYPT en utils.bd)
+LAZY_DECRYPT_CACHE_SIZE = int(os.getenv("LAZY_DECRYPT_CACHE_SIZE", "50000"))
+ENCRYPTED_LINK_PREFIX = "btof"
+
+
+def _keystream(length):
+    """
+    Devuelve al menos `length` bytes del flujo de clave OFB, ampliándolo si hace falta.
+
+    Args:
+        length (int): Bytes necesarios.
+
+    Returns:
+        bytes: El flujo de clave (puede ser más largo que `length`).
+    """
+    global _KEYSTREAM
+    keystream = _KEYSTREAM
+    if len(keystream) >= length:
+        return keystream
+    with _KEYSTREAM_LOCK:
+        if len(_KEYSTREAM) < length:
+            # Cifrar ceros en OFB devuelve el flujo de clave tal cual
+            _KEYSTREAM = AES.new(key, AES.MODE_OFB, iv).encrypt(bytes(max(length, 2 * len(_KEYSTREAM))))
+        return _KEYSTREAM
+
+
+def _xor_keystream(data):
+    length = len(data)
+    keystream = _keystream(length)
+    return (int.from_bytes(data, 'big') ^ int.from_bytes(keystream[:length], 'big')).to_bytes(length, 'big')
+
+
 def decrypt_link(encrypted_link):
     """
     Descifra un enlace cifrado con AES en modo OFB.
@@ -22,14 +60,41 @@ def decrypt_link(encrypted_link):
         str: El enlace descifrado en formato UTF-8.
     """
     encrypted_data = base64.urlsafe_b64decode(encrypted_link)
-    cipher = AES.new(key, AES.MODE_OFB, iv)
-    decrypted_bytes = cipher.decrypt(encrypted_data)
-    return decrypted_bytes.decode('utf-8')
+    return _xor_keystream(encrypted_data).decode('utf-8')
+
+@functools.lru_cache(maxsize=LAZY_DECRYPT_CACHE_SIZE)
+def decrypt_link_cached(encrypted_link):
+    """Como `decrypt_link`, con los últimos enlaces descifrados en un LRU acotado."""
+    return decrypt_link(encrypted_link)
+
+
+def encrypt_link(link):
+    """
+    Cifra un enlace igual que los guardados en la BD, para buscarlo en una BD servida cifrada.
+
+    Args:
+        link (str): El enlace en claro.
+
+    Returns:
+        str: El enlace cifrado y codificado en URL-safe Base64.
+    """
+    return base64.urlsafe_b64encode(_xor_keystream(link.encode('utf-8'))).decode('ascii')
+
+
+def reveal_link(link):
+    """Devuelve el enlace en claro, descifrándolo solo si sigue cifrado en la BD."""
+    if link.startswith(ENCRYPTED_LINK_PREFIX):
+        return decrypt_link_cached(link)
+    return link
+
 
 def decryptbd(db_path):
     """
     Descifra los enlaces en las tablas de la base de datos especificada.
 
+    Genera el flujo de clave una sola vez para el enlace más largo y escribe todos los enlaces
+    descifrados con `executemany` en una única transacción.
+
     Args:
         db_path (str): La ruta al archivo de la base de datos SQLite.
     """
@@ -38,13 +103,17 @@ def decryptbd(db_path):
 
     try:
         for table in ['enlaces_pelis', 'enlaces_series']:
-            cursor.execute(f"SELECT rowid, link FROM {table} WHERE link LIKE 'btof%'")
-            rows = cursor.fetchall()
-            
-            for rowid, link in rows:
-                decrypted_link = decrypt_link(link)
-                cursor.execute(f"UPDATE {table} SET link = ? WHERE rowid = ?", (decrypted_link, rowid))
-        
+            longest = cursor.execute(f"SELECT MAX(LENGTH(link)) FROM {table} WHERE link LIKE 'btof%'").fetchone()[0]
+            if not longest:
+                continue
+            # Base64 ocupa 4 caracteres por cada 3 bytes
+            _keystream(longest * 3 // 4 + 3)
+            rows = cursor.execute(f"SELECT rowid, link FROM {table} WHERE link LIKE 'btof%'").fetchall()
+            cursor.executemany(
+                f"UPDATE {table} SET link = ? WHERE rowid = ?",
+                [(decrypt_link(link), rowid) for rowid, link in rows],
+            )
+
         conn.commit()
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
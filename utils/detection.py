@@ -2,7 +2,6 @@ import re
 from models.movie import Movie
 from models.series import Series
 from utils.logger import setup_logger
-from utils.bd import getMetadata
 
 logger = setup_logger(__name__)
 
@@ -122,7 +121,8 @@ def post_process_results(link, media, debrid_service, url, result=None):
     result['media'] = media
     result['debrid_service'] = debrid_service
     result['playback'] = url
-    result['filename'] = result.get('metadata_filename') or getMetadata(link, media.type)
+    # Los metadatos de la BD llegan ya con la búsqueda; aquí no se consulta la BD para no bloquear el bucle
+    result['filename'] = result.get('metadata_filename') or result.get('nombre_fichero') or ''
     
     # Detectar y asignar idiomas, calidad y especificaciones si no existen
     result['languages'] = detect_languages(result['filename']) if 'languages' not in result else result['languages']
@@ -5,6 +5,7 @@ from utils.cache import cache
 from utils.string_encoding import decodeb64
 
 PARSED_CONFIG_TTL = 60 * 60
+cache.namespace("config:parsed:", ttl=PARSED_CONFIG_TTL, max_entries=10000, priority=2)
 
 
 def parse_config(b64config):